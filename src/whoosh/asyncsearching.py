@@ -0,0 +1,275 @@
+# Copyright 2012 Matt Chaput. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY MATT CHAPUT ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL MATT CHAPUT OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Matt Chaput.
+
+
+"""This module contains an asyncio wrapper for
+:class:`whoosh.searching.Searcher`, for searching from inside an event loop
+(for example, in an asyncio web server) without blocking the loop::
+
+    from whoosh.asyncsearching import AsyncSearcher
+
+    asearcher = AsyncSearcher(myindex.searcher(), timelimit=2.0)
+
+    async def handle(request):
+        results = await asearcher.search(myquery, limit=10)
+        ...
+
+This module requires Python 3.7 or later.
+"""
+
+import asyncio
+import copy
+from threading import Lock
+
+from whoosh.collectors import TimeLimitCollector
+from whoosh.searching import Results, ResultsPage
+
+
+def _copy_result(result):
+    # Returns a copy of a search result for one of the callers sharing a
+    # flight, so one caller changing its results (for example, with
+    # Results.filter()) doesn't change the results of the others
+    if isinstance(result, Results):
+        return result._copy()
+    if isinstance(result, ResultsPage):
+        page = copy.copy(result)
+        page.results = result.results._copy()
+        return page
+    return result
+
+
+class _Flight(object):
+    # A search running in the executor, shared by all the callers that asked
+    # for the same search while it was running
+
+    def __init__(self, flights=None, key=None):
+        # The dictionary of running flights this flight is registered in
+        self.flights = flights
+        self.key = key
+        self.future = None
+        self.collector = None
+        self.waiters = 0
+        self.cancelled = False
+
+    def forget(self, *args):
+        # Removes this flight from the dictionary of running flights, so later
+        # callers start a new search instead of joining this one
+        flights = self.flights
+        if flights is not None and flights.get(self.key) is self:
+            del flights[self.key]
+
+    def set_collector(self, collector):
+        # Called in the executor thread before the search starts
+        self.collector = collector
+        if self.cancelled:
+            collector.stop()
+
+    def cancel(self):
+        # Called in the event loop thread when every caller waiting for this
+        # search was cancelled
+        self.cancelled = True
+        self.forget()
+        if self.collector is not None:
+            self.collector.stop()
+        # If the search hasn't started yet, this keeps it from running
+        self.future.cancel()
+
+
+class AsyncSearcher(object):
+    """Wraps a :class:`whoosh.searching.Searcher` and runs searches in an
+    executor, so awaiting them doesn't block the event loop.
+
+    The methods of this object return asyncio futures. If identical searches
+    (the same query and keyword arguments) are requested while one of them is
+    still running, they share the running search instead of starting another
+    one ("single-flight"). Searches are identical if they would have the same
+    key in a :class:`whoosh.searching.ResultCache`; searches that can't be
+    cached are never shared.
+
+    Cancelling the future returned by :meth:`AsyncSearcher.search` (for
+    example, because the client disconnected or ``asyncio.wait_for`` timed
+    out) stops the search using a
+    :class:`whoosh.collectors.TimeLimitCollector` once all the callers sharing
+    it are cancelled.
+
+    A searcher can't be used by several threads at once (its readers share
+    file positions and caches), so the calls this object runs in the executor
+    use the wrapped searcher one at a time, holding a lock. The event loop is
+    still free while a search runs. Reading from the returned results (for
+    example, a hit's stored fields) also uses the wrapped searcher, so to
+    avoid doing that in the event loop thread while a search is running, use
+    :meth:`AsyncSearcher.stored_fields_many` to load the stored fields of the
+    hits you need. To run searches in parallel, use one ``AsyncSearcher`` (and
+    one searcher) for each worker.
+
+    The methods of this object must be called in a running event loop.
+    """
+
+    def __init__(self, searcher, executor=None, timelimit=None,
+                 singleflight=True):
+        """
+        :param searcher: the :class:`whoosh.searching.Searcher` to wrap.
+        :param executor: the ``concurrent.futures.Executor`` to run searches
+            in. The default (None) uses the event loop's default executor.
+        :param timelimit: if not None, searches that take longer than this
+            many seconds raise :class:`whoosh.searching.TimeLimit`.
+        :param singleflight: if True, identical concurrent searches share one
+            running search.
+        """
+
+        self.searcher = searcher
+        self.executor = executor
+        self.timelimit = timelimit
+        self.singleflight = singleflight
+        self._flights = {}
+        # Only one executor thread at a time may use the searcher
+        self._lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes the wrapped searcher.
+        """
+
+        self.searcher.close()
+
+    def _submit(self, key, fn, *args):
+        # Runs fn(flight, *args) in the executor, or joins the flight already
+        # running with the same key, and returns a future for the result
+        loop = asyncio.get_running_loop()
+        flights = self._flights
+        flight = None
+        if key is not None:
+            flight = flights.get(key)
+
+        if flight is None:
+            if key is None:
+                flight = _Flight()
+            else:
+                flight = _Flight(flights, key)
+            flight.future = loop.run_in_executor(self.executor, fn, flight,
+                                                 *args)
+            if key is not None:
+                flights[key] = flight
+                flight.future.add_done_callback(flight.forget)
+
+        return self._waiter(loop, flight)
+
+    def _waiter(self, loop, flight):
+        # Returns a future for one caller waiting for a flight. Cancelling the
+        # future only cancels the flight if no other callers are waiting
+        flight.waiters += 1
+        waiter = loop.create_future()
+
+        def finished(f):
+            if waiter.done():
+                return
+            if f.cancelled():
+                waiter.cancel()
+            elif f.exception() is not None:
+                waiter.set_exception(f.exception())
+            elif flight.waiters > 1:
+                # Give each caller sharing the flight its own copy
+                waiter.set_result(_copy_result(f.result()))
+            else:
+                waiter.set_result(f.result())
+
+        def waiter_done(w):
+            if w.cancelled():
+                flight.waiters -= 1
+                if not flight.waiters and not flight.future.done():
+                    flight.cancel()
+
+        flight.future.add_done_callback(finished)
+        waiter.add_done_callback(waiter_done)
+        return waiter
+
+    def _key(self, method, q, kwargs):
+        if not self.singleflight:
+            return None
+        key = self.searcher._result_cache_key(q, kwargs)
+        if key is not None:
+            key = (method, key)
+        return key
+
+    def _search(self, flight, q, kwargs):
+        # Runs in the executor
+        searcher = self.searcher
+        c = TimeLimitCollector(searcher.collector(**kwargs), self.timelimit,
+                               use_alarm=False)
+        flight.set_collector(c)
+        with self._lock:
+            return searcher._search(q, kwargs, collector=c)
+
+    def search(self, q, **kwargs):
+        """Runs a :class:`whoosh.query.Query` object in the executor and
+        returns a future for the :class:`whoosh.searching.Results`. Takes the
+        same keyword arguments as :meth:`whoosh.searching.Searcher.search`.
+        """
+
+        return self._submit(self._key("search", q, kwargs), self._search, q,
+                            kwargs)
+
+    def _search_page(self, flight, q, pagenum, pagelen, kwargs):
+        results = self._search(flight, q, kwargs)
+        return ResultsPage(results, pagenum, pagelen)
+
+    def search_page(self, q, pagenum, pagelen=10, **kwargs):
+        """Returns a future for a :class:`whoosh.searching.ResultsPage` object
+        representing a page of results. See
+        :meth:`whoosh.searching.Searcher.search_page`.
+        """
+
+        if pagenum < 1:
+            raise ValueError("pagenum must be >= 1")
+
+        kwargs["limit"] = pagenum * pagelen
+        key = self._key("search", q, kwargs)
+        if key is not None:
+            key += (pagenum, pagelen)
+        return self._submit(key, self._search_page, q, pagenum, pagelen,
+                            kwargs)
+
+    def _stored_fields_many(self, flight, docnums, fieldnames):
+        with self._lock:
+            return self.searcher.stored_fields_many(docnums, fieldnames)
+
+    def stored_fields_many(self, docnums, fieldnames=None):
+        """Returns a future for a list of the stored fields of the given
+        documents. See :meth:`whoosh.searching.Searcher.stored_fields_many`.
+
+        :param docnums: a sequence of document numbers.
+        :param fieldnames: if not None, only the values of these fields are
+            returned.
+        """
+
+        return self._submit(None, self._stored_fields_many, list(docnums),
+                            fieldnames)
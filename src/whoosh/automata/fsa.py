@@ -0,0 +1,398 @@
+# Copyright 2012 Matt Chaput. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY MATT CHAPUT ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL MATT CHAPUT OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Matt Chaput.
+
+
+"""
+This module implements simple nondeterministic and deterministic finite state
+automata over unicode characters, used to intersect patterns (globs, regular
+expressions) with the sorted term dictionary of a field.
+
+Instead of testing every term in a field against a pattern, the
+:func:`find_all_matches` function uses :meth:`DFA.next_valid_string` to skip
+directly to the next term that could possibly be accepted by the automaton,
+so patterns such as ``*tion`` or ``a*b*c`` only read the parts of the term
+index that can contain matches.
+"""
+
+from bisect import bisect_right
+
+from whoosh.compat import iteritems, next, u, unichr
+
+
+# Special transition labels
+
+class _Label(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+EPSILON = _Label("EPSILON")
+ANY = _Label("ANY")
+
+# The largest possible character
+_MAXCHAR = 0x10FFFF
+
+
+class UnsupportedPattern(Exception):
+    """Raised when a pattern uses a feature that can't be converted into a
+    finite automaton (for example, back-references in a regular expression).
+    Code using the automata should fall back to testing terms one at a time.
+    """
+
+
+class NFA(object):
+    """A nondeterministic finite automaton. States are integers allocated by
+    :meth:`new_state`. Transitions are labeled with a single character,
+    :data:`EPSILON`, or :data:`ANY` (which can optionally exclude a set of
+    characters).
+    """
+
+    def __init__(self):
+        self.transitions = {}
+        self.anys = {}
+        self.finals = set()
+        self._count = 0
+        self.initial = self.new_state()
+
+    def __repr__(self):
+        return "<%s %d states>" % (self.__class__.__name__, self._count)
+
+    def new_state(self):
+        state = self._count
+        self._count += 1
+        return state
+
+    def add_transition(self, src, label, dest):
+        if label is ANY:
+            self.add_any(src, dest)
+        else:
+            labels = self.transitions.setdefault(src, {})
+            labels.setdefault(label, set()).add(dest)
+
+    def add_any(self, src, dest, exclude=frozenset()):
+        """Adds a transition from ``src`` to ``dest`` on any character except
+        the characters in ``exclude``.
+        """
+
+        self.anys.setdefault(src, []).append((frozenset(exclude), dest))
+
+    def add_final_state(self, state):
+        self.finals.add(state)
+
+    def epsilon_closure(self, states):
+        stack = list(states)
+        seen = set(stack)
+        transitions = self.transitions
+        while stack:
+            state = stack.pop()
+            if state in transitions:
+                for dest in transitions[state].get(EPSILON, ()):
+                    if dest not in seen:
+                        seen.add(dest)
+                        stack.append(dest)
+        return frozenset(seen)
+
+    def to_dfa(self, maxstates=10000):
+        """Returns a :class:`DFA` equivalent to this automaton using the
+        subset construction.
+
+        :param maxstates: raise :class:`UnsupportedPattern` if the
+            determinized automaton would need more than this many states.
+        """
+
+        transitions = self.transitions
+        anys = self.anys
+        finals = self.finals
+        closure = self.epsilon_closure
+
+        dfa = DFA()
+        start = closure([self.initial])
+        numbers = {start: dfa.initial}
+        stack = [start]
+        while stack:
+            current = stack.pop()
+            src = numbers[current]
+            if current & finals:
+                dfa.add_final_state(src)
+
+            # Gather the explicit characters leaving this set of states, and
+            # the "any" transitions with their exclusions
+            explicit = set()
+            anylist = []
+            for state in current:
+                if state in transitions:
+                    explicit.update(transitions[state])
+                if state in anys:
+                    for exclude, dest in anys[state]:
+                        explicit.update(exclude)
+                        anylist.append((exclude, dest))
+            explicit.discard(EPSILON)
+
+            targets = {}
+            for char in explicit:
+                dests = set()
+                for state in current:
+                    if state in transitions:
+                        dests.update(transitions[state].get(char, ()))
+                for exclude, dest in anylist:
+                    if char not in exclude:
+                        dests.add(dest)
+                # An empty target set is recorded too, since the explicit
+                # character must override the "any" transition
+                targets[char] = closure(dests) if dests else None
+            if anylist:
+                targets[ANY] = closure(dest for _, dest in anylist)
+
+            for label, target in iteritems(targets):
+                if target is None:
+                    dfa.add_transition(src, label, None)
+                    continue
+                if target not in numbers:
+                    if len(numbers) >= maxstates:
+                        raise UnsupportedPattern("Automaton is too large")
+                    numbers[target] = dfa.new_state()
+                    stack.append(target)
+                if label is ANY:
+                    dfa.set_default(src, numbers[target])
+                else:
+                    dfa.add_transition(src, label, numbers[target])
+
+        dfa.prune()
+        return dfa
+
+
+class DFA(object):
+    """A deterministic finite automaton over unicode characters. Each state
+    has a dictionary of explicit character transitions and an optional
+    "default" transition taken for any character not explicitly listed.
+    """
+
+    def __init__(self):
+        self.transitions = {}
+        self.defaults = {}
+        self.finals = set()
+        self._count = 0
+        self._labels = {}
+        self.initial = self.new_state()
+
+    def __repr__(self):
+        return "<%s %d states>" % (self.__class__.__name__, self._count)
+
+    def new_state(self):
+        state = self._count
+        self._count += 1
+        return state
+
+    def add_transition(self, src, label, dest):
+        self.transitions.setdefault(src, {})[label] = dest
+        self._labels.pop(src, None)
+
+    def set_default(self, src, dest):
+        self.defaults[src] = dest
+
+    def add_final_state(self, state):
+        self.finals.add(state)
+
+    def is_final(self, state):
+        return state in self.finals
+
+    def prune(self):
+        """Removes transitions leading to states from which no final state can
+        be reached, so that every transition left in the automaton leads to at
+        least one accepted string.
+        """
+
+        incoming = {}
+        for src, labels in iteritems(self.transitions):
+            for dest in labels.values():
+                incoming.setdefault(dest, set()).add(src)
+        for src, dest in iteritems(self.defaults):
+            incoming.setdefault(dest, set()).add(src)
+
+        live = set(self.finals)
+        stack = list(live)
+        while stack:
+            state = stack.pop()
+            for src in incoming.get(state, ()):
+                if src not in live:
+                    live.add(src)
+                    stack.append(src)
+
+        for src, labels in iteritems(self.transitions):
+            for label in [lb for lb, dest in iteritems(labels)
+                          if dest not in live]:
+                # Keep dead explicit labels as transitions to None, so they
+                # still override the default transition for that character
+                labels[label] = None
+        for src in [s for s, dest in iteritems(self.defaults)
+                    if dest not in live]:
+            del self.defaults[src]
+        self._labels = {}
+
+    def next_state(self, state, char):
+        labels = self.transitions.get(state)
+        if labels and char in labels:
+            return labels[char]
+        return self.defaults.get(state)
+
+    def accept(self, string):
+        """Returns True if this automaton accepts the given string.
+        """
+
+        state = self.initial
+        next_state = self.next_state
+        for char in string:
+            state = next_state(state, char)
+            if state is None:
+                return False
+        return state in self.finals
+
+    def _sorted_labels(self, state):
+        try:
+            return self._labels[state]
+        except KeyError:
+            labels = sorted(self.transitions.get(state, ()))
+            self._labels[state] = labels
+            return labels
+
+    def find_next_edge(self, state, char):
+        """Returns the smallest character greater than ``char`` (or the
+        smallest character at all, if ``char`` is None) that leads from
+        ``state`` to a state from which a final state is reachable, or None
+        if there is no such character.
+        """
+
+        labels = self._sorted_labels(state)
+        explicit = self.transitions.get(state, {})
+
+        # The smallest explicit label greater than char that's still live
+        i = 0 if char is None else bisect_right(labels, char)
+        best = None
+        while i < len(labels):
+            if explicit[labels[i]] is not None:
+                best = labels[i]
+                break
+            i += 1
+
+        # The smallest character greater than char that takes the default
+        # transition (that is, isn't explicitly listed)
+        if state in self.defaults:
+            code = 0 if char is None else ord(char) + 1
+            while code <= _MAXCHAR and unichr(code) in explicit:
+                code += 1
+            if code <= _MAXCHAR and (best is None or code < ord(best)):
+                best = unichr(code)
+
+        return best
+
+    def next_valid_string(self, string):
+        """Returns the smallest string greater than or equal to the given
+        string that could be accepted by this automaton, or None if there
+        are no such strings.
+
+        If the smallest such string is infinitely long (because the smallest
+        path through the automaton loops), this method instead returns a
+        prefix of it, which is still a valid lower bound for the next
+        accepted string.
+        """
+
+        state = self.initial
+        stack = []
+
+        # Follow the automaton as far as possible along the string
+        for i, char in enumerate(string):
+            stack.append((string[:i], state, char))
+            state = self.next_state(state, char)
+            if state is None:
+                break
+        else:
+            if state in self.finals:
+                return string
+            stack.append((string, state, None))
+
+        # Walk back up the stack until we find a place to branch off to a
+        # larger string
+        while stack:
+            path, state, char = stack.pop()
+            char = self.find_next_edge(state, char)
+            if char is not None:
+                return self._smallest_from(path + char,
+                                           self.next_state(state, char))
+        return None
+
+    def _smallest_from(self, path, state):
+        # Follow the smallest edges from state until we reach a final state
+        seen = set()
+        while state not in self.finals:
+            if state in seen:
+                # The smallest path loops, so return the prefix we've got
+                break
+            seen.add(state)
+            char = self.find_next_edge(state, None)
+            if char is None:
+                break
+            path += char
+            state = self.next_state(state, char)
+        return path
+
+
+def find_all_matches(dfa, keys_from, first=u("")):
+    """Yields the strings from a sorted key space accepted by the given
+    automaton, seeking past ranges of keys that can't possibly match.
+
+    :param dfa: a :class:`DFA` object.
+    :param keys_from: a function that takes a string and returns an iterator
+        of the keys greater than or equal to that string, in sorted order.
+    :param first: the string to start from.
+    """
+
+    target = dfa.next_valid_string(first)
+    if target is None:
+        return
+    keys = keys_from(target)
+    while True:
+        key = next(keys, None)
+        if key is None:
+            return
+
+        if key < target:
+            # The next key is still before the next possible match, so seek
+            # forward instead of scanning
+            keys = keys_from(target)
+            continue
+
+        if dfa.accept(key):
+            yield key
+            # Keep reading sequentially: the next key is usually closer than
+            # anything we could compute
+            target = key
+        else:
+            target = dfa.next_valid_string(key)
+            if target is None:
+                return
@@ -788,6 +788,10 @@ class Cursor(BaseCursor):
         current = stack[-1]
         if label == current.label:
             return True
+        elif current.lastarc or label < current.label:
+            # The arcs are sorted, and the ones after the last arc of this
+            # node belong to other nodes
+            return False
         else:
             arc = self.graph.find_arc(current.endpos, label, current)
             return arc
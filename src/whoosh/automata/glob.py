@@ -25,9 +25,10 @@
 # those of the authors and should not be interpreted as representing official
 # policies, either expressed or implied, of Matt Chaput.
 
-from whoosh.compat import b
+from whoosh.compat import b, unichr
 from whoosh.system import emptybytes
 from whoosh.automata.fst import to_labels, Arc
+from whoosh.automata.fsa import EPSILON, NFA, UnsupportedPattern
 
 
 # Implement glob matching on graph reader
@@ -245,6 +246,83 @@ def glob_vacuum_limit(mode, pattern):
     return emptybytes.join(output)
 
 
+# Convert a glob into a finite automaton
+
+def _glob_charset(spec, maxchars=256):
+    # Expands the inside of a [...] glob range into a set of characters
+    chars = set()
+    i = 0
+    while i < len(spec):
+        if i + 2 < len(spec) and spec[i + 1] == "-":
+            lo, hi = ord(spec[i]), ord(spec[i + 2])
+            if hi - lo >= maxchars:
+                raise UnsupportedPattern("Character range is too large")
+            chars.update(unichr(code) for code in range(lo, hi + 1))
+            i += 3
+        else:
+            chars.add(spec[i])
+            i += 1
+    return chars
+
+
+def glob_automaton(pattern):
+    """Returns a :class:`whoosh.automata.fsa.DFA` accepting the same strings
+    as the given unicode "glob" pattern would match using the ``fnmatch``
+    module: ``*`` matches any number of characters, ``?`` matches any single
+    character, ``[abc]`` and ``[a-z]`` match any of the listed characters,
+    and ``[!abc]`` matches any character not in the list.
+    """
+
+    nfa = NFA()
+    state = nfa.initial
+    i = 0
+    n = len(pattern)
+    while i < n:
+        char = pattern[i]
+        i += 1
+        if char == "*":
+            # (Consecutive stars are the same as one star)
+            while i < n and pattern[i] == "*":
+                i += 1
+            loop = nfa.new_state()
+            nfa.add_transition(state, EPSILON, loop)
+            nfa.add_any(loop, loop)
+            state = loop
+            continue
+
+        nextstate = nfa.new_state()
+        if char == "?":
+            nfa.add_any(state, nextstate)
+        elif char == "[":
+            # Find the end of the range (a ] right after the [ or [! is part
+            # of the range)
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+
+            if j >= n:
+                # No closing bracket, so the [ is a literal character
+                nfa.add_transition(state, "[", nextstate)
+            else:
+                spec = pattern[i:j]
+                i = j + 1
+                if spec.startswith("!"):
+                    nfa.add_any(state, nextstate, _glob_charset(spec[1:]))
+                else:
+                    for c in _glob_charset(spec):
+                        nfa.add_transition(state, c, nextstate)
+        else:
+            nfa.add_transition(state, char, nextstate)
+        state = nextstate
+
+    nfa.add_final_state(state)
+    return nfa.to_dfa()
+
+
 # if __name__ == "__main__":
 #     from whoosh import index, query
 #     from whoosh.filedb.filestore import RamStorage
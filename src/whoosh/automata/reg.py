@@ -0,0 +1,185 @@
+# Copyright 2012 Matt Chaput. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY MATT CHAPUT ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL MATT CHAPUT OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Matt Chaput.
+
+
+"""
+This module converts (a subset of) Python regular expressions into finite
+automata, using the standard library's regular expression parser.
+"""
+
+import sys
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+from whoosh.compat import unichr
+from whoosh.automata.fsa import EPSILON, NFA, UnsupportedPattern
+
+
+# The most copies of a subexpression we'll make to implement a bounded
+# repetition such as {2,5}
+MAX_REPEAT_COPIES = 64
+# The largest character range we'll expand into individual transitions
+MAX_RANGE_CHARS = 256
+
+_c = sre_constants
+_ALLOWED_FLAGS = getattr(_c, "SRE_FLAG_UNICODE", 0)
+_START_ANCHORS = (_c.AT_BEGINNING, _c.AT_BEGINNING_STRING)
+_END_ANCHORS = (_c.AT_END, _c.AT_END_STRING)
+
+
+def _charset(items):
+    # Converts the contents of an IN op into (negate, set_of_chars)
+    negate = False
+    chars = set()
+    for op, av in items:
+        if op is _c.NEGATE:
+            negate = True
+        elif op is _c.LITERAL:
+            chars.add(unichr(av))
+        elif op is _c.RANGE:
+            lo, hi = av
+            if hi - lo >= MAX_RANGE_CHARS:
+                raise UnsupportedPattern("Character range is too large")
+            chars.update(unichr(code) for code in range(lo, hi + 1))
+        else:
+            raise UnsupportedPattern("Can't convert %s in a set" % op)
+    return negate, chars
+
+
+def _build(nfa, items, state):
+    # Adds the given list of parsed regex items to the NFA starting at state,
+    # and returns the state at the end of the new sub-automaton
+    for op, av in items:
+        if op is _c.LITERAL:
+            nextstate = nfa.new_state()
+            nfa.add_transition(state, unichr(av), nextstate)
+            state = nextstate
+        elif op is _c.NOT_LITERAL:
+            nextstate = nfa.new_state()
+            nfa.add_any(state, nextstate, (unichr(av),))
+            state = nextstate
+        elif op is _c.ANY:
+            # Without the DOTALL flag (which we don't allow), a dot doesn't
+            # match a newline
+            nextstate = nfa.new_state()
+            nfa.add_any(state, nextstate, ("\n",))
+            state = nextstate
+        elif op is _c.IN:
+            negate, chars = _charset(av)
+            nextstate = nfa.new_state()
+            if negate:
+                nfa.add_any(state, nextstate, chars)
+            else:
+                for char in chars:
+                    nfa.add_transition(state, char, nextstate)
+            state = nextstate
+        elif op is _c.SUBPATTERN:
+            # Python 2 uses (group, subpattern), Python 3.6+ uses
+            # (group, add_flags, del_flags, subpattern)
+            if len(av) > 2 and (av[1] or av[2]):
+                raise UnsupportedPattern("Can't convert inline flags")
+            state = _build(nfa, av[-1], state)
+        elif op is _c.BRANCH:
+            endstate = nfa.new_state()
+            for alternative in av[1]:
+                start = nfa.new_state()
+                nfa.add_transition(state, EPSILON, start)
+                end = _build(nfa, alternative, start)
+                nfa.add_transition(end, EPSILON, endstate)
+            state = endstate
+        elif op is _c.MAX_REPEAT or op is _c.MIN_REPEAT:
+            # Greedy and non-greedy repeats accept the same set of strings
+            minimum, maximum, sub = av
+            unbounded = maximum == _c.MAXREPEAT
+            copies = minimum if unbounded else maximum
+            if copies > MAX_REPEAT_COPIES:
+                raise UnsupportedPattern("Repetition is too large")
+
+            for _ in range(minimum):
+                state = _build(nfa, sub, state)
+            if unbounded:
+                loop = nfa.new_state()
+                nfa.add_transition(state, EPSILON, loop)
+                end = _build(nfa, sub, loop)
+                nfa.add_transition(end, EPSILON, loop)
+                state = loop
+            else:
+                for _ in range(maximum - minimum):
+                    end = _build(nfa, sub, state)
+                    nextstate = nfa.new_state()
+                    nfa.add_transition(state, EPSILON, nextstate)
+                    nfa.add_transition(end, EPSILON, nextstate)
+                    state = nextstate
+        else:
+            raise UnsupportedPattern("Can't convert %s" % op)
+    return state
+
+
+def regex_automaton(pattern):
+    """Returns a :class:`whoosh.automata.fsa.DFA` accepting the strings for
+    which ``re.match(pattern, string)`` would succeed (that is, the pattern
+    is anchored at the start of the string but not at the end, unless it ends
+    with ``$`` or ``\\Z``).
+
+    Raises :class:`whoosh.automata.fsa.UnsupportedPattern` if the pattern uses
+    features that can't be represented by a finite automaton, such as
+    back-references, lookaround assertions, character categories (``\\w``),
+    or flags.
+    """
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        e = sys.exc_info()[1]
+        raise UnsupportedPattern(str(e))
+
+    if parsed.state.flags & ~_ALLOWED_FLAGS:
+        raise UnsupportedPattern("Can't convert regex flags")
+
+    items = list(parsed)
+    if items and items[0][0] is _c.AT and items[0][1] in _START_ANCHORS:
+        items = items[1:]
+    anchored = False
+    if items and items[-1][0] is _c.AT and items[-1][1] in _END_ANCHORS:
+        items = items[:-1]
+        anchored = True
+
+    nfa = NFA()
+    state = _build(nfa, items, nfa.initial)
+    if not anchored:
+        # re.match() only anchors at the start, so any suffix is allowed
+        loop = nfa.new_state()
+        nfa.add_transition(state, EPSILON, loop)
+        nfa.add_any(loop, loop)
+        state = loop
+    nfa.add_final_state(state)
+    return nfa.to_dfa()
@@ -333,6 +333,23 @@ class TermsReader(object):
     def indexed_field_names(self):
         raise NotImplementedError
 
+    def has_key_index(self, fieldname):
+        """Returns True if this reader can look up the document numbers of
+        terms in the given unique field with :meth:`TermsReader.key_docnums`.
+        """
+
+        return False
+
+    def key_docnums(self, fieldname, tbytes_list):
+        """Yields a ``(tbytes, docnums)`` tuple for each of the given terms
+        that's in the given unique field, where ``docnums`` is a sequence of
+        the numbers of the documents containing the term (including deleted
+        documents), or None if the caller should read the term's postings
+        instead.
+        """
+
+        raise NotImplementedError
+
     def close(self):
         pass
 
@@ -430,6 +447,18 @@ class PerDocumentReader(object):
     def stored_fields(self, docnum):
         raise NotImplementedError
 
+    def stored_field_values(self, docnum, fieldnames):
+        # Returns a dictionary of the stored values of the given fields. Codecs
+        # that can read stored fields separately should override this
+        sfs = self.stored_fields(docnum)
+        return dict((name, sfs[name]) for name in fieldnames if name in sfs)
+
+    def prefetch_stored_fields(self, docnums):
+        # Hints that the stored fields of the given (sorted) documents are
+        # about to be read. Codecs that can tell the storage where the
+        # documents are should override this
+        pass
+
     def all_stored_fields(self):
         # Must yield stored fields for deleted documents too
         for docnum in xrange(self.doc_count_all()):
@@ -488,6 +517,15 @@ class Segment(object):
             return False
         return self.compound
 
+    def sort_order(self):
+        """Returns a ``(fieldname, reverse)`` tuple if the documents in this
+        segment are in order of the values in the given field's column (see
+        the ``sortedby`` argument of :class:`whoosh.writing.SegmentWriter`),
+        or None.
+        """
+
+        return getattr(self, "sortedby", None)
+
     # File convenience methods
 
     def make_filename(self, ext):
@@ -524,10 +562,45 @@ class Segment(object):
             storage.delete_file(name)
         self.compound = True
 
-    def open_compound_file(self, storage):
+    def open_compound_file(self, storage, verify=True):
+        """Opens this segment's compound file as a storage object.
+
+        :param verify: if True, the first time the file is opened in this
+            process it is queued to be checked against its checksums in a
+            background thread (see ``CompoundStorage.verify_in_background()``
+            in :mod:`whoosh.filedb.compound`).
+        """
+
         name = self.make_filename(self.COMPOUND_EXT)
         dbfile = storage.open_file(name)
-        return CompoundStorage(dbfile, use_mmap=storage.supports_mmap)
+        cstore = CompoundStorage(dbfile, use_mmap=storage.supports_mmap)
+        if verify:
+            key = (getattr(storage, "folder", None) or id(storage), name)
+            cstore.verify_in_background(
+                key, lambda: self.open_compound_file(storage, verify=False))
+        return cstore
+
+    def verify(self, storage):
+        """Checks this segment's files against the checksums recorded when
+        they were written, and returns a list of the names of the files that
+        failed (including a compound file that couldn't be opened at all).
+        Only compound segments have checksums, so for other segments this
+        returns an empty list.
+        """
+
+        if not self.is_compound():
+            return []
+
+        name = self.make_filename(self.COMPOUND_EXT)
+        try:
+            cstore = self.open_compound_file(storage, verify=False)
+        except Exception:
+            # The directory at the end of the file is missing or unreadable
+            return [name]
+        try:
+            return cstore.verify()
+        finally:
+            cstore.close()
 
     # Abstract methods
 
@@ -588,6 +661,16 @@ class Segment(object):
 
         raise NotImplementedError
 
+    def deletion_generation(self):
+        """
+        Returns a value that changes when documents in this segment are
+        deleted or undeleted. Two versions of a segment (for example, from
+        different generations of the index) with the same segment ID and
+        deletion generation have the same deleted documents.
+        """
+
+        return self.deleted_count()
+
     def should_assemble(self):
         return True
 
@@ -628,8 +711,11 @@ class WrappingSegment(Segment):
     def create_compound_file(self, storage):
         return self._child.create_compound_file(storage)
 
-    def open_compound_file(self, storage):
-        return self._child.open_compound_file(storage)
+    def open_compound_file(self, storage, verify=True):
+        return self._child.open_compound_file(storage, verify=verify)
+
+    def verify(self, storage):
+        return self._child.verify(storage)
 
     def delete_document(self, docnum, delete=True):
         return self._child.delete_document(docnum, delete=delete)
@@ -646,6 +732,9 @@ class WrappingSegment(Segment):
     def is_deleted(self, docnum):
         return self._child.is_deleted(docnum)
 
+    def deletion_generation(self):
+        return self._child.deletion_generation()
+
     def set_doc_count(self, doccount):
         self._child.set_doc_count(doccount)
 
@@ -753,6 +842,100 @@ class MultiPerDocumentReader(PerDocumentReader):
         return max(r.max_field_length() for r in self._readers)
 
 
+# Per doc reader with different deletions
+
+class DeletionsPerDocReader(PerDocumentReader):
+    """Wraps a per-document reader for a segment, but answers questions about
+    deleted documents using a different (usually later) version of the same
+    segment. This lets a reader for a new generation of an index share the
+    open files of a segment whose only change is that more documents were
+    deleted.
+
+    Closing this object does not close the wrapped reader.
+    """
+
+    def __init__(self, child, segment):
+        """
+        :param child: the :class:`PerDocumentReader` to wrap.
+        :param segment: the :class:`Segment` to get deletions from.
+        """
+
+        self._child = child
+        self._segment = segment
+
+    def doc_count(self):
+        return self._segment.doc_count()
+
+    def doc_count_all(self):
+        return self._child.doc_count_all()
+
+    # Deletions
+
+    def has_deletions(self):
+        return self._segment.has_deletions()
+
+    def is_deleted(self, docnum):
+        return self._segment.is_deleted(docnum)
+
+    def deleted_docs(self):
+        return self._segment.deleted_docs()
+
+    # Columns
+
+    def supports_columns(self):
+        return self._child.supports_columns()
+
+    def has_column(self, fieldname):
+        return self._child.has_column(fieldname)
+
+    def list_columns(self):
+        return self._child.list_columns()
+
+    def column_reader(self, fieldname, column):
+        return self._child.column_reader(fieldname, column)
+
+    # Bitmaps
+
+    def field_docs(self, fieldname):
+        return self._child.field_docs(fieldname)
+
+    # Lengths
+
+    def doc_field_length(self, docnum, fieldname, default=0):
+        return self._child.doc_field_length(docnum, fieldname, default)
+
+    def field_length(self, fieldname):
+        return self._child.field_length(fieldname)
+
+    def min_field_length(self, fieldname):
+        return self._child.min_field_length(fieldname)
+
+    def max_field_length(self, fieldname):
+        return self._child.max_field_length(fieldname)
+
+    # Vectors
+
+    def has_vector(self, docnum, fieldname):
+        return self._child.has_vector(docnum, fieldname)
+
+    def vector(self, docnum, fieldname, format_):
+        return self._child.vector(docnum, fieldname, format_)
+
+    # Stored
+
+    def stored_fields(self, docnum):
+        return self._child.stored_fields(docnum)
+
+    def stored_field_values(self, docnum, fieldnames):
+        return self._child.stored_field_values(docnum, fieldnames)
+
+    def prefetch_stored_fields(self, docnums):
+        self._child.prefetch_stored_fields(docnums)
+
+    def all_stored_fields(self):
+        return self._child.all_stored_fields()
+
+
 # Extended base classes
 
 class PerDocWriterWithColumns(PerDocumentWriter):
@@ -1061,6 +1061,9 @@ class W2TermsReader(PostingIndexBase):
     def indexed_field_names(self):
         return self.fieldmap.keys()
 
+    def has_key_index(self, fieldname):
+        return False
+
     def terms(self):
         return self.keys()
 
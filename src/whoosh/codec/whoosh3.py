@@ -38,6 +38,7 @@ from whoosh.compat import b, bytes_type, string_type, integer_types
 from whoosh.compat import dumps, loads, iteritems, xrange
 from whoosh.codec import base
 from whoosh.filedb import compound, filetables
+from whoosh.filedb.structfile import WILLNEED
 from whoosh.matching import ListMatcher, ReadTooFar, LeafMatcher
 from whoosh.reading import TermInfo, TermNotFound
 from whoosh.system import emptybytes
@@ -63,8 +64,11 @@ LENGTHS_COLUMN = columns.NumericColumn("B", default=0)
 VECTOR_COLUMN = columns.NumericColumn("I")
 # Column type to store vector posting list lengths
 VECTOR_LEN_COLUMN = columns.NumericColumn("i")
-# Column type to store values of stored fields
+# Column type to store values of stored fields (segments written before the
+# STORED_FIELDS_COLUMN was added)
 STORED_COLUMN = columns.PickleColumn(columns.CompressedBytesColumn())
+# Column type to store values of stored fields so they can be read separately
+STORED_FIELDS_COLUMN = columns.StoredFieldsColumn()
 
 
 class W3Codec(base.CodecWithGraph):
@@ -73,11 +77,47 @@ class W3Codec(base.CodecWithGraph):
     POSTS_EXT = ".pst"  # Term postings
     VPOSTS_EXT = ".vps"  # Vector postings
     COLUMN_EXT = ".col"  # Per-document value columns
+    KEYS_EXT = ".key"  # Document numbers of the terms in unique fields
+
+    # Terms in unique fields that are in more documents than this (such as
+    # the lower-precision terms of numeric fields) are not stored in the key
+    # index with their document numbers, since readers would only use them
+    # to find a single undeleted document
+    KEY_DOCS_LIMIT = 8
+
+    # The number of posting blocks past the current one that matchers ask the
+    # storage to read ahead (this is a class attribute so codec objects
+    # unpickled from older segments have it)
+    _prefetch_blocks = 4
+    # The number of terms in each block of the term dictionary, or 0 to write
+    # the term dictionary as an ordered hash file
+    _termblocks = 0
+
+    def __init__(self, blocklimit=128, compression=3, inlinelimit=1,
+                 prefetch_blocks=4, termblocks=0):
+        """
+        :param blocklimit: the maximum number of postings in a block.
+        :param compression: the zlib compression level of posting blocks.
+        :param inlinelimit: postings lists with this many postings or fewer
+            are stored in the term info instead of the postings file.
+        :param prefetch_blocks: as a matcher moves through a postings list,
+            it hints to the storage that roughly this many upcoming blocks
+            will be read soon, so they can be loaded in one batch instead of
+            as separate small reads. Use 0 to turn this off.
+        :param termblocks: if this is not 0, the term dictionary is written
+            as a :class:`whoosh.filedb.filetables.SortedBlockWriter` file with
+            this many terms in each block (for example, 32), instead of an
+            ordered hash file. The sorted block file is about half the size,
+            uses less memory while writing, and is faster for expanding
+            prefixes and ranges, but looking up single terms (the common case
+            when searching) is slower.
+        """
 
-    def __init__(self, blocklimit=128, compression=3, inlinelimit=1):
         self._blocklimit = blocklimit
         self._compression = compression
         self._inlinelimit = inlinelimit
+        self._prefetch_blocks = prefetch_blocks
+        self._termblocks = termblocks
 
     # Per-document value writer
     def per_document_writer(self, storage, segment):
@@ -104,7 +144,7 @@ class W3Codec(base.CodecWithGraph):
         else:
             offset, length = terminfo.extent()
             m = W3LeafMatcher(dbfile, offset, length, format_, term=term,
-                              scorer=scorer)
+                              scorer=scorer, prefetch=self._prefetch_blocks)
         return m
 
     # Readers
@@ -119,7 +159,14 @@ class W3Codec(base.CodecWithGraph):
 
         postfile = segment.open_file(storage, self.POSTS_EXT)
 
-        return W3TermsReader(self, tifile, tilen, postfile)
+        # Segments written before the key index was added (or without unique
+        # fields) don't have a key file
+        keyindex = None
+        kname = segment.make_filename(self.KEYS_EXT)
+        if storage.file_exists(kname):
+            keyindex = filetables.SortedBlockReader.open(storage, kname)
+
+        return W3TermsReader(self, tifile, tilen, postfile, keyindex)
 
     # Graph methods provided by CodecWithGraph
 
@@ -149,6 +196,14 @@ def _lenfield(fieldname):
     return "_%s_len" % fieldname
 
 
+def _docnums_to_bytes(docnums):
+    return struct.pack("!%dI" % len(docnums), *docnums)
+
+
+def _docnums_from_bytes(bs):
+    return struct.unpack("!%dI" % (len(bs) // _INT_SIZE), bs)
+
+
 # Per-doc information writer
 
 class W3PerDocWriter(base.PerDocWriterWithColumns):
@@ -160,7 +215,7 @@ class W3PerDocWriter(base.PerDocWriterWithColumns):
         tempst = storage.temp_storage("%s.tmp" % segment.indexname)
         self._cols = compound.CompoundWriter(tempst)
         self._colwriters = {}
-        self._create_column("_stored", STORED_COLUMN)
+        self._create_column("_sfields", STORED_FIELDS_COLUMN)
 
         self._fieldlengths = defaultdict(int)
         self._doccount = 0
@@ -240,7 +295,7 @@ class W3PerDocWriter(base.PerDocWriterWithColumns):
     def finish_doc(self):
         sf = self._storedfields
         if sf:
-            self.add_column_value("_stored", STORED_COLUMN, sf)
+            self.add_column_value("_sfields", STORED_FIELDS_COLUMN, sf)
             sf.clear()
         self._indoc = False
 
@@ -254,15 +309,17 @@ class W3PerDocWriter(base.PerDocWriterWithColumns):
 
         self._segment._fieldlengths = self._fieldlengths
 
+        # If vectors were written, close the vector writers. Do this before
+        # saving the columns so a storage that streams files into a single
+        # file can write the columns right after the vectors
+        if self._vpostfile:
+            self._vpostfile.close()
+
         # Finish open columns and close the columns writer
         for writer in self._colwriters.values():
             writer.finish(self._doccount)
         self._cols.save_as_files(self._storage, self._column_filename)
 
-        # If vectors were written, close the vector writers
-        if self._vpostfile:
-            self._vpostfile.close()
-
         self.is_closed = True
 
 
@@ -279,11 +336,20 @@ class W3FieldWriter(base.FieldWriterWithGraph):
         self._format = None
 
         _tifile = self._create_file(W3Codec.TERMS_EXT)
-        self._tindex = filetables.OrderedHashWriter(_tifile)
+        if codec._termblocks:
+            self._tindex = filetables.SortedBlockWriter(
+                _tifile, blockkeys=codec._termblocks)
+        else:
+            self._tindex = filetables.OrderedHashWriter(_tifile)
         self._fieldmap = self._tindex.extras["fieldmap"] = {}
 
         self._postfile = self._create_file(W3Codec.POSTS_EXT)
 
+        # The key index maps the terms of unique fields directly to document
+        # numbers. It's created when the first unique field is written
+        self._kindex = None
+        self._keydocs = None
+
         self._postwriter = None
         self._infield = False
         self.is_closed = False
@@ -303,6 +369,15 @@ class W3FieldWriter(base.FieldWriterWithGraph):
         self._fieldobj = fieldobj
         self._format = fieldobj.format
         self._infield = True
+        if fieldobj.unique:
+            if self._kindex is None:
+                kfile = self._create_file(W3Codec.KEYS_EXT)
+                self._kindex = filetables.SortedBlockWriter(kfile)
+                self._kindex.extras["fieldnames"] = set()
+            self._kindex.extras["fieldnames"].add(fieldname)
+            self._keydocs = []
+        else:
+            self._keydocs = None
 
         # Set up graph for this field if necessary
         self._start_graph_field(fieldname, fieldobj)
@@ -319,6 +394,8 @@ class W3FieldWriter(base.FieldWriterWithGraph):
 
     def add(self, docnum, weight, vbytes, length):
         self._postwriter.add_posting(docnum, weight, vbytes, length)
+        if self._keydocs is not None:
+            self._keydocs.append(docnum)
 
     def finish_term(self):
         terminfo = self._postwriter.finish_postings()
@@ -328,6 +405,16 @@ class W3FieldWriter(base.FieldWriterWithGraph):
         valbytes = terminfo.to_bytes()
         self._tindex.add(keybytes, valbytes)
 
+        # Add the term's document numbers to the key index. If there are too
+        # many, store an empty value so readers look in the postings instead
+        keydocs = self._keydocs
+        if keydocs is not None:
+            if len(keydocs) > W3Codec.KEY_DOCS_LIMIT:
+                self._kindex.add(keybytes, emptybytes)
+            else:
+                self._kindex.add(keybytes, _docnums_to_bytes(keydocs))
+            self._keydocs = []
+
     # FieldWriterWithGraph.add_spell_word
 
     def finish_field(self):
@@ -340,6 +427,8 @@ class W3FieldWriter(base.FieldWriterWithGraph):
     def close(self):
         self._tindex.close()
         self._postfile.close()
+        if self._kindex is not None:
+            self._kindex.close()
         self._close_graph()
         self.is_closed = True
 
@@ -484,19 +573,46 @@ class W3PerDocReader(base.PerDocumentReader):
 
     # Stored fields
 
+    def _stored_reader(self):
+        reader = self._cached_reader("_sfields", STORED_FIELDS_COLUMN)
+        if reader is None:
+            # Segment from before stored fields were stored by field
+            reader = self._cached_reader("_stored", STORED_COLUMN)
+        return reader
+
     def stored_fields(self, docnum):
-        reader = self._cached_reader("_stored", STORED_COLUMN)
-        v = reader[docnum]
+        v = self._stored_reader()[docnum]
         if v is None:
             v = {}
         return v
 
+    def stored_field_values(self, docnum, fieldnames):
+        reader = self._stored_reader()
+        if isinstance(reader, columns.StoredFieldsColumn.Reader):
+            return reader.fields(docnum, fieldnames)
+        return base.PerDocumentReader.stored_field_values(self, docnum,
+                                                          fieldnames)
+
+    def prefetch_stored_fields(self, docnums):
+        reader = self._stored_reader()
+        if reader is not None:
+            reader.prefetch(docnums)
+
 
 class W3TermsReader(base.TermsReader):
-    def __init__(self, codec, dbfile, length, postfile):
+    def __init__(self, codec, dbfile, length, postfile, keyindex=None):
         self._codec = codec
         self._dbfile = dbfile
-        self._tindex = filetables.OrderedHashReader(dbfile, length)
+        self._kindex = keyindex
+        self._keyfields = frozenset()
+        if keyindex is not None:
+            self._keyfields = frozenset(keyindex.extras["fieldnames"])
+        # Segments written with termblocks=0 (the default) or before the
+        # sorted block format existed have an ordered hash file
+        if dbfile.get(0, 4) == b("HSH3"):
+            self._tindex = filetables.OrderedHashReader(dbfile, length)
+        else:
+            self._tindex = filetables.SortedBlockReader(dbfile, length)
         self._fieldmap = self._tindex.extras["fieldmap"]
         self._postfile = postfile
 
@@ -566,9 +682,26 @@ class W3TermsReader(base.TermsReader):
                                         term=(fieldname, tbytes), scorer=scorer)
         return m
 
+    def has_key_index(self, fieldname):
+        return fieldname in self._keyfields
+
+    def key_docnums(self, fieldname, tbytes_list):
+        kindex = self._kindex
+        keycoder = self._keycoder
+        # Look up the keys in order, so keys in the same block of the index
+        # are found with one read
+        for tbytes in sorted(tbytes_list):
+            value = kindex.get(keycoder(fieldname, tbytes))
+            if value is None:
+                continue
+            # An empty value means the document numbers weren't stored
+            yield tbytes, _docnums_from_bytes(value) if value else None
+
     def close(self):
         self._tindex.close()
         self._postfile.close()
+        if self._kindex is not None:
+            self._kindex.close()
 
 
 # Postings
@@ -801,7 +934,7 @@ class W3LeafMatcher(LeafMatcher):
     """
 
     def __init__(self, postfile, startoffset, length, format_, term=None,
-                 byteids=None, scorer=None):
+                 byteids=None, scorer=None, prefetch=0):
         self._postfile = postfile
         self._startoffset = startoffset
         self._length = length
@@ -809,6 +942,10 @@ class W3LeafMatcher(LeafMatcher):
         self._term = term
         self._byteids = byteids
         self.scorer = scorer
+        # Number of blocks to hint to the storage ahead of the current block,
+        # and the offset up to which we've already hinted
+        self._prefetch = prefetch
+        self._prefetched = 0
 
         self._fixedsize = self.format.fixed_value_size()
         # Read the header tag at the start of the postings
@@ -867,6 +1004,10 @@ class W3LeafMatcher(LeafMatcher):
 
         # Remember the offset of the next block
         self._nextoffset = position + _INT_SIZE + length
+        # If we've moved past the region we last asked the storage to read
+        # ahead, hint the next few blocks (estimated from this block's size)
+        if self._prefetch and self._nextoffset >= self._prefetched:
+            self._prefetch_from(self._nextoffset, _INT_SIZE + length)
         # Read the pickled block info tuple
         info = postfile.read_pickle()
         # Remember the offset of the block's data
@@ -878,6 +1019,13 @@ class W3LeafMatcher(LeafMatcher):
         self._minlength = byte_to_length(mnlen)
         self._maxlength = byte_to_length(mxlen)
 
+    def _prefetch_from(self, offset, blocksize):
+        end = min(self._startoffset + self._length,
+                  offset + blocksize * self._prefetch)
+        if end > offset:
+            self._postfile.advise(WILLNEED, offset, end - offset)
+        self._prefetched = end
+
     def _next_block(self):
         if self._atend:
             # We were already at the end, and yet somebody called _next_block()
@@ -1150,7 +1298,7 @@ class W3TermInfo(TermInfo):
             offpos = st.size
             lenpos = st.size + _LONG_SIZE
             terminfo._offset = unpack_long(s[offpos:lenpos])[0]
-            terminfo._length = unpack_int(s[lenpos:lenpos + _INT_SIZE])
+            terminfo._length = unpack_int(s[lenpos:lenpos + _INT_SIZE])[0]
 
         return terminfo
 
@@ -1178,6 +1326,10 @@ class W3TermInfo(TermInfo):
 # Segment implementation
 
 class W3Segment(base.Segment):
+    # Incremented every time a document is deleted or undeleted (a class
+    # attribute so segments pickled without it load)
+    _delgen = 0
+
     def __init__(self, codec, indexname, doccount=0, segid=None, deleted=None):
         self.indexname = indexname
         self.segid = self._random_id() if segid is None else segid
@@ -1214,6 +1366,12 @@ class W3Segment(base.Segment):
             self._deleted.add(docnum)
         elif self._deleted is not None and docnum in self._deleted:
             self._deleted.clear(docnum)
+        self._delgen += 1
+
+    def deletion_generation(self):
+        # Include the deleted count to tell apart versions of segments written
+        # before the counter existed
+        return (self._delgen, self.deleted_count())
 
     def is_deleted(self, docnum):
         if self._deleted is None:
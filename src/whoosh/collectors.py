@@ -78,9 +78,8 @@ generally a good idea to create a new collector for each search.
 import os
 import threading
 from array import array
-from bisect import insort
 from collections import defaultdict
-from heapq import heapify, heappush, heapreplace
+from heapq import heapify, heappop, heappush, heapreplace
 
 from whoosh import sorting
 from whoosh.compat import abstractmethod, iteritems, itervalues, xrange
@@ -135,6 +134,9 @@ class Collector(object):
         self.starttime = now()
         self.runtime = None
         self.docset = set()
+        # Global document numbers of documents that were collected and then
+        # removed with remove(), but are still in the collector's items
+        self._removed = set()
 
     def run(self):
         # Collect matches for each sub-searcher
@@ -253,17 +255,26 @@ class Collector(object):
         raise NotImplementedError
 
     def remove(self, global_docnum):
-        """Removes a document from the collector. Not that this method uses the
-        global document number as opposed to :meth:`Collector.collect` which
-        takes a segment-relative docnum.
+        """Removes a previously collected document from the collector. Not that
+        this method uses the global document number as opposed to
+        :meth:`Collector.collect` which takes a segment-relative docnum.
         """
 
-        items = self.items
-        for i in xrange(len(items)):
-            if items[i][1] == global_docnum:
-                items.pop(i)
-                return
-        raise KeyError(global_docnum)
+        if global_docnum not in self.docset:
+            raise KeyError(global_docnum)
+        # Instead of searching the list of items for the document, remember
+        # that it was removed and leave it out of the results
+        self.docset.discard(global_docnum)
+        self._removed.add(global_docnum)
+
+    def kept(self, global_docnum):
+        """Returns True if the given (collected) document is still in the
+        collector's results. Collectors that only keep the top N documents
+        return False for documents that were pushed out of the top N. The
+        default implementation always returns True.
+        """
+
+        return True
 
     def _step_through_matches(self):
         matcher = self.matcher
@@ -299,6 +310,9 @@ class Collector(object):
     def _results(self, items, **kwargs):
         # Fills in a Results object with the invariant information and the
         # given "items" (a list of (score, docnum) tuples)
+        removed = self._removed
+        if removed:
+            items = [item for item in items if item[1] not in removed]
         r = Results(self.top_searcher, self.q, items, **kwargs)
         r.runtime = self.runtime
         r.collector = self
@@ -436,6 +450,14 @@ class TopCollector(ScoredCollector):
         self.usequality = usequality
         self.total = 0
 
+    def prepare(self, top_searcher, q, context):
+        ScoredCollector.prepare(self, top_searcher, q, context)
+        self.total = 0
+        # Negated document numbers of the documents in the heap. Removed
+        # documents stay in the heap (and in self._removed) until they reach
+        # the top, so removing a document doesn't have to rebuild the heap
+        self._inheap = set()
+
     def _use_block_quality(self):
         return (self.usequality
                 and not self.top_searcher.weighting.use_final
@@ -460,40 +482,54 @@ class TopCollector(ScoredCollector):
     # ScoredCollector.collect calls this
     def _collect(self, global_docnum, score):
         items = self.items
+        inheap = self._inheap
         self.total += 1
 
         # Document numbers are negated before putting them in the heap so that
         # higher document numbers have lower "priority" in the queue. Lower
         # document numbers should always come before higher document numbers
         # with the same score to keep the order stable.
-        if len(items) < self.limit:
+        negated = 0 - global_docnum
+        if len(items) - len(self._removed) < self.limit:
             # The heap isn't full, so add this document
-            heappush(items, (score, 0 - global_docnum))
+            heappush(items, (score, negated))
+            inheap.add(negated)
             # Negate score to act as sort key so higher scores appear first
             return 0 - score
         elif score > items[0][0]:
             # The heap is full, but if this document has a high enough
             # score to make the top N, add it to the heap
-            heapreplace(items, (score, 0 - global_docnum))
+            inheap.discard(heapreplace(items, (score, negated))[1])
+            inheap.add(negated)
+            self._purge()
             self.minscore = items[0][0]
             # Negate score to act as sort key so higher scores appear first
             return 0 - score
         else:
             return 0
 
-    def remove(self, global_docnum):
-        negated = 0 - global_docnum
+    def _purge(self):
+        # Pops removed documents off the top of the heap, so the top of the
+        # heap is always the lowest-scoring document in the top N
         items = self.items
+        removed = self._removed
+        while items and (0 - items[0][1]) in removed:
+            removed.discard(0 - heappop(items)[1])
 
-        # Remove the document if it's on the list (it may not be since
-        # TopCollector forgets documents that don't make the top N list)
-        for i in xrange(len(items)):
-            if items[i][1] == negated:
-                items.pop(i)
-                # Restore the heap invariant
-                heapify(items)
-                self.minscore = items[0][0] if items else 0
-                return
+    def kept(self, global_docnum):
+        return (0 - global_docnum) in self._inheap
+
+    def remove(self, global_docnum):
+        self.total -= 1
+        negated = 0 - global_docnum
+        # Mark the document as removed if it's in the heap (it may not be
+        # since TopCollector forgets documents that don't make the top N list)
+        if negated in self._inheap:
+            self._inheap.discard(negated)
+            self._removed.add(global_docnum)
+            self._purge()
+            items = self.items
+            self.minscore = items[0][0] if items else 0
 
     def results(self):
         # The items are stored (postive score, negative docnum) so the heap
@@ -532,23 +568,54 @@ class UnlimitedCollector(ScoredCollector):
 
 # Sorting collector
 
+class _Descending(object):
+    # Wraps a (sortkey, docnum) item so that the heap module's min-heap keeps
+    # the highest item at the top
+
+    __slots__ = ("item",)
+
+    def __init__(self, item):
+        self.item = item
+
+    def __lt__(self, other):
+        return other.item < self.item
+
+
 class SortingCollector(Collector):
     """A collector that returns results sorted by a given
     :class:`whoosh.sorting.Facet` object. See :doc:`/facets` for more
     information.
+
+    If ``limit`` is not None, the collector only keeps the top N documents in
+    a heap instead of sorting every matching document. If the sort key
+    provides bounds for blocks of documents (see
+    :meth:`whoosh.sorting.Categorizer.block_bounds`, for example a sortable
+    numeric field), once the heap is full the collector skips blocks of
+    documents that can't sort high enough to make the top N, and stops
+    searching a segment when none of its remaining blocks can. If the segment
+    was written sorted on the same field (see the ``sortedby`` argument of
+    :class:`whoosh.writing.SegmentWriter`), the collector stops searching the
+    segment after the first N matches.
     """
 
-    def __init__(self, sortedby, limit=10, reverse=False):
+    def __init__(self, sortedby, limit=10, reverse=False, useblocks=True):
         """
         :param sortedby: see :doc:`/facets`.
+        :param limit: the maximum number of results to return, or None to
+            return all matching documents.
         :param reverse: If True, reverse the overall results. Note that you
             can reverse individual facets in a multi-facet sort key as well.
+        :param useblocks: whether to skip blocks of documents that can't make
+            the top N results. You should turn this off if you wrap this
+            collector in a collector that needs to see every match, such as
+            :class:`FacetCollector`.
         """
 
         Collector.__init__(self)
         self.sortfacet = sorting.MultiFacet.from_sortedby(sortedby)
         self.limit = limit
         self.reverse = reverse
+        self.useblocks = useblocks
 
     def prepare(self, top_searcher, q, context):
         self.categorizer = self.sortfacet.categorizer(top_searcher)
@@ -557,28 +624,225 @@ class SortingCollector(Collector):
         rm = context.needs_current or self.categorizer.needs_current
         Collector.prepare(self, top_searcher, q, context.set(needs_current=rm))
 
-        # List of (sortkey, docnum) pairs
+        # List of (sortkey, docnum) pairs. If there's a limit, this is a heap
+        # with the item that sorts last at the top
         self.items = []
+        self.total = 0
+        # Document numbers of the documents in the heap. Removed documents
+        # stay in the heap (and in self._removed) until they reach the top
+        self._inheap = set()
+        # Whether the sort keys are tuples (only the first part of a tuple
+        # key is bounded by the categorizer's block bounds)
+        self._tuplekeys = isinstance(self.categorizer,
+                                     sorting.MultiFacet.MultiCategorizer)
+        self._bounds = None
+        self._inorder = False
+        # Number of blocks skipped and segments cut short by the block bounds
+        # (for debugging)
+        self.skipped_times = 0
+        self.terminated_times = 0
 
     def set_subsearcher(self, subsearcher, offset):
         Collector.set_subsearcher(self, subsearcher, offset)
         self.categorizer.set_searcher(subsearcher, offset)
 
+        self._bounds = None
+        self._inorder = False
+        if self.limit and self.useblocks:
+            # If the documents in the segment are in sorted order, the
+            # collector can stop at the first document that doesn't make the
+            # top N
+            keyorder = self.categorizer.key_order()
+            self._inorder = keyorder == (-1 if self.reverse else 1)
+            if not self._inorder:
+                self._bounds = self.categorizer.block_bounds()
+
+    def computes_count(self):
+        return not (self.skipped_times or self.terminated_times)
+
+    def all_ids(self):
+        if self.limit:
+            # Since this collector only keeps the top N documents, if the user
+            # asks for all matched docs we need to re-run the search
+            return self.top_searcher.docs_for_query(self.q)
+        return self.docset
+
+    def count(self):
+        if self.computes_count():
+            return self.total
+        else:
+            return ilen(self.all_ids())
+
     def sort_key(self, sub_docnum):
         return self.categorizer.key_for(self.matcher, sub_docnum)
 
+    def _last_key(self):
+        # Returns the first part of the key of the document that currently
+        # sorts last in the top N
+        if self.reverse:
+            key = self.items[0][0]
+        else:
+            key = self.items[0].item[0]
+        if self._tuplekeys:
+            key = key[0]
+        return key
+
+    def _competes(self, bound, lastkey):
+        # Returns True if a document with the given bound could sort before
+        # the current last document in the top N
+        if self.reverse:
+            return bound >= lastkey
+        else:
+            return bound <= lastkey
+
+    def _bounded_matches(self):
+        blocksize, lows, highs = self._bounds
+        if self.reverse:
+            # The best key in each block, and the best key in each block or
+            # any block after it
+            best = highs
+            rest = list(highs)
+            for i in xrange(len(rest) - 2, -1, -1):
+                rest[i] = max(rest[i], rest[i + 1])
+        else:
+            best = lows
+            rest = list(lows)
+            for i in xrange(len(rest) - 2, -1, -1):
+                rest[i] = min(rest[i], rest[i + 1])
+
+        competes = self._competes
+        limit = self.limit
+        items = self.items
+        removed = self._removed
+        matcher = self.matcher
+        while matcher.is_active():
+            docnum = matcher.id()
+            if len(items) - len(removed) >= limit:
+                lastkey = self._last_key()
+                block = docnum // blocksize
+                if not competes(best[block], lastkey):
+                    if not competes(rest[block], lastkey):
+                        # No document in the rest of the segment can make the
+                        # top N
+                        self.terminated_times += 1
+                        return
+
+                    # Skip to the next block that can make the top N
+                    block += 1
+                    while not competes(best[block], lastkey):
+                        block += 1
+                    self.skipped_times += 1
+                    matcher.skip_to(block * blocksize)
+                    continue
+
+            yield docnum
+            matcher.next()
+
+    def _ordered_matches(self):
+        competes = self._competes
+        limit = self.limit
+        items = self.items
+        removed = self._removed
+        matcher = self.matcher
+        while matcher.is_active():
+            docnum = matcher.id()
+            if len(items) - len(removed) >= limit:
+                key = self.sort_key(docnum)
+                if self._tuplekeys:
+                    key = key[0]
+                if not competes(key, self._last_key()):
+                    # The rest of the documents in the segment sort after this
+                    # one, so none of them can make the top N
+                    self.terminated_times += 1
+                    return
+
+            yield docnum
+            matcher.next()
+
+    def matches(self):
+        if self._inorder:
+            return self._ordered_matches()
+        elif self._bounds is not None:
+            return self._bounded_matches()
+        return Collector.matches(self)
+
     def collect(self, sub_docnum):
         global_docnum = self.offset + sub_docnum
         sortkey = self.sort_key(sub_docnum)
-        self.items.append((sortkey, global_docnum))
-        self.docset.add(global_docnum)
+        self.total += 1
+
+        limit = self.limit
+        if not limit:
+            self.items.append((sortkey, global_docnum))
+            self.docset.add(global_docnum)
+            return sortkey
+
+        # Keep the top N (sortkey, docnum) items in a heap with the item that
+        # sorts last at the top, so the same items are kept as if we sorted
+        # the full list and took the first N
+        item = (sortkey, global_docnum)
+        items = self.items
+        inheap = self._inheap
+        full = len(items) - len(self._removed) >= limit
+        if self.reverse:
+            if not full:
+                heappush(items, item)
+            elif item > items[0]:
+                inheap.discard(heapreplace(items, item)[1])
+            else:
+                return sortkey
+        else:
+            if not full:
+                heappush(items, _Descending(item))
+            elif item < items[0].item:
+                inheap.discard(heapreplace(items, _Descending(item)).item[1])
+            else:
+                return sortkey
+        inheap.add(global_docnum)
+        if full:
+            self._purge()
         return sortkey
 
+    def _top_docnum(self):
+        item = self.items[0]
+        return item[1] if self.reverse else item.item[1]
+
+    def _purge(self):
+        # Pops removed documents off the top of the heap, so the top of the
+        # heap is always the document that sorts last in the top N
+        items = self.items
+        removed = self._removed
+        while items and self._top_docnum() in removed:
+            removed.discard(self._top_docnum())
+            heappop(items)
+
+    def kept(self, global_docnum):
+        if not self.limit:
+            return True
+        return global_docnum in self._inheap
+
+    def remove(self, global_docnum):
+        self.total -= 1
+        if not self.limit:
+            return Collector.remove(self, global_docnum)
+
+        # Mark the document as removed if it's in the heap (it may not be
+        # since the collector forgets documents that don't make the top N)
+        if global_docnum in self._inheap:
+            self._inheap.discard(global_docnum)
+            self._removed.add(global_docnum)
+            self._purge()
+
     def results(self):
         items = self.items
-        items.sort(reverse=self.reverse)
         if self.limit:
-            items = items[:self.limit]
+            if self.reverse:
+                items = sorted(items, reverse=True)
+            else:
+                items = sorted(item.item for item in items)
+            return self._results(items)
+
+        items.sort(reverse=self.reverse)
         return self._results(items, docset=self.docset)
 
 
@@ -620,6 +884,9 @@ class WrappingCollector(Collector):
         self.matcher = self.child.matcher
         self.offset = self.child.offset
 
+    def computes_count(self):
+        return self.child.computes_count()
+
     def all_ids(self):
         return self.child.all_ids()
 
@@ -636,6 +903,12 @@ class WrappingCollector(Collector):
     def collect(self, sub_docnum):
         return self.child.collect(sub_docnum)
 
+    def remove(self, global_docnum):
+        return self.child.remove(global_docnum)
+
+    def kept(self, global_docnum):
+        return self.child.kept(global_docnum)
+
     def matches(self):
         return self.child.matches()
 
@@ -715,7 +988,9 @@ class FilterCollector(WrappingCollector):
     def count(self):
         child = self.child
         if child.computes_count():
-            return child.count() - self.filtered_count
+            # Filtered documents are never passed to the child, so its count
+            # only includes the allowed documents
+            return child.count()
         else:
             return ilen(self.all_ids())
 
@@ -741,6 +1016,10 @@ class FilterCollector(WrappingCollector):
 
     def results(self):
         r = self.child.results()
+        # If the child can't count its matches (for example, because it
+        # skipped documents that couldn't make the top N), the results
+        # count them again through this collector, so they're filtered
+        r.collector = self
         r.filtered_count = self.filtered_count
         r.allowed = self.allow
         r.restricted = self.restrict
@@ -765,18 +1044,29 @@ class FacetCollector(WrappingCollector):
         fc = FacetedCollector(uc, sorting.FieldFacet("category"))
         mysearcher.search_with_collector(myquery, fc)
         print(fc.facetmaps)
+
+    If you pass a ``budget``, the collector only groups a sample of about
+    ``budget`` matching documents (every Nth match, where N is the estimated
+    number of matches divided by the budget), so the cost of grouping doesn't
+    grow with the number of matches. The wrapped collector still sees every
+    match. After the search, ``FacetCollector.sample_rate`` is the fraction of
+    matching documents that were grouped. This is useful with the approximate
+    facet maps such as :class:`whoosh.sorting.TopCounts`.
     """
 
-    def __init__(self, child, groupedby, maptype=None):
+    def __init__(self, child, groupedby, maptype=None, budget=None):
         """
         :param groupedby: see :doc:`/facets`.
         :param maptype: a :class:`whoosh.sorting.FacetMap` type to use for any
             facets that don't specify their own.
+        :param budget: if not None, the maximum number of matching documents
+            to group.
         """
 
         self.child = child
         self.facets = sorting.Facets.from_groupedby(groupedby)
         self.maptype = maptype
+        self.budget = budget
 
     def prepare(self, top_searcher, q, context):
         facets = self.facets
@@ -787,20 +1077,58 @@ class FacetCollector(WrappingCollector):
         self.facetmaps = {}
         self.categorizers = {}
 
+        # For facets that only count documents, if the categorizer can count
+        # keys in bulk, the collector just records the matching document
+        # numbers in each segment and counts them when it leaves the segment
+        self._counted = {}
+
         # Set needs_current to True if any of the categorizers require the
         # current document to work
         needs_current = context.needs_current
         for facetname, facet in facets.items():
-            self.facetmaps[facetname] = facet.map(self.maptype)
+            fmap = self.facetmaps[facetname] = facet.map(self.maptype)
 
             ctr = facet.categorizer(top_searcher)
             self.categorizers[facetname] = ctr
             needs_current = needs_current or ctr.needs_current
+
+            if hasattr(fmap, "add_count") and ctr.bulk_counts:
+                self._counted[facetname] = array("I")
         context = context.set(needs_current=needs_current)
 
+        # Number of matching documents, and number of them grouped
+        self.total = 0
+        self.sampled = 0
+        # If there's a budget, only group every Nth match
+        self._stride = 1
+        if self.budget is not None:
+            try:
+                estimate = q.estimate_size(top_searcher.reader())
+            except NotImplementedError:
+                estimate = top_searcher.doc_count()
+            self._stride = max(1, estimate // max(1, self.budget))
+
         self.child.prepare(top_searcher, q, context)
 
+    @property
+    def sample_rate(self):
+        if not self.total:
+            return 1.0
+        return self.sampled / float(self.total)
+
+    def _count_segment(self):
+        # Counts the keys of the documents recorded in the current segment for
+        # the facets that count in bulk
+        for name, docnums in iteritems(self._counted):
+            if docnums:
+                categorizer = self.categorizers[name]
+                add_count = self.facetmaps[name].add_count
+                for key, count in categorizer.key_counts(docnums):
+                    add_count(categorizer.key_to_name(key), count)
+                self._counted[name] = array("I")
+
     def set_subsearcher(self, subsearcher, offset):
+        self._count_segment()
         WrappingCollector.set_subsearcher(self, subsearcher, offset)
 
         # Tell each categorizer about the new subsearcher and offset
@@ -815,8 +1143,20 @@ class FacetCollector(WrappingCollector):
         # the facet groups
         sortkey = self.child.collect(sub_docnum)
 
+        self.total += 1
+        if self.budget is not None:
+            if (self.sampled >= self.budget
+                    or (self.total - 1) % self._stride):
+                return sortkey
+        self.sampled += 1
+
         # For each facet we're grouping by
+        counted = self._counted
         for name, categorizer in iteritems(self.categorizers):
+            if name in counted:
+                counted[name].append(sub_docnum)
+                continue
+
             add = self.facetmaps[name].add
 
             # We have to do more work if the facet allows overlapping groups
@@ -830,6 +1170,10 @@ class FacetCollector(WrappingCollector):
 
         return sortkey
 
+    def finish(self):
+        self._count_segment()
+        WrappingCollector.finish(self)
+
     def results(self):
         r = self.child.results()
         r._facetmaps = self.facetmaps
@@ -856,9 +1200,26 @@ class CollapseCollector(WrappingCollector):
         mysearcher.search_with_collector(myquery, cc)
         print(cc.collapsed_counts)
 
+    The collector works on the facet's sort keys, so collapsing on a field
+    with an ordinal column (such as :class:`whoosh.columns.RefBytesColumn`)
+    compares integers instead of values. For each key it keeps a small heap
+    of the best documents. When collapsing in the results order and the
+    wrapped collector only keeps the top N documents, the collector
+    periodically forgets the documents of keys whose documents have all been
+    pushed out of the top N, so it only keeps a count of the documents with
+    each of those keys. The number of results and ``collapsed_counts`` are
+    computed from these counts, so forgetting keys doesn't change them. (If
+    the wrapped collector skips blocks of matching documents,
+    ``collapsed_counts`` doesn't include the skipped documents, and the
+    number of results is found by running the query again.)
+
     See :ref:`collapsing` for more information.
     """
 
+    # The minimum number of keys to track before trying to forget keys whose
+    # documents are no longer in the wrapped collector's results
+    prune_size = 1024
+
     def __init__(self, child, keyfacet, limit=1, order=None):
         """
         :param child: the collector to wrap.
@@ -889,14 +1250,19 @@ class CollapseCollector(WrappingCollector):
         if self.orderfacet:
             self.orderer = self.orderfacet.categorizer(top_searcher)
 
-        # Dictionary mapping keys to lists of (sortkey, global_docnum) pairs
-        # representing the best docs for that key
-        self.lists = defaultdict(list)
-        # Dictionary mapping keys to the number of documents that have been
-        # filtered out with that key
-        self.collapsed_counts = defaultdict(int)
-        # Total number of documents filtered out by collapsing
-        self.collapsed_total = 0
+        # Dictionary mapping keys to the best docs for that key. If the limit
+        # is 1, the value is a (sortkey, global_docnum) tuple, otherwise it's
+        # a heap of the tuples with the worst document at the top
+        self._best = {}
+        # Set of keys with empty names, which are never collapsed
+        self._emptykeys = set()
+        # Dictionary mapping keys to the number of matching documents with
+        # that key. Unlike the best docs, the counts are never forgotten, so
+        # the number of collapsed documents is exact
+        self._seen = defaultdict(int)
+        # Number of matching documents with an empty key
+        self._emptycount = 0
+        self._prunesize = self.prune_size
 
         # If the keyer or orderer require a valid matcher, tell the child
         # collector we need it
@@ -914,80 +1280,160 @@ class CollapseCollector(WrappingCollector):
         if self.orderer:
             self.orderer.set_searcher(subsearcher, offset)
 
+    @property
+    def collapsed_counts(self):
+        """A dictionary mapping key names to the number of documents that
+        were eliminated with that key.
+        """
+
+        key_to_name = self.keyer.key_to_name
+        limit = self.limit
+        counts = defaultdict(int)
+        for key, count in iteritems(self._seen):
+            if count > limit:
+                counts[key_to_name(key)] += count - limit
+        return counts
+
+    @property
+    def collapsed_total(self):
+        """The total number of documents eliminated by collapsing.
+        """
+
+        limit = self.limit
+        return sum(count - limit for count in itervalues(self._seen)
+                   if count > limit)
+
+    def _is_empty(self, key):
+        # Returns True if the given key has an empty name. Only keys that
+        # aren't being tracked need to be checked
+        if key in self._best:
+            return False
+        if key in self._emptykeys:
+            return True
+        if self.keyer.key_to_name(key):
+            return False
+        self._emptykeys.add(key)
+        return True
+
     def all_ids(self):
+        # The child collector may have skipped matching documents, so re-run
+        # the query and collapse every match
         child = self.child
         limit = self.limit
+        keyer = self.keyer
+        is_empty = self._is_empty
         counters = defaultdict(int)
 
-        for subsearcher, offset in child.subsearchers():
-            self.set_subsearcher(subsearcher, offset)
-            matcher = child.matcher
-            keyer = self.keyer
-            for sub_docnum in child.matches():
+        for subsearcher, offset in self.top_searcher.leaf_searchers():
+            keyer.set_searcher(subsearcher, offset)
+            matcher = child.q.matcher(subsearcher, child.context)
+            while matcher.is_active():
+                sub_docnum = matcher.id()
                 ckey = keyer.key_for(matcher, sub_docnum)
-                if ckey is not None:
-                    if ckey in counters and counters[ckey] >= limit:
-                        continue
-                    else:
-                        counters[ckey] += 1
-                yield offset + sub_docnum
+                if is_empty(ckey):
+                    yield offset + sub_docnum
+                elif counters[ckey] < limit:
+                    counters[ckey] += 1
+                    yield offset + sub_docnum
+                matcher.next()
 
     def count(self):
         if self.child.computes_count():
-            return self.child.count() - self.collapsed_total
+            # Every match went through collect_matches(), so count the
+            # documents kept for each key
+            limit = self.limit
+            return self._emptycount + sum(min(count, limit) for count
+                                          in itervalues(self._seen))
         else:
             return ilen(self.all_ids())
 
     def collect_matches(self):
-        lists = self.lists
+        best = self._best
+        seen = self._seen
         limit = self.limit
         keyer = self.keyer
         orderer = self.orderer
-        collapsed_counts = self.collapsed_counts
+        is_empty = self._is_empty
 
         child = self.child
         matcher = child.matcher
         offset = child.offset
         for sub_docnum in child.matches():
             # Collapsing category key
-            ckey = keyer.key_to_name(keyer.key_for(matcher, sub_docnum))
-            if not ckey:
+            ckey = keyer.key_for(matcher, sub_docnum)
+            if is_empty(ckey):
                 # If the document isn't in a collapsing category, just add it
+                self._emptycount += 1
                 child.collect(sub_docnum)
-            else:
-                global_docnum = offset + sub_docnum
+                continue
+            seen[ckey] += 1
 
-                if orderer:
-                    # If user specified a collapse order, use it
-                    sortkey = orderer.key_for(child.matcher, sub_docnum)
-                else:
-                    # Otherwise, use the results order
-                    sortkey = child.sort_key(sub_docnum)
-
-                # Current list of best docs for this collapse key
-                best = lists[ckey]
-                add = False
-                if len(best) < limit:
-                    # If the heap is not full yet, just add this document
-                    add = True
-                elif sortkey < best[-1][0]:
-                    # If the heap is full but this document has a lower sort
-                    # key than the highest key currently on the heap, replace
-                    # the "least-best" document
-                    # Tell the child collector to remove the document
-                    child.remove(best.pop()[1])
-                    add = True
-
-                if add:
-                    insort(best, (sortkey, global_docnum))
-                    child.collect(sub_docnum)
+            if orderer:
+                # If user specified a collapse order, use it
+                sortkey = orderer.key_for(child.matcher, sub_docnum)
+            else:
+                # Otherwise, use the results order
+                sortkey = child.sort_key(sub_docnum)
+            item = (sortkey, offset + sub_docnum)
+
+            # The current best docs for this collapse key
+            current = best.get(ckey)
+            worse = None
+            if current is None:
+                best[ckey] = item if limit == 1 else [_Descending(item)]
+            elif limit == 1:
+                if item < current:
+                    best[ckey] = item
+                    worse = current
                 else:
-                    # Remember that a document was filtered
-                    collapsed_counts[ckey] += 1
-                    self.collapsed_total += 1
+                    worse = item
+            elif len(current) < limit:
+                heappush(current, _Descending(item))
+            elif item < current[0].item:
+                # The heap is full but this document sorts before the
+                # "least-best" document, so replace it
+                worse = heapreplace(current, _Descending(item)).item
+            else:
+                worse = item
+
+            if worse is None:
+                child.collect(sub_docnum)
+            elif worse is not item:
+                # Tell the child collector to remove the "least-best"
+                # document before adding this one
+                child.remove(worse[1])
+                child.collect(sub_docnum)
+
+            if orderer is None and len(best) > self._prunesize:
+                self._prune()
+
+    def _prune(self):
+        # Forgets documents that the child collector has pushed out of its
+        # results. When collapsing in results order, a later document with the
+        # same key that sorts after a forgotten document can't make the
+        # results either, so the forgotten documents don't change the results
+        # (and the number of documents with each key is kept in self._seen)
+        best = self._best
+        kept = self.child.kept
+        for key in list(best):
+            current = best[key]
+            if self.limit == 1:
+                if not kept(current[1]):
+                    del best[key]
+            else:
+                live = [d for d in current if kept(d.item[1])]
+                if not live:
+                    del best[key]
+                elif len(live) < len(current):
+                    heapify(live)
+                    best[key] = live
+        self._prunesize = max(self.prune_size, len(best) * 2)
 
     def results(self):
         r = self.child.results()
+        # The child collector counts documents collected against forgotten
+        # keys, so the results count their matches through this collector
+        r.collector = self
         r.collapsed_counts = self.collapsed_counts
         return r
 
@@ -1020,7 +1466,8 @@ class TimeLimitCollector(WrappingCollector):
         :param child: the collector to wrap.
         :param timelimit: the maximum amount of time (in seconds) to
             allow for searching. If the search takes longer than this, it will
-            raise a ``TimeLimit`` exception.
+            raise a ``TimeLimit`` exception. If this is None, the search is
+            only stopped if you call :meth:`TimeLimitCollector.stop`.
         :param greedy: if ``True``, the collector will finish adding the most
             recent hit before raising the ``TimeLimit`` exception.
         :param use_alarm: if ``True`` (the default), the collector will try to
@@ -1038,11 +1485,16 @@ class TimeLimitCollector(WrappingCollector):
 
         self.timer = None
         self.timedout = False
+        self._stopped = False
 
     def prepare(self, top_searcher, q, context):
         self.child.prepare(top_searcher, q, context)
 
-        self.timedout = False
+        # If stop() was called before the search started, stop immediately
+        self.timedout = self._stopped
+        if self.timelimit is None:
+            return
+
         if self.use_alarm:
             import signal
             signal.signal(signal.SIGALRM, self._was_signaled)
@@ -1052,6 +1504,15 @@ class TimeLimitCollector(WrappingCollector):
         self.timer = threading.Timer(self.timelimit, self._timestop)
         self.timer.start()
 
+    def stop(self):
+        """Makes the search raise a ``TimeLimit`` exception as if the time
+        limit had been reached. You can call this method from another thread
+        to cancel a running search.
+        """
+
+        self._stopped = True
+        self.timedout = True
+
     def _timestop(self):
         # Called when the timer expires
         self.timer = None
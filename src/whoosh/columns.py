@@ -38,8 +38,15 @@ although numeric and date fields use ``NumericColumn``. Expert users may use
 other field types that may be faster or more storage efficient based on the
 field contents. For example, if a field always contains one of a limited number
 of possible values, a ``RefBytesColumn`` will save space by only storing the
-values once. If a field's values are always a fixed length, the
-``FixedBytesColumn`` saves space by not storing the length of each value.
+values once, and a ``DictionaryColumn`` does the same for fields with many
+unique values. A ``SortedSetColumn`` stores a set of values for each document
+(for example, the keywords of a ``KEYWORD`` field). If a field's values are
+always a fixed length, the ``FixedBytesColumn`` saves space by not storing the
+length of each value.
+A ``PointsColumn`` stores numbers like ``NumericColumn`` but also indexes them
+for fast range lookups, and a ``BlockColumn`` stores integers compactly in
+blocks with minimum and maximum values that let range lookups and sorting skip
+whole blocks.
 
 A ``Column`` object basically exists to store configuration information and
 provides two important methods: ``writer()`` to return a ``ColumnWriter`` object
@@ -49,7 +56,12 @@ and ``reader()`` to return a ``ColumnReader`` object.
 from __future__ import division, with_statement
 import struct, warnings
 from array import array
+from binascii import hexlify, unhexlify
 from bisect import bisect_right
+from heapq import nsmallest
+from operator import itemgetter
+from random import getrandbits
+from threading import Lock
 
 try:
     import zlib
@@ -57,9 +69,9 @@ except ImportError:
     zlib = None
 
 from whoosh.compat import b, bytes_type, BytesIO
-from whoosh.compat import array_tobytes, xrange
+from whoosh.compat import array_tobytes, iteritems, izip, xrange
 from whoosh.compat import dumps, loads
-from whoosh.filedb.structfile import StructFile
+from whoosh.filedb.structfile import StructFile, WILLNEED
 from whoosh.idsets import BitSet, OnDiskBitSet
 from whoosh.system import emptybytes
 from whoosh.util.cache import lru_cache
@@ -134,6 +146,10 @@ class Column(object):
     """
 
     reversible = False
+    # If True, the column's readers map each document to an "ordinal" (an
+    # index into a per-segment list of unique values) and implement the
+    # ordinal(), ordinal_values() and ordinals() methods
+    ordinal = False
 
     def writer(self, dbfile):
         """Returns a :class:`ColumnWriter` object you can use to use to create
@@ -192,6 +208,12 @@ class ColumnWriter(object):
 
 
 class ColumnReader(object):
+    # The number of documents in each block reported by block_bounds()
+    blocksize = 128
+    # True if docs_in_range() is fast enough that range queries should use it
+    # instead of the terms index
+    fast_ranges = False
+
     def __init__(self, dbfile, basepos, length, doccount):
         self._dbfile = dbfile
         self._basepos = basepos
@@ -217,6 +239,49 @@ class ColumnReader(object):
     def set_reverse(self):
         raise NotImplementedError
 
+    def block_bounds(self):
+        """Returns a ``(blocksize, lows, highs)`` tuple, where ``lows`` and
+        ``highs`` are lists containing the lowest and highest sort key (see
+        :meth:`ColumnReader.sort_key`) of each block of ``blocksize``
+        consecutive documents in the column, or None if the column can't
+        compute the bounds cheaply. Collectors use the bounds to skip blocks
+        of documents that can't sort high enough to make the results.
+        """
+
+        return None
+
+    def prefetch(self, docnums):
+        """Hints to the storage that the values of the given documents are
+        about to be read, so it can start loading them in the background.
+        The default implementation does nothing.
+
+        :param docnums: a sorted sequence of document numbers.
+        """
+
+        pass
+
+
+def _block_bounds(values, doccount, default, blocksize):
+    # Returns lists of the minimum and maximum value in each block of
+    # blocksize documents. The values sequence may be shorter than the
+    # document count, in which case the rest of the documents have the default
+    count = len(values)
+    lows = []
+    highs = []
+    for start in xrange(0, doccount, blocksize):
+        end = min(start + blocksize, doccount)
+        part = values[start:min(end, count)]
+        lo = hi = default
+        if part:
+            lo = min(part)
+            hi = max(part)
+            if end > count:
+                lo = min(lo, default)
+                hi = max(hi, default)
+        lows.append(lo)
+        highs.append(hi)
+    return lows, highs
+
 
 # Arbitrary bytes column
 
@@ -308,6 +373,23 @@ class VarBytesColumn(Column):
                 yield get(pos, length)
                 pos += length
 
+        def prefetch(self, docnums):
+            # Coalesce the extents of consecutive documents and pass each run
+            # to the file as a single hint
+            advise = self._dbfile.advise
+            offsets = self._offsets
+            start = end = None
+            for docnum in docnums:
+                if end is not None and offsets[docnum] == end:
+                    end = offsets[docnum + 1]
+                    continue
+                if end is not None and end > start:
+                    advise(WILLNEED, self._basepos + start, end - start)
+                start = offsets[docnum]
+                end = offsets[docnum + 1]
+            if end is not None and end > start:
+                advise(WILLNEED, self._basepos + start, end - start)
+
 
 class FixedBytesColumn(Column):
     """Stores fixed-length byte strings.
@@ -401,14 +483,18 @@ class RefBytesColumn(Column):
     example, a "tags" field). If you try to index too many unique values, the
     column will convert additional unique values to the default value and issue
     a warning using the ``warnings`` module (this will usually be preferable to
-    crashing the indexer and potentially losing indexed documents).
+    crashing the indexer and potentially losing indexed documents). For
+    fields with more unique values, use :class:`DictionaryColumn`.
     """
 
     # NOTE that RefBytes is reversible within a single column (we could just
     # negate the reference number), but it's NOT reversible ACROSS SEGMENTS
     # (since different segments can have different uniques values in their
-    # columns), so we have to say that the column type is not reversible
+    # columns), so we have to say that the column type is not reversible.
+    # Sorting maps the references to "global ordinals" across all segments
+    # instead (see whoosh.sorting.GlobalOrdinals)
     reversible = False
+    ordinal = True
 
     def __init__(self, fixedlen=0, default=None):
         """
@@ -548,9 +634,30 @@ class RefBytesColumn(Column):
             return uniques
 
         def __getitem__(self, docnum):
+            return self._uniques[self.ordinal(docnum)]
+
+        def ordinal(self, docnum):
+            """Returns the position of the given document's value in the list
+            returned by :meth:`ordinal_values`.
+            """
+
             pos = self._basepos + docnum * self._itemsize
-            ref = self._unpack(self._dbfile.get(pos, self._itemsize))[0]
-            return self._uniques[ref]
+            return self._unpack(self._dbfile.get(pos, self._itemsize))[0]
+
+        def ordinal_values(self):
+            """Returns the list of unique values in this column, in the order
+            they were first added.
+            """
+
+            return self._uniques
+
+        def ordinals(self):
+            """Returns an array of the ordinal of every document in the
+            column.
+            """
+
+            return self._dbfile.get_array(self._basepos, self._typecode,
+                                          self._doccount)
 
         def __iter__(self):
             get = self._dbfile.get
@@ -565,6 +672,559 @@ class RefBytesColumn(Column):
                 yield uniques[ref]
 
 
+# Dictionary column
+
+def _write_packed(dbfile, ints, width):
+    # Writes a list of non-negative integers using the given number of bits
+    # for each one. The integers are packed in groups of 8, so each group
+    # takes exactly ``width`` bytes and any integer can be found without
+    # reading the ones before it
+    if not width:
+        return
+    zero = b("\x00")
+    for start in xrange(0, len(ints), 8):
+        group = ints[start:start + 8]
+        if len(group) < 8:
+            group = list(group) + [0] * (8 - len(group))
+        dbfile.write(_pack_bits(group, width).rjust(width, zero))
+
+
+def _read_packed(dbfile, pos, width, start, end):
+    # Returns an array of the integers from start to end in a list written by
+    # _write_packed at the given position
+    ints = array("I")
+    if not width:
+        ints.extend(0 for _ in xrange(end - start))
+        return ints
+
+    firstgroup = start >> 3
+    data = dbfile.get(pos + firstgroup * width,
+                      (((end + 7) >> 3) - firstgroup) * width)
+    for i in xrange(0, len(data), width):
+        ints.extend(_unpack_bits(data[i:i + width], width, 8))
+    offset = start & 7
+    return ints[offset:offset + end - start]
+
+
+class DictionaryColumn(Column):
+    """Stores byte strings like :class:`RefBytesColumn`, as a dictionary of
+    the unique values and a pointer ("ordinal") into the dictionary for each
+    document, but without the 65535 unique value limit, so it is suitable for
+    fields with many unique values, such as "author" or "domain".
+
+    The dictionary is kept in sorted order, so the ordinals of a segment
+    sort the same way as the values, and each ordinal only uses as many bits
+    as the number of unique values requires. The dictionary is read from
+    disk as needed rather than loaded into memory.
+
+    If you pass ``fst=True``, the column also stores the dictionary as a
+    finite state transducer (see :mod:`whoosh.automata.fst`), which makes
+    looking up values and prefixes
+    (:meth:`DictionaryColumn.Reader.ordinal_of`,
+    :meth:`DictionaryColumn.Reader.prefix_ordinals`) faster at the cost of
+    some extra space.
+    """
+
+    reversible = False
+    ordinal = True
+
+    def __init__(self, fixedlen=0, default=None, fst=False):
+        """
+        :param fixedlen: an optional fixed length for the values. If you
+            specify a number other than 0, the column will require all values
+            to be the specified length.
+        :param default: a default value to use for documents that don't specify
+            one. If you don't specify a default, the column will use an empty
+            bytestring (``b''``), or if you specify a fixed length,
+            ``b'\\x00' * fixedlen``.
+        :param fst: if True, also store the dictionary as a finite state
+            transducer for fast value and prefix lookups.
+        """
+
+        self._fixedlen = fixedlen
+        self._fst = fst
+
+        if default is None:
+            default = b("\x00") * fixedlen if fixedlen else emptybytes
+        elif fixedlen and len(default) != fixedlen:
+            raise ValueError
+        self._default = default
+
+    def writer(self, dbfile):
+        return self.Writer(dbfile, self._fixedlen, self._default, self._fst)
+
+    def reader(self, dbfile, basepos, length, doccount):
+        return self.Reader(dbfile, basepos, length, doccount, self._fixedlen)
+
+    class Writer(ColumnWriter):
+        def __init__(self, dbfile, fixedlen, default, fst):
+            self._dbfile = dbfile
+            self._fixedlen = fixedlen
+            self._default = default
+            self._fst = fst
+
+            # The ordinals aren't known until all the unique values are
+            # sorted, so buffer a temporary number for each document, in the
+            # order the values were first added
+            self._uniques = {default: 0}
+            self._refs = array("I")
+
+        def __repr__(self):
+            return "<DictionaryColumn.Writer>"
+
+        def add(self, docnum, v):
+            fixedlen = self._fixedlen
+            if fixedlen and len(v) != fixedlen:
+                raise ValueError("Value %r is not %s bytes long"
+                                 % (v, fixedlen))
+
+            refs = self._refs
+            if docnum > len(refs):
+                refs.extend(0 for _ in xrange(docnum - len(refs)))
+
+            uniques = self._uniques
+            try:
+                ref = uniques[v]
+            except KeyError:
+                uniques[v] = ref = len(uniques)
+            refs.append(ref)
+
+        def _write_fst(self, values):
+            # Returns the bytes of an FST mapping each (non-empty) value to its
+            # ordinal
+            from whoosh.automata import fst
+
+            output = []
+
+            def onclose(sf):
+                output.append(sf.file.getvalue())
+            f = StructFile(BytesIO(), onclose=onclose)
+            gw = fst.GraphWriter(f, vtype=fst.IntValues)
+            gw.start_field("values")
+            for i, v in enumerate(values):
+                if v:
+                    gw.insert(v, i)
+            gw.close()
+            return output[0]
+
+        def _sorted_values(self):
+            # Sorts the unique values, and returns the sorted list and an array
+            # mapping the temporary numbers to ordinals
+            uniques = self._uniques
+            values = sorted(uniques)
+            ordmap = array("I", [0]) * len(values)
+            for i, v in enumerate(values):
+                ordmap[uniques[v]] = i
+            return values, ordmap
+
+        def _write_dictionary(self, basepos, values):
+            # Writes the sorted dictionary and returns a list of the positions
+            # to write in the footer
+            dbfile = self._dbfile
+            dictpos = dbfile.tell() - basepos
+            offsets = array("I")
+            offset = 0
+            for v in values:
+                offsets.append(offset)
+                dbfile.write(v)
+                offset += len(v)
+            offsets.append(offset)
+            offsetspos = dbfile.tell() - basepos
+            if not self._fixedlen:
+                dbfile.write_array(offsets)
+
+            fstpos = dbfile.tell() - basepos
+            fstlen = 0
+            if self._fst and any(values):
+                fstdata = self._write_fst(values)
+                dbfile.write(fstdata)
+                fstlen = len(fstdata)
+            return [dictpos, offsetspos, fstpos, fstlen, len(values)]
+
+        def _write_footer(self, footer, width):
+            dbfile = self._dbfile
+            for n in footer:
+                dbfile.write_uint(n)
+            dbfile.write_byte(width)
+
+        def finish(self, doccount):
+            dbfile = self._dbfile
+            basepos = dbfile.tell()
+            refs = self._refs
+            if len(refs) < doccount:
+                refs.extend(0 for _ in xrange(doccount - len(refs)))
+
+            values, ordmap = self._sorted_values()
+            width = (len(values) - 1).bit_length()
+            _write_packed(dbfile, [ordmap[ref] for ref in refs[:doccount]],
+                          width)
+            footer = self._write_dictionary(basepos, values)
+            self._write_footer(footer, width)
+
+    class Reader(ColumnReader):
+        # The ordinals are in the same order as the values
+        sorted_ordinals = True
+
+        def __init__(self, dbfile, basepos, length, doccount, fixedlen):
+            self._dbfile = dbfile
+            self._basepos = basepos
+            self._doccount = doccount
+            self._fixedlen = fixedlen
+
+            endpos = basepos + length
+            self._width = dbfile.get_byte(endpos - 1)
+            footer = endpos - 21
+            self._dictpos = basepos + dbfile.get_uint(footer)
+            self._offsetspos = basepos + dbfile.get_uint(footer + 4)
+            self._fstpos = basepos + dbfile.get_uint(footer + 8)
+            self._fstlen = dbfile.get_uint(footer + 12)
+            self._count = dbfile.get_uint(footer + 16)
+
+            self._values = None
+            self._graph = None
+
+        def __repr__(self):
+            return "<DictionaryColumn.Reader>"
+
+        def __len__(self):
+            return self._doccount
+
+        def __getitem__(self, docnum):
+            return self.value(self.ordinal(docnum))
+
+        def __iter__(self):
+            values = self.ordinal_values()
+            for o in self.ordinals():
+                yield values[o]
+
+        def ordinal(self, docnum):
+            """Returns the position of the given document's value in the
+            sorted list of unique values (see :meth:`ordinal_values`).
+            """
+
+            return _read_packed(self._dbfile, self._basepos, self._width,
+                                docnum, docnum + 1)[0]
+
+        def ordinals(self):
+            """Returns an array of the ordinal of every document in the
+            column.
+            """
+
+            return _read_packed(self._dbfile, self._basepos, self._width, 0,
+                                self._doccount)
+
+        def value(self, ordinal):
+            """Returns the unique value with the given ordinal.
+            """
+
+            if self._values is not None:
+                return self._values[ordinal]
+
+            dbfile = self._dbfile
+            fixedlen = self._fixedlen
+            if fixedlen:
+                return dbfile.get(self._dictpos + ordinal * fixedlen, fixedlen)
+            pos = self._offsetspos + ordinal * 4
+            start = dbfile.get_uint(pos)
+            end = dbfile.get_uint(pos + 4)
+            return dbfile.get(self._dictpos + start, end - start)
+
+        def ordinal_values(self):
+            """Returns the sorted list of unique values in this column. This
+            loads the whole dictionary into memory.
+            """
+
+            if self._values is None:
+                dbfile = self._dbfile
+                count = self._count
+                fixedlen = self._fixedlen
+                data = dbfile.get(self._dictpos,
+                                  self._offsetspos - self._dictpos)
+                if fixedlen:
+                    offsets = xrange(0, (count + 1) * fixedlen, fixedlen)
+                else:
+                    offsets = dbfile.get_array(self._offsetspos, "I",
+                                               count + 1)
+                self._values = [data[offsets[i]:offsets[i + 1]]
+                                for i in xrange(count)]
+            return self._values
+
+        def _fst(self):
+            # Returns a GraphReader for the FST of the dictionary, or None if
+            # the column doesn't have one
+            if self._graph is None and self._fstlen:
+                from whoosh.automata import fst
+                from whoosh.filedb.structfile import BufferFile
+
+                data = self._dbfile.get(self._fstpos, self._fstlen)
+                self._graph = fst.GraphReader(BufferFile(data),
+                                              vtype=fst.IntValues)
+            return self._graph
+
+        def _bisect(self, v):
+            # Returns the position of the first unique value >= v
+            lo = 0
+            hi = self._count
+            value = self.value
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if value(mid) < v:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+        def ordinal_of(self, v):
+            """Returns the ordinal of the given value, or None if no document
+            in the column has the value.
+            """
+
+            graph = self._fst()
+            if graph is not None and v:
+                cur = graph.cursor()
+                if cur.find_path(v) and cur.accept():
+                    # The cursor can report a match for a path that only
+                    # partly matched, so check the value of the ordinal
+                    i = cur.value()
+                    if i < self._count and self.value(i) == v:
+                        return i
+                return None
+
+            i = self._bisect(v)
+            if i < self._count and self.value(i) == v:
+                return i
+            return None
+
+        def prefix_ordinals(self, prefix):
+            """Returns a ``(start, end)`` tuple of the range of ordinals
+            (including ``start`` but not ``end``) of the values that start
+            with the given prefix.
+            """
+
+            if not prefix:
+                return 0, self._count
+
+            graph = self._fst()
+            if graph is not None:
+                start, end = self._fst_prefix_ordinals(graph, prefix)
+                # The cursor can report a match for a path that only partly
+                # matched, so check the values at the edges of the range, and
+                # fall back to searching the sorted values if they're wrong
+                if self._is_prefix_range(prefix, start, end):
+                    return start, end
+                return self._bisect_prefix(prefix)
+            return self._bisect_prefix(prefix)
+
+        def _is_prefix_range(self, prefix, start, end):
+            # Returns True if the ordinals from start to end are exactly the
+            # values starting with the prefix
+            value = self.value
+            if start >= end or end > self._count:
+                return False
+            if start > 0 and value(start - 1).startswith(prefix):
+                return False
+            if end < self._count and value(end).startswith(prefix):
+                return False
+            return (value(start).startswith(prefix) and
+                    value(end - 1).startswith(prefix))
+
+        def _bisect_prefix(self, prefix):
+            # Returns the range of ordinals of the values starting with the
+            # prefix by searching the sorted values
+            start = self._bisect(prefix)
+            end = start
+            value = self.value
+            # Find the end of the range by galloping then bisecting
+            step = 1
+            count = self._count
+            while (end < count and
+                   value(end)[:len(prefix)] == prefix):
+                end = min(end + step, count)
+                step *= 2
+            lo = max(start, end - step // 2)
+            while lo < end:
+                mid = (lo + end) // 2
+                if value(mid)[:len(prefix)] == prefix:
+                    lo = mid + 1
+                else:
+                    end = mid
+            return start, end
+
+        def _fst_prefix_ordinals(self, graph, prefix):
+            # Returns the range of ordinals of the values starting with the
+            # prefix using the FST
+            cur = graph.cursor()
+            if not cur.find_path(prefix):
+                return 0, 0
+            # The first key under the prefix has the lowest ordinal
+            first = graph.cursor()
+            first.find_path(prefix)
+            while not first.accept():
+                first.follow()
+            start = first.value()
+            # Follow the last arcs down to the last key under the prefix
+            while not cur.stopped():
+                cur.follow()
+                while not cur.at_last_arc():
+                    cur.next_arc()
+            end = cur.value() + 1
+            if start >= self._count or end > self._count:
+                return 0, 0
+            return start, end
+
+
+class SortedSetColumn(DictionaryColumn):
+    """Stores a set of byte strings for each document, for multi-valued fields
+    such as tags (this is the default column type for
+    :class:`whoosh.fields.KEYWORD`). Like :class:`DictionaryColumn`, the
+    column keeps a sorted dictionary of the unique values, and for each
+    document stores the sorted ordinals of its values, bit-packed, with a
+    packed array of where each document's ordinals start.
+
+    Reading a document's value returns the sorted list of its values. When
+    sorting or grouping without overlap, each document uses its lowest
+    value; documents without values use the default (an empty bytestring).
+    """
+
+    def __init__(self, fixedlen=0, fst=False):
+        """
+        :param fixedlen: an optional fixed length for the values. If you
+            specify a number other than 0, the column will require all values
+            to be the specified length.
+        :param fst: if True, also store the dictionary as a finite state
+            transducer for fast value and prefix lookups.
+        """
+
+        # The default is always the lowest possible value, so it always has
+        # ordinal 0
+        DictionaryColumn.__init__(self, fixedlen=fixedlen, fst=fst)
+
+    def stores_lists(self):
+        return True
+
+    class Writer(DictionaryColumn.Writer):
+        def __init__(self, dbfile, fixedlen, default, fst):
+            DictionaryColumn.Writer.__init__(self, dbfile, fixedlen, default,
+                                             fst)
+            # The temporary numbers of each document's values are buffered in
+            # one array, with an array of where each document's values end
+            self._ends = array("I")
+
+        def __repr__(self):
+            return "<SortedSetColumn.Writer>"
+
+        def add(self, docnum, ls):
+            fixedlen = self._fixedlen
+            refs = self._refs
+            ends = self._ends
+            if docnum > len(ends):
+                ends.extend(len(refs) for _ in xrange(docnum - len(ends)))
+
+            uniques = self._uniques
+            for v in ls:
+                if fixedlen and len(v) != fixedlen:
+                    raise ValueError("Value %r is not %s bytes long"
+                                     % (v, fixedlen))
+                try:
+                    ref = uniques[v]
+                except KeyError:
+                    uniques[v] = ref = len(uniques)
+                refs.append(ref)
+            ends.append(len(refs))
+
+        def finish(self, doccount):
+            dbfile = self._dbfile
+            basepos = dbfile.tell()
+            refs = self._refs
+            ends = self._ends
+            if len(ends) < doccount:
+                ends.extend(len(refs) for _ in xrange(doccount - len(ends)))
+
+            # Translate each document's values to sorted, unique ordinals
+            values, ordmap = self._sorted_values()
+            ords = []
+            starts = [0]
+            start = 0
+            for end in ends[:doccount]:
+                docords = set(ordmap[ref] for ref in refs[start:end])
+                ords.extend(sorted(docords))
+                starts.append(len(ords))
+                start = end
+
+            width = (len(values) - 1).bit_length()
+            _write_packed(dbfile, ords, width)
+            startspos = dbfile.tell() - basepos
+            startswidth = len(ords).bit_length()
+            _write_packed(dbfile, starts, startswidth)
+
+            footer = self._write_dictionary(basepos, values)
+            dbfile.write_uint(startspos)
+            dbfile.write_byte(startswidth)
+            self._write_footer(footer, width)
+
+    class Reader(DictionaryColumn.Reader):
+        def __init__(self, dbfile, basepos, length, doccount, fixedlen):
+            DictionaryColumn.Reader.__init__(self, dbfile, basepos, length,
+                                             doccount, fixedlen)
+            footer = basepos + length - 26
+            self._startspos = basepos + dbfile.get_uint(footer)
+            self._startswidth = dbfile.get_byte(footer + 4)
+
+        def __repr__(self):
+            return "<SortedSetColumn.Reader>"
+
+        def __getitem__(self, docnum):
+            value = self.value
+            return [value(o) for o in self.doc_ordinals(docnum)]
+
+        def __iter__(self):
+            values = self.ordinal_values()
+            starts, ords = self.all_ordinals()
+            for docnum in xrange(self._doccount):
+                yield [values[o] for o
+                       in ords[starts[docnum]:starts[docnum + 1]]]
+
+        def sort_key(self, docnum):
+            return self.value(self.ordinal(docnum))
+
+        def _starts(self, start, end):
+            return _read_packed(self._dbfile, self._startspos,
+                                self._startswidth, start, end)
+
+        def doc_ordinals(self, docnum):
+            """Returns an array of the sorted ordinals of the given document's
+            values.
+            """
+
+            start, end = self._starts(docnum, docnum + 2)
+            return _read_packed(self._dbfile, self._basepos, self._width,
+                                start, end)
+
+        def all_ordinals(self):
+            """Returns a tuple of two arrays, ``(starts, ords)``, where
+            ``ords`` contains the ordinals of every document's values, and the
+            ordinals of document ``n`` are ``ords[starts[n]:starts[n + 1]]``.
+            """
+
+            starts = self._starts(0, self._doccount + 1)
+            ords = _read_packed(self._dbfile, self._basepos, self._width, 0,
+                                starts[-1])
+            return starts, ords
+
+        def ordinal(self, docnum):
+            """Returns the lowest ordinal of the given document's values, or
+            the ordinal of the default if the document has no values.
+            """
+
+            ords = self.doc_ordinals(docnum)
+            return ords[0] if ords else 0
+
+        def ordinals(self):
+            starts, ords = self.all_ordinals()
+            return array("I", (ords[start] if start < end else 0
+                               for start, end in izip(starts, starts[1:])))
+
+
 # Numeric column
 
 class NumericColumn(FixedBytesColumn):
@@ -632,6 +1292,7 @@ class NumericColumn(FixedBytesColumn):
             self._defaultbytes = struct.pack("!" + typecode, default)
             self._fixedlen = struct.calcsize(typecode)
             self._count = length // self._fixedlen
+            self._bounds = None
 
         def __repr__(self):
             return "<Numeric.Reader>"
@@ -655,6 +1316,747 @@ class NumericColumn(FixedBytesColumn):
         def set_reverse(self):
             self._reverse = True
 
+        def block_bounds(self):
+            default = self._default
+            if default != default:
+                # The bounds are meaningless if the default is NaN
+                return None
+
+            if self._bounds is None:
+                count = self._count
+                fmt = "!%d%s" % (count, self._typecode)
+                data = self._dbfile.get(self._basepos, count * self._fixedlen)
+                values = struct.unpack(fmt, data)
+                self._bounds = _block_bounds(values, self._doccount, default,
+                                             self.blocksize)
+
+            lows, highs = self._bounds
+            if self._reverse:
+                lows, highs = ([0 - v for v in highs], [0 - v for v in lows])
+            return self.blocksize, lows, highs
+
+        def docs_in_range(self, low, high):
+            """Returns a sorted array of the document numbers with values
+            between ``low`` and ``high`` (inclusive), by scanning the column.
+            Documents with the default value are treated as having no value.
+            """
+
+            default = self._default
+            return array("I", (docnum for docnum, v in enumerate(self.load())
+                                if low <= v <= high and v != default))
+
+
+# Points column
+
+def _points_tree(start, end, leafsize):
+    # Yields the (start, end) slices of the leaves of the implicit balanced
+    # tree both the points writer and reader use to divide the points between
+    # leaf blocks
+    if start == end:
+        return
+    elif end - start <= leafsize:
+        yield start, end
+    else:
+        mid = (start + end) // 2
+        for leaf in _points_tree(start, mid, leafsize):
+            yield leaf
+        for leaf in _points_tree(mid, end, leafsize):
+            yield leaf
+
+
+class PointsColumn(Column):
+    """Stores fixed-size numbers like :class:`NumericColumn`, but also writes a
+    "points" index of the values, so that the documents with values in a
+    given range can be found with a logarithmic lookup instead of a scan of the
+    column or an expansion of the range into terms.
+
+    The points are bulk-loaded into a k-d tree with fixed-size leaf blocks
+    (the same idea as the "BKD tree" in Lucene): the points are recursively
+    split in half along the dimension with the widest spread. Each leaf stores
+    the bounding box of its points, so a range lookup copies leaves that are
+    completely inside the range, filters leaves that cross it, and skips the
+    rest.
+
+    The column can store one-dimensional numbers, or (with ``dims=2``) tuples
+    of two numbers, such as points on a map. Each document can only have one
+    value. Documents with a value equal to the column's default are treated
+    as having no value and are not added to the points index.
+
+    >>> schema = fields.Schema(date=fields.DATETIME(points=True))
+    >>> ...
+    >>> reader.column_reader("date", translate=False).docs_in_range(lo, hi)
+    """
+
+    reversible = True
+
+    def __init__(self, typecode, default=0, dims=1, leafsize=512):
+        """
+        :param typecode: a typecode character (as used by the ``struct``
+            module) specifying the number type. For example, ``"i"`` for
+            signed integers.
+        :param default: the default value to use for documents that don't
+            specify one. If ``dims`` is greater than 1, this should be a tuple.
+        :param dims: the number of dimensions of the values, 1 or 2.
+        :param leafsize: the maximum number of points in each leaf block of
+            the points index.
+        """
+
+        if dims not in (1, 2):
+            raise ValueError("Points can have 1 or 2 dimensions, not %r"
+                             % (dims,))
+        if dims > 1 and not isinstance(default, tuple):
+            default = (default,) * dims
+
+        self._typecode = typecode
+        self._default = default
+        self._dims = dims
+        self._leafsize = leafsize
+
+    def writer(self, dbfile):
+        return self.Writer(dbfile, self._typecode, self._default, self._dims,
+                           self._leafsize)
+
+    def reader(self, dbfile, basepos, length, doccount):
+        return self.Reader(dbfile, basepos, length, doccount, self._typecode,
+                           self._default, self._dims)
+
+    def default_value(self, reverse=False):
+        v = self._default
+        if reverse:
+            if self._dims > 1:
+                v = tuple(0 - n for n in v)
+            else:
+                v = 0 - v
+        return v
+
+    class Writer(ColumnWriter):
+        def __init__(self, dbfile, typecode, default, dims, leafsize):
+            self._dbfile = dbfile
+            self._typecode = typecode
+            self._struct = struct.Struct("!" + typecode * dims)
+            self._default = default
+            self._dims = dims
+            self._leafsize = leafsize
+            self._docnums = array("I")
+            self._points = []
+
+        def __repr__(self):
+            return "<Points.Writer>"
+
+        def add(self, docnum, v):
+            if v == self._default:
+                return
+            if self._dims == 1:
+                v = (v,)
+            self._docnums.append(docnum)
+            self._points.append(tuple(v))
+
+        def _sort_points(self, order, start, end):
+            # Recursively sorts the slice of the point order along the
+            # dimension with the widest spread and splits it in half, until
+            # the slices are small enough to be leaves
+            if end - start <= self._leafsize:
+                return
+
+            points = self._points
+            dim = 0
+            if self._dims > 1:
+                spread = -1
+                for d in xrange(self._dims):
+                    vals = [points[i][d] for i in order[start:end]]
+                    s = max(vals) - min(vals)
+                    if s > spread:
+                        dim, spread = d, s
+            order[start:end] = sorted(order[start:end],
+                                      key=lambda i: points[i][dim])
+
+            mid = (start + end) // 2
+            self._sort_points(order, start, mid)
+            self._sort_points(order, mid, end)
+
+        def finish(self, doccount):
+            dbfile = self._dbfile
+            pack = self._struct.pack
+            dims = self._dims
+            docnums = self._docnums
+            points = self._points
+            npoints = len(points)
+
+            # Write the fixed-size per-document values
+            defaultbytes = pack(*(self._default if dims > 1
+                                  else (self._default,)))
+            count = 0
+            for docnum, point in zip(docnums, points):
+                if docnum > count:
+                    dbfile.write(defaultbytes * (docnum - count))
+                dbfile.write(pack(*point))
+                count = docnum + 1
+            if doccount > count:
+                dbfile.write(defaultbytes * (doccount - count))
+
+            # Sort the points into leaf order
+            order = list(xrange(npoints))
+            self._sort_points(order, 0, npoints)
+
+            # Write the document numbers and the values in leaf order
+            dbfile.write_array(array("I", (docnums[i] for i in order)))
+            leaves = list(_points_tree(0, npoints, self._leafsize))
+            for start, end in leaves:
+                for i in order[start:end]:
+                    dbfile.write(pack(*points[i]))
+
+            # Write the bounding box of each leaf
+            for start, end in leaves:
+                leafpoints = [points[i] for i in order[start:end]]
+                for fn in (min, max):
+                    dbfile.write(pack(*[fn(p[d] for p in leafpoints)
+                                        for d in xrange(dims)]))
+
+            dbfile.write_uint(npoints)
+            dbfile.write_uint(self._leafsize)
+
+            self._docnums = self._points = None
+
+    class Reader(ColumnReader):
+        fast_ranges = True
+
+        def __init__(self, dbfile, basepos, length, doccount, typecode,
+                     default, dims):
+            self._dbfile = dbfile
+            self._basepos = basepos
+            self._doccount = doccount
+            self._default = default
+            self._dims = dims
+            self._reverse = False
+
+            self._typecode = typecode
+            self._struct = struct.Struct("!" + typecode * dims)
+            self._recsize = self._struct.size
+
+            endpos = basepos + length
+            self._npoints = dbfile.get_uint(endpos - 8)
+            self._leafsize = dbfile.get_uint(endpos - 4)
+            self._docspos = basepos + doccount * self._recsize
+            self._valuespos = self._docspos + self._npoints * 4
+            self._boxespos = self._valuespos + self._npoints * self._recsize
+            self._root = None
+            self._bounds = None
+
+        def __repr__(self):
+            return "<Points.Reader>"
+
+        def __getitem__(self, docnum):
+            pos = self._basepos + self._recsize * docnum
+            v = self._struct.unpack(self._dbfile.get(pos, self._recsize))
+            if self._dims == 1:
+                v = v[0]
+            return v
+
+        def sort_key(self, docnum):
+            key = self[docnum]
+            if self._reverse:
+                if self._dims > 1:
+                    key = tuple(0 - n for n in key)
+                else:
+                    key = 0 - key
+            return key
+
+        def set_reverse(self):
+            self._reverse = True
+
+        def block_bounds(self):
+            if self._dims > 1:
+                return None
+
+            if self._bounds is None:
+                doccount = self._doccount
+                fmt = "!%d%s" % (doccount, self._typecode)
+                data = self._dbfile.get(self._basepos,
+                                        doccount * self._recsize)
+                values = struct.unpack(fmt, data)
+                self._bounds = _block_bounds(values, doccount, self._default,
+                                             self.blocksize)
+
+            lows, highs = self._bounds
+            if self._reverse:
+                lows, highs = ([0 - v for v in highs], [0 - v for v in lows])
+            return self.blocksize, lows, highs
+
+        def point_count(self):
+            """Returns the number of documents with values in this column.
+            """
+
+            return self._npoints
+
+        def _tree(self):
+            # Reads the leaf bounding boxes and rebuilds the implicit tree
+            # over them. Each node is a (start, end, mins, maxes, children)
+            # tuple, where children is None for leaves
+            if self._root is None:
+                dbfile = self._dbfile
+                unpack = self._struct.unpack
+                recsize = self._recsize
+                leaves = []
+                pos = self._boxespos
+                for start, end in _points_tree(0, self._npoints,
+                                               self._leafsize):
+                    mins = unpack(dbfile.get(pos, recsize))
+                    maxes = unpack(dbfile.get(pos + recsize, recsize))
+                    leaves.append((start, end, mins, maxes, None))
+                    pos += recsize * 2
+                self._root = self._build_node(iter(leaves), 0, self._npoints)
+            return self._root
+
+        def _build_node(self, leaves, start, end):
+            if end - start <= self._leafsize:
+                return next(leaves) if start < end else None
+            mid = (start + end) // 2
+            left = self._build_node(leaves, start, mid)
+            right = self._build_node(leaves, mid, end)
+            dims = xrange(self._dims)
+            mins = tuple(min(left[2][d], right[2][d]) for d in dims)
+            maxes = tuple(max(left[3][d], right[3][d]) for d in dims)
+            return start, end, mins, maxes, (left, right)
+
+        def _leaf_docs(self, start, end):
+            return self._dbfile.get_array(self._docspos + start * 4, "I",
+                                          end - start)
+
+        def _leaf_values(self, start, end):
+            recsize = self._recsize
+            fmt = "!%d%s" % ((end - start) * self._dims, self._typecode)
+            return struct.unpack(fmt, self._dbfile.get(
+                self._valuespos + start * recsize, (end - start) * recsize))
+
+        def docs_in_range(self, low, high):
+            """Returns a sorted array of the document numbers with values
+            between ``low`` and ``high`` (inclusive). For a column with more
+            than one dimension, ``low`` and ``high`` are tuples giving the
+            opposite corners of a box.
+            """
+
+            dims = self._dims
+            if dims == 1:
+                low = (low,)
+                high = (high,)
+            dimrange = xrange(dims)
+
+            root = self._tree()
+            stack = [root] if root else []
+            docnums = array("I")
+            while stack:
+                start, end, mins, maxes, children = stack.pop()
+                if any(maxes[d] < low[d] or mins[d] > high[d]
+                       for d in dimrange):
+                    # The node is completely outside the range
+                    continue
+                if all(low[d] <= mins[d] and maxes[d] <= high[d]
+                       for d in dimrange):
+                    # The node is completely inside the range
+                    docnums.extend(self._leaf_docs(start, end))
+                elif children:
+                    stack.extend(children)
+                else:
+                    # The leaf crosses the range, so check each point
+                    leafdocs = self._leaf_docs(start, end)
+                    values = self._leaf_values(start, end)
+                    for i, docnum in enumerate(leafdocs):
+                        base = i * dims
+                        if all(low[d] <= values[base + d] <= high[d]
+                               for d in dimrange):
+                            docnums.append(docnum)
+            return array("I", sorted(docnums))
+
+
+# Block column
+
+def _pack_bits(values, width):
+    # Packs a list of non-negative integers into bytes, using the given number
+    # of bits for each value
+    if not width or not values:
+        return emptybytes
+    n = 0
+    for v in reversed(values):
+        n = (n << width) | v
+    nbytes = (len(values) * width + 7) // 8
+    return unhexlify("%0*x" % (nbytes * 2, n))
+
+
+def _unpack_bits(data, width, count):
+    # The inverse of _pack_bits
+    if not width:
+        return [0] * count
+    n = int(hexlify(data), 16)
+    mask = (1 << width) - 1
+    return [(n >> (i * width)) & mask for i in xrange(count)]
+
+
+class _BlockCache(object):
+    # A small thread-safe cache of decoded blocks, shared by all block column
+    # readers. When the cache is full it throws away the least recently used
+    # tenth of the blocks
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = {}
+        self._lastused = {}
+        self._clock = 0
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._clock += 1
+                self._lastused[key] = self._clock
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.maxsize:
+                for k, _ in nsmallest(self.maxsize // 10 or 1,
+                                      iteritems(self._lastused),
+                                      key=itemgetter(1)):
+                    del self._data[k]
+                    del self._lastused[k]
+            self._clock += 1
+            self._data[key] = value
+            self._lastused[key] = self._clock
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._lastused.clear()
+
+
+class BlockColumn(Column):
+    """Stores integers in blocks of a fixed number of documents. Each block
+    is encoded with either "frame of reference" encoding (each value is
+    stored as its difference from the block's minimum, using only as many
+    bits as the largest difference needs) or, if the block has few distinct
+    values, dictionary encoding (each value is stored as a small index into
+    a sorted list of the block's values), whichever is smaller.
+
+    The column keeps a directory of the blocks with the minimum and maximum
+    value and the number of documents without a value ("nulls") in each
+    block. Range lookups (:meth:`BlockColumn.Reader.docs_in_range`) and
+    sorting (through :meth:`ColumnReader.block_bounds`) use the directory to
+    skip blocks without decoding them. Decoded blocks are kept in a small
+    cache shared by all readers, so random access to nearby documents only
+    decodes each block once.
+
+    Documents without a value, or with a value equal to the column's default,
+    are stored as nulls and read back as the default.
+
+    >>> schema = fields.Schema(price=fields.NUMERIC(blocks=True))
+    """
+
+    reversible = True
+
+    # Shared cache of decoded blocks
+    cache = _BlockCache()
+
+    def __init__(self, typecode="q", default=0, blocksize=128):
+        """
+        :param typecode: a typecode character (as used by the ``struct``
+            module) specifying the integer type. For example, ``"i"`` for
+            signed 32-bit integers.
+        :param default: the default value to use for documents that don't
+            specify one.
+        :param blocksize: the number of documents in each block.
+        """
+
+        if typecode not in "bBhHiIlLqQ":
+            raise ValueError("BlockColumn only stores integers, not %r"
+                             % (typecode,))
+        if not 0 < blocksize <= 65535:
+            raise ValueError("Invalid block size %r" % (blocksize,))
+
+        self._typecode = typecode
+        self._default = default
+        self._blocksize = blocksize
+
+    def writer(self, dbfile):
+        return self.Writer(dbfile, self._typecode, self._default,
+                           self._blocksize)
+
+    def reader(self, dbfile, basepos, length, doccount):
+        return self.Reader(dbfile, basepos, length, doccount, self._typecode,
+                           self._default)
+
+    def default_value(self, reverse=False):
+        v = self._default
+        if reverse:
+            v = 0 - v
+        return v
+
+    # Block encodings
+    EMPTY = 0
+    FOR = 1
+    DICT = 2
+
+    @staticmethod
+    def _directory_struct(typecode):
+        # Offset, length, null count, min, max, encoding
+        return struct.Struct("!IIH%s%sB" % (typecode, typecode))
+
+    class Writer(ColumnWriter):
+        def __init__(self, dbfile, typecode, default, blocksize):
+            self._dbfile = dbfile
+            self._default = default
+            self._blocksize = blocksize
+            self._dirstruct = BlockColumn._directory_struct(typecode)
+            self._pack = struct.Struct("!" + typecode).pack
+
+            self._startpos = dbfile.tell()
+            self._directory = []
+            # The document number of the first document in the current block,
+            # and the values of the block (None for documents without a value)
+            self._blockstart = 0
+            self._values = [None] * blocksize
+
+        def __repr__(self):
+            return "<BlockColumn.Writer>"
+
+        def _encode(self, values):
+            # Returns an (encoding, data) tuple for the non-null values of a
+            # block, using whichever encoding is smaller
+            lo = min(values)
+            width = (max(values) - lo).bit_length()
+            fordata = b(chr(width)) + _pack_bits([v - lo for v in values],
+                                                 width)
+
+            distinct = sorted(set(values))
+            if len(distinct) <= 256:
+                codewidth = (len(distinct) - 1).bit_length()
+                codes = dict((v, i) for i, v in enumerate(distinct))
+                dictdata = (b(chr(width) + chr(len(distinct) - 1))
+                            + _pack_bits([v - lo for v in distinct], width)
+                            + _pack_bits([codes[v] for v in values],
+                                         codewidth))
+                if len(dictdata) < len(fordata):
+                    return BlockColumn.DICT, dictdata
+            return BlockColumn.FOR, fordata
+
+        def _flush(self, count):
+            # Writes the block of the first count documents in the buffer
+            dbfile = self._dbfile
+            values = self._values[:count]
+            nonnull = [v for v in values if v is not None]
+            nulls = count - len(nonnull)
+            default = self._default
+            offset = dbfile.tell() - self._startpos
+
+            if not nonnull:
+                encoding = BlockColumn.EMPTY
+                lo = hi = 0
+                data = emptybytes
+            else:
+                lo = min(nonnull)
+                hi = max(nonnull)
+                encoding, data = self._encode(nonnull)
+                if nulls:
+                    # Prefix a bitmap of which documents have values
+                    data = _pack_bits([int(v is not None) for v in values],
+                                      1) + data
+            dbfile.write(data)
+            self._directory.append((offset, len(data), nulls, lo, hi,
+                                    encoding))
+            self._values = [None] * self._blocksize
+
+        def add(self, docnum, v):
+            if v == self._default:
+                return
+            blocksize = self._blocksize
+            while docnum >= self._blockstart + blocksize:
+                self._flush(blocksize)
+                self._blockstart += blocksize
+            self._values[docnum - self._blockstart] = v
+
+        def finish(self, doccount):
+            blocksize = self._blocksize
+            while self._blockstart < doccount:
+                self._flush(min(blocksize, doccount - self._blockstart))
+                self._blockstart += blocksize
+
+            dbfile = self._dbfile
+            pack = self._dirstruct.pack
+            for entry in self._directory:
+                dbfile.write(pack(*entry))
+            dbfile.write_uint(len(self._directory))
+            dbfile.write_uint(blocksize)
+            # A random identifier for this column's data, used to key its
+            # blocks in the shared cache
+            dbfile.write_ulong(getrandbits(64))
+
+    class Reader(ColumnReader):
+        fast_ranges = True
+
+        def __init__(self, dbfile, basepos, length, doccount, typecode,
+                     default):
+            self._dbfile = dbfile
+            self._basepos = basepos
+            self._doccount = doccount
+            self._default = default
+            self._reverse = False
+
+            endpos = basepos + length - 16
+            nblocks = dbfile.get_uint(endpos)
+            self.blocksize = dbfile.get_uint(endpos + 4)
+            # Readers of the same data share their decoded blocks
+            self._cachekey = (dbfile.get_ulong(endpos + 8),)
+
+            dirstruct = BlockColumn._directory_struct(typecode)
+            dirsize = dirstruct.size
+            dirdata = dbfile.get(endpos - nblocks * dirsize,
+                                 nblocks * dirsize)
+            # List of (offset, length, nulls, min, max, encoding) tuples
+            self._directory = [dirstruct.unpack(dirdata[i:i + dirsize])
+                               for i in xrange(0, len(dirdata), dirsize)]
+
+        def __repr__(self):
+            return "<BlockColumn.Reader>"
+
+        def _block_count(self, blocknum):
+            # The number of documents in the given block
+            start = blocknum * self.blocksize
+            return min(self.blocksize, self._doccount - start)
+
+        def _decode(self, blocknum):
+            offset, length, nulls, lo, _, encoding = self._directory[blocknum]
+            count = self._block_count(blocknum)
+            default = self._default
+            if encoding == BlockColumn.EMPTY:
+                return [default] * count
+
+            data = self._dbfile.get(self._basepos + offset, length)
+            present = None
+            if nulls:
+                bitmaplen = (count + 7) // 8
+                present = _unpack_bits(data[:bitmaplen], 1, count)
+                data = data[bitmaplen:]
+            nvalues = count - nulls
+
+            width = ord(data[0:1])
+            if encoding == BlockColumn.FOR:
+                values = [lo + v for v in _unpack_bits(data[1:], width,
+                                                       nvalues)]
+            else:
+                ndistinct = ord(data[1:2]) + 1
+                distlen = (ndistinct * width + 7) // 8
+                distinct = [lo + v for v in _unpack_bits(data[2:2 + distlen],
+                                                         width, ndistinct)]
+                codewidth = (ndistinct - 1).bit_length()
+                values = [distinct[code] for code
+                          in _unpack_bits(data[2 + distlen:], codewidth,
+                                          nvalues)]
+
+            if present is not None:
+                it = iter(values)
+                values = [next(it) if p else default for p in present]
+            return values
+
+        def _block(self, blocknum):
+            # Returns the decoded values of the given block, using the shared
+            # cache
+            cache = BlockColumn.cache
+            key = self._cachekey + (blocknum,)
+            values = cache.get(key)
+            if values is None:
+                values = self._decode(blocknum)
+                cache.put(key, values)
+            return values
+
+        def __getitem__(self, docnum):
+            blocknum = docnum // self.blocksize
+            if blocknum >= len(self._directory):
+                return self._default
+            if self._directory[blocknum][5] == BlockColumn.EMPTY:
+                return self._default
+            return self._block(blocknum)[docnum % self.blocksize]
+
+        def __iter__(self):
+            for blocknum in xrange(len(self._directory)):
+                for v in self._decode(blocknum):
+                    yield v
+            for _ in xrange(len(self._directory) * self.blocksize,
+                            self._doccount):
+                yield self._default
+
+        def sort_key(self, docnum):
+            key = self[docnum]
+            if self._reverse:
+                key = 0 - key
+            return key
+
+        def set_reverse(self):
+            self._reverse = True
+
+        def block_bounds(self):
+            default = self._default
+            if default != default:
+                # NaN can't be compared, so the bounds are useless
+                return None
+
+            lows = []
+            highs = []
+            for _, _, nulls, lo, hi, encoding in self._directory:
+                if encoding == BlockColumn.EMPTY:
+                    lo = hi = default
+                elif nulls:
+                    lo = min(lo, default)
+                    hi = max(hi, default)
+                lows.append(lo)
+                highs.append(hi)
+
+            if self._reverse:
+                lows, highs = ([0 - v for v in highs], [0 - v for v in lows])
+            return self.blocksize, lows, highs
+
+        def null_count(self, blocknum):
+            """Returns the number of documents without a value in the given
+            block.
+            """
+
+            return self._directory[blocknum][2]
+
+        def docs_in_range(self, low, high):
+            """Returns a sorted array of the document numbers with values
+            between ``low`` and ``high`` (inclusive). Documents without a
+            value are not included. Only the blocks that cross the edges of
+            the range are decoded.
+            """
+
+            blocksize = self.blocksize
+            docnums = array("I")
+            for blocknum, entry in enumerate(self._directory):
+                _, _, nulls, lo, hi, encoding = entry
+                if encoding == BlockColumn.EMPTY or hi < low or lo > high:
+                    # No document in the block can match
+                    continue
+
+                start = blocknum * blocksize
+                count = self._block_count(blocknum)
+                if low <= lo and hi <= high and not nulls:
+                    # Every document in the block matches
+                    docnums.extend(xrange(start, start + count))
+                    continue
+
+                default = self._default
+                values = self._block(blocknum)
+                if nulls:
+                    # Find which documents actually have values
+                    offset, length = entry[0], entry[1]
+                    bitmap = self._dbfile.get(self._basepos + offset,
+                                              (count + 7) // 8)
+                    present = _unpack_bits(bitmap, 1, count)
+                else:
+                    present = None
+                for i, v in enumerate(values):
+                    if low <= v <= high and (present is None or present[i]):
+                        docnums.append(start + i)
+            return docnums
+
 
 # Column of boolean values
 
@@ -1001,6 +2403,150 @@ class StructColumn(FixedBytesColumn):
             return self._struct.unpack(v)
 
 
+# Stored fields column
+
+# The length of the table at the start of a stored fields record
+_sfheadlen = struct.Struct("!I")
+
+
+class StoredFieldsColumn(Column):
+    """Stores a dictionary of stored field values for each document.
+
+    Values whose pickles are larger than ``compress_over`` bytes are pickled
+    and compressed separately, and the other values are pickled together in
+    one dictionary. Each document's record starts with a table of the names
+    and lengths of the large values. This lets the reader load a subset of a
+    document's fields (see :meth:`StoredFieldsColumn.Reader.fields`) without
+    reading, decompressing, or unpickling the large values of the other
+    fields, while reading a whole document still only takes a few unpickling
+    calls.
+    """
+
+    def __init__(self, compress_over=256, level=3):
+        """
+        :param compress_over: pickled values longer than this many bytes are
+            stored separately and compressed using zlib.
+        :param level: the compression level to use.
+        """
+
+        self._compress_over = compress_over
+        self._level = level
+
+    def writer(self, dbfile):
+        return self.Writer(dbfile, self._compress_over, self._level)
+
+    class Writer(VarBytesColumn.Writer):
+        def __init__(self, dbfile, compress_over, level):
+            VarBytesColumn.Writer.__init__(self, dbfile)
+            self._compress_over = compress_over
+            self._level = level
+
+        def __repr__(self):
+            return "<StoredFields.Writer>"
+
+        def add(self, docnum, d):
+            if not d:
+                return
+            compress_over = self._compress_over
+            small = {}
+            table = []
+            values = []
+            for name in sorted(d):
+                v = dumps(d[name], -1)
+                if len(v) <= compress_over:
+                    small[name] = d[name]
+                    continue
+                compressed = 0
+                if zlib:
+                    v = zlib.compress(v, self._level)
+                    compressed = 1
+                table.append((name, len(v), compressed))
+                values.append(v)
+
+            smallbytes = dumps(small, -1) if small else emptybytes
+            head = dumps((len(smallbytes), table), -1)
+            record = emptybytes.join([_sfheadlen.pack(len(head)), head,
+                                      smallbytes] + values)
+            VarBytesColumn.Writer.add(self, docnum, record)
+
+    class Reader(VarBytesColumn.Reader):
+        # The number of bytes to read at the start of a record when only
+        # reading some of its values. If the table of large values is longer,
+        # the reader reads the rest of it separately
+        _prefix_size = 128
+
+        def __repr__(self):
+            return "<StoredFields.Reader>"
+
+        def _value(self, v, compressed):
+            if compressed:
+                v = zlib.decompress(v)
+            return loads(v)
+
+        def __getitem__(self, docnum):
+            length = self._lengths[docnum]
+            if not length:
+                return {}
+            data = self._dbfile.get(self._basepos + self._offsets[docnum],
+                                    length)
+            hsize = _sfheadlen.size
+            pos = hsize + _sfheadlen.unpack(data[:hsize])[0]
+            smalllen, table = loads(data[hsize:pos])
+            d = loads(data[pos:pos + smalllen]) if smalllen else {}
+            pos += smalllen
+            value = self._value
+            for name, vlen, compressed in table:
+                d[name] = value(data[pos:pos + vlen], compressed)
+                pos += vlen
+            return d
+
+        def fields(self, docnum, fieldnames):
+            """Returns a dictionary of the values of the given fields in the
+            given document. Large values of other fields are not read from
+            disk.
+
+            :param docnum: the document number.
+            :param fieldnames: a collection of field names to return.
+            """
+
+            length = self._lengths[docnum]
+            if not length:
+                return {}
+            get = self._dbfile.get
+            pos = self._basepos + self._offsets[docnum]
+
+            # Read the table of large values from the start of the record
+            hsize = _sfheadlen.size
+            data = get(pos, min(length, self._prefix_size))
+            end = hsize + _sfheadlen.unpack(data[:hsize])[0]
+            if end > len(data):
+                data = get(pos, end)
+            smalllen, table = loads(data[hsize:end])
+            pos += end
+
+            out = {}
+            wanted = set(fieldnames)
+            if smalllen:
+                large = set(entry[0] for entry in table)
+                if not wanted.issubset(large):
+                    small = loads(get(pos, smalllen))
+                    for name in wanted:
+                        if name in small:
+                            out[name] = small[name]
+            pos += smalllen
+
+            value = self._value
+            for name, vlen, compressed in table:
+                if name in wanted:
+                    out[name] = value(get(pos, vlen), compressed)
+                pos += vlen
+            return out
+
+        def __iter__(self):
+            for docnum in xrange(self._doccount):
+                yield self[docnum]
+
+
 # Utility readers
 
 class EmptyColumnReader(ColumnReader):
@@ -1008,6 +2554,9 @@ class EmptyColumnReader(ColumnReader):
     the default.
     """
 
+    # The only ordinal value is the default
+    sorted_ordinals = True
+
     def __init__(self, default, doccount):
         """
         :param default: the value to return for all "get" requests.
@@ -1020,6 +2569,15 @@ class EmptyColumnReader(ColumnReader):
     def __getitem__(self, docnum):
         return self._default
 
+    def ordinal(self, docnum):
+        return 0
+
+    def ordinal_values(self):
+        return [self._default]
+
+    def ordinals(self):
+        return array("B", [0]) * self._doccount
+
     def __iter__(self):
         return (self._default for _ in xrange(self._doccount))
 
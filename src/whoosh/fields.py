@@ -427,7 +427,7 @@ class NUMERIC(FieldType):
 
     def __init__(self, numtype=int, bits=32, stored=False, unique=False,
                  field_boost=1.0, decimal_places=0, shift_step=4, signed=True,
-                 sortable=False, default=None):
+                 sortable=False, default=None, points=False, blocks=False):
         """
         :param numtype: the type of numbers that can be stored in this field,
             either ``int``, ``float``. If you use ``Decimal``,
@@ -447,6 +447,15 @@ class NUMERIC(FieldType):
             of `0` means no tiered indexing.
         :param signed: Whether the numbers stored in this field may be
             negative.
+        :param points: if True, the field's column (implies ``sortable``) is
+            a :class:`whoosh.columns.PointsColumn`, which indexes the values so
+            :class:`whoosh.query.NumericRange` queries can find matching
+            documents without expanding the range into terms. The column only
+            stores one value per document.
+        :param blocks: if True, the field's column (implies ``sortable``) is
+            a :class:`whoosh.columns.BlockColumn`, which stores the values in
+            compressed blocks with the minimum and maximum value of each
+            block, so range queries and sorting can skip whole blocks.
         """
 
         # Allow users to specify strings instead of Python types in case
@@ -504,8 +513,13 @@ class NUMERIC(FieldType):
             raise Exception("The default %r is not a valid number for this "
                             "field" % default)
 
+        if points and blocks:
+            raise ValueError("A field can't use both points and blocks")
+
         self.default = default
-        self.set_sortable(sortable)
+        self.points = points
+        self.blocks = blocks
+        self.set_sortable(sortable or points or blocks)
 
     def __getstate__(self):
         d = self.__dict__.copy()
@@ -531,6 +545,12 @@ class NUMERIC(FieldType):
         return min_value, max_value
 
     def default_column(self):
+        if getattr(self, "points", False):
+            return columns.PointsColumn(self.sortable_typecode,
+                                        default=self.default)
+        if getattr(self, "blocks", False):
+            return columns.BlockColumn(self.sortable_typecode,
+                                       default=self.default)
         return columns.NumericColumn(self.sortable_typecode,
                                      default=self.default)
 
@@ -598,6 +618,15 @@ class NUMERIC(FieldType):
         x = from_sortable(self.numtype, self.bits, self.signed, x)
         return self.unprepare_number(x)
 
+    def number_to_column_value(self, x):
+        """Converts a number that has already been passed through
+        ``prepare_number()`` (such as the bounds of a
+        :class:`whoosh.query.NumericRange`) into the representation stored in
+        this field's column.
+        """
+
+        return to_sortable(self.numtype, self.bits, self.signed, x)
+
     def to_bytes(self, x, shift=0):
         # Try to avoid re-encoding; this sucks because on Python 2 we can't
         # tell the difference between a string and encoded bytes, so we have
@@ -689,16 +718,24 @@ class DATETIME(NUMERIC):
 
     __inittypes__ = dict(stored=bool, unique=bool)
 
-    def __init__(self, stored=False, unique=False, sortable=False):
+    def __init__(self, stored=False, unique=False, sortable=False,
+                 points=False, blocks=False):
         """
         :param stored: Whether the value of this field is stored with the
             document.
         :param unique: Whether the value of this field is unique per-document.
+        :param points: if True, index the dates in a points column so
+            :class:`whoosh.query.DateRange` queries don't have to expand the
+            range into terms. See :class:`NUMERIC`.
+        :param blocks: if True, store the dates in a block column so range
+            queries and sorting can skip blocks of documents. See
+            :class:`NUMERIC`.
         """
 
         super(DATETIME, self).__init__(int, 64, stored=stored,
                                        unique=unique, shift_step=8,
-                                       sortable=sortable)
+                                       sortable=sortable, points=points,
+                                       blocks=blocks)
 
     def prepare_datetime(self, x):
         from whoosh.util.times import floor
@@ -726,6 +763,10 @@ class DATETIME(NUMERIC):
     def from_column_value(self, x):
         return long_to_datetime(x)
 
+    def number_to_column_value(self, x):
+        # The column stores the datetime as a long without any conversion
+        return x
+
     def to_bytes(self, x, shift=0):
         x = self.prepare_datetime(x)
         return NUMERIC.to_bytes(self, x, shift=shift)
@@ -919,6 +960,9 @@ class KEYWORD(FieldType):
         :param comma: Whether this is a comma-separated field. If this is False
             (the default), it is treated as a space-separated field.
         :param scorable: Whether this field is scorable.
+        :param sortable: Whether to store the keywords of each document in a
+            column (by default a :class:`whoosh.columns.SortedSetColumn`) for
+            fast sorting and faceting.
         """
 
         self.analyzer = analysis.KeywordAnalyzer(lowercase=lowercase,
@@ -940,8 +984,21 @@ class KEYWORD(FieldType):
             vector = None
         self.vector = vector
 
-        if sortable:
-            self.column_type = self.default_column()
+        self.set_sortable(sortable)
+
+    def default_column(self):
+        return columns.SortedSetColumn()
+
+    def to_column_value(self, value):
+        if self.column_type.stores_lists():
+            # Store the set of keywords
+            return sorted(set(btext for btext, _, _, _ in self.index(value)))
+        return FieldType.to_column_value(self, value)
+
+    def from_column_value(self, value):
+        if isinstance(value, list):
+            return [self.from_bytes(v) for v in value]
+        return self.from_bytes(value)
 
 
 class TEXT(FieldType):
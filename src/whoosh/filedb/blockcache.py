@@ -0,0 +1,362 @@
+# Copyright 2012 Matt Chaput. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY MATT CHAPUT ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL MATT CHAPUT OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Matt Chaput.
+
+"""
+This module contains a storage wrapper that keeps recently read blocks of
+files in a fixed-size in-process cache. This is useful with storages that
+don't memory-map files, such as :class:`~whoosh.filedb.filestore.RamStorage`,
+:class:`~whoosh.filedb.filestore.OverlayStorage`, or a
+:class:`~whoosh.filedb.filestore.FileStorage` created with
+``supports_mmap=False`` (for example on a network filesystem), where every
+read of the index otherwise turns into a seek and a read on the underlying
+file::
+
+    from whoosh.filedb.blockcache import CachingStorage
+    from whoosh.filedb.filestore import FileStorage
+
+    st = CachingStorage(FileStorage("indexdir", supports_mmap=False),
+                        cachesize=256)
+    ix = st.open_index()
+"""
+
+from threading import Lock
+
+from whoosh.compat import b, xrange
+from whoosh.filedb.filestore import Storage
+from whoosh.filedb.structfile import StructFile
+from whoosh.system import emptybytes
+
+
+class BlockCache(object):
+    """A fixed-size cache of file blocks, shared by all the files opened
+    through a :class:`CachingStorage`. Blocks are evicted using the CLOCK
+    algorithm (an approximation of least-recently-used that only needs to set
+    a flag when a block is read).
+    """
+
+    def __init__(self, cachesize=64, blocksize=4096):
+        """
+        :param cachesize: the maximum size of the cache in megabytes.
+        :param blocksize: the size of each cached block in bytes. Blocks start
+            at multiples of this size in the file, so it should usually be the
+            page size of the operating system.
+        """
+
+        self.blocksize = blocksize
+        self.capacity = max(1, int(cachesize * 1024 * 1024) // blocksize)
+
+        # Each slot holds the key of a cached block, and the data and the
+        # "referenced" flag of the block in the slot are in parallel lists
+        self._slots = []
+        self._data = []
+        self._refs = []
+        self._keymap = {}
+        self._hand = 0
+        self._stats = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _stat(self, name):
+        try:
+            return self._stats[name]
+        except KeyError:
+            stat = self._stats[name] = {"hits": 0, "misses": 0,
+                                        "evictions": 0}
+            return stat
+
+    def block(self, key, blocknum, loader):
+        """Returns the data for the given block of the given file, calling
+        ``loader(blocknum)`` to read it if it isn't in the cache.
+
+        :param key: a ``(name, length)`` tuple identifying the file.
+        :param blocknum: the number of the block in the file.
+        :param loader: a function that reads the given block from the file.
+        """
+
+        bkey = (key, blocknum)
+        with self._lock:
+            slot = self._keymap.get(bkey)
+            if slot is not None:
+                self._refs[slot] = True
+                self._stat(key[0])["hits"] += 1
+                return self._data[slot]
+            self._stat(key[0])["misses"] += 1
+
+        # Read the block outside the lock so other threads can use the cache
+        # while we're waiting on the storage
+        data = loader(blocknum)
+
+        with self._lock:
+            if bkey in self._keymap:
+                # Another thread loaded the same block in the meantime
+                return data
+
+            if len(self._slots) < self.capacity:
+                slot = len(self._slots)
+                self._slots.append(bkey)
+                self._data.append(data)
+                self._refs.append(False)
+            else:
+                slot = self._victim()
+                oldkey = self._slots[slot]
+                if oldkey is not None:
+                    del self._keymap[oldkey]
+                    self._stat(oldkey[0][0])["evictions"] += 1
+                self._slots[slot] = bkey
+                self._data[slot] = data
+                self._refs[slot] = False
+            self._keymap[bkey] = slot
+        return data
+
+    def _victim(self):
+        # Move the clock hand around the slots, clearing referenced flags,
+        # until it finds an empty slot or one that hasn't been referenced
+        # since the last time the hand passed it
+        slots = self._slots
+        refs = self._refs
+        count = len(slots)
+        while True:
+            slot = self._hand
+            self._hand = (slot + 1) % count
+            if slots[slot] is None or not refs[slot]:
+                return slot
+            refs[slot] = False
+
+    def forget(self, name):
+        """Removes all cached blocks of the file with the given name.
+        """
+
+        with self._lock:
+            for slot in xrange(len(self._slots)):
+                bkey = self._slots[slot]
+                if bkey is not None and bkey[0][0] == name:
+                    del self._keymap[bkey]
+                    self._slots[slot] = None
+                    self._data[slot] = None
+                    self._refs[slot] = False
+
+    def clear(self):
+        """Removes all blocks from the cache and resets the statistics.
+        """
+
+        with self._lock:
+            self._slots = []
+            self._data = []
+            self._refs = []
+            self._keymap = {}
+            self._hand = 0
+            self._stats = {}
+
+    def stats(self):
+        """Returns a dictionary mapping file names to dictionaries containing
+        the number of ``"hits"``, ``"misses"`` and ``"evictions"`` of blocks
+        of that file.
+        """
+
+        with self._lock:
+            return dict((name, dict(stat))
+                        for name, stat in self._stats.items())
+
+
+class CachedFile(object):
+    """A read-only file-like object that reads the blocks of an underlying
+    file through a :class:`BlockCache`. Use :meth:`CachingStorage.open_file`
+    instead of instantiating this object directly.
+    """
+
+    def __init__(self, rawfile, key, length, cache):
+        self._raw = rawfile
+        self._key = key
+        self._length = length
+        self._cache = cache
+        self._pos = 0
+        self.closed = False
+
+    def _load(self, blocknum):
+        blocksize = self._cache.blocksize
+        return self._raw.get(blocknum * blocksize, blocksize)
+
+    def get(self, position, length):
+        end = min(position + length, self._length)
+        if position >= end:
+            return emptybytes
+
+        cache = self._cache
+        blocksize = cache.blocksize
+        first = position // blocksize
+        last = (end - 1) // blocksize
+        if last - first >= cache.capacity // 2:
+            # Don't flush the whole cache to serve one huge read
+            return self._raw.get(position, end - position)
+
+        block = cache.block
+        key = self._key
+        load = self._load
+        if first == last:
+            data = block(key, first, load)
+        else:
+            data = emptybytes.join(block(key, n, load)
+                                   for n in xrange(first, last + 1))
+        start = position - first * blocksize
+        return data[start:start + end - position]
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            size = self._length - self._pos
+        data = self.get(self._pos, size)
+        self._pos += len(data)
+        return data
+
+    def readline(self):
+        pieces = []
+        while self._pos < self._length:
+            data = self.get(self._pos, self._cache.blocksize)
+            i = data.find(b("\n"))
+            if i >= 0:
+                data = data[:i + 1]
+            pieces.append(data)
+            self._pos += len(data)
+            if i >= 0:
+                break
+        return emptybytes.join(pieces)
+
+    def seek(self, where, whence=0):
+        if whence == 0:  # Absolute
+            self._pos = where
+        elif whence == 1:  # Relative
+            self._pos += where
+        elif whence == 2:  # From end
+            self._pos = self._length + where
+        else:
+            raise ValueError
+
+    def tell(self):
+        return self._pos
+
+    def write(self, *args):
+        raise IOError("%r is read-only" % (self._key[0],))
+
+    def advise(self, advice, position=0, length=0):
+        self._raw.advise(advice, position, length)
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+            self.closed = True
+
+
+class CachingStorage(Storage):
+    """Wraps another storage object and reads files opened with
+    :meth:`~whoosh.filedb.filestore.Storage.open_file` through a fixed-size
+    block cache shared by all the files, so frequently read parts of the index
+    (such as term dictionaries and postings of common terms) stay in memory no
+    matter how the wrapped storage reads files. Writing, locking, and all
+    other operations are passed through to the wrapped storage.
+
+    >>> st = CachingStorage(RamStorage(), cachesize=16)
+    >>> ix = st.create_index(schema)
+    """
+
+    def __init__(self, child, cachesize=64, blocksize=4096):
+        """
+        :param child: the :class:`~whoosh.filedb.filestore.Storage` object to
+            wrap.
+        :param cachesize: the maximum size of the cache in megabytes.
+        :param blocksize: the size of each cached block in bytes.
+        """
+
+        self.child = child
+        self.cache = BlockCache(cachesize, blocksize)
+        self.readonly = child.readonly
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.child)
+
+    def create(self):
+        self.child.create()
+        return self
+
+    def destroy(self, *args, **kwargs):
+        self.cache.clear()
+        self.child.destroy(*args, **kwargs)
+
+    def create_file(self, name, *args, **kwargs):
+        self.cache.forget(name)
+        return self.child.create_file(name, *args, **kwargs)
+
+    def open_file(self, name, *args, **kwargs):
+        length = self.child.file_length(name)
+        rawfile = self.child.open_file(name)
+        # Include the length in the key, so if the file is replaced by
+        # another process we don't read stale blocks
+        cfile = CachedFile(rawfile, (name, length), length, self.cache)
+        return StructFile(cfile, name=name, *args, **kwargs)
+
+    def cache_stats(self):
+        """Returns a dictionary mapping file names to dictionaries containing
+        the number of ``"hits"``, ``"misses"`` and ``"evictions"`` of blocks
+        of that file in the cache.
+        """
+
+        return self.cache.stats()
+
+    def list(self):
+        return self.child.list()
+
+    def file_exists(self, name):
+        return self.child.file_exists(name)
+
+    def file_modified(self, name):
+        return self.child.file_modified(name)
+
+    def file_length(self, name):
+        return self.child.file_length(name)
+
+    def delete_file(self, name):
+        self.cache.forget(name)
+        return self.child.delete_file(name)
+
+    def rename_file(self, frm, to, safe=False):
+        self.cache.forget(frm)
+        self.cache.forget(to)
+        return self.child.rename_file(frm, to, safe=safe)
+
+    def lock(self, name):
+        return self.child.lock(name)
+
+    def close(self):
+        # Readers close the storage they were given when they're closed, so
+        # keep the cache so the next reader can use it
+        self.child.close()
+
+    def optimize(self):
+        self.child.optimize()
+
+    def temp_storage(self, name=None):
+        return self.child.temp_storage(name=name)
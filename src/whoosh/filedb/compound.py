@@ -28,8 +28,8 @@
 import errno
 import os
 import sys
-from threading import Lock
-from shutil import copyfileobj
+import zlib
+from threading import Lock, Thread
 
 try:
     import mmap
@@ -38,16 +38,88 @@ except ImportError:
 
 from whoosh.compat import BytesIO, memoryview_
 from whoosh.filedb.structfile import BufferFile, StructFile
-from whoosh.filedb.filestore import FileStorage, StorageError
+from whoosh.filedb.filestore import ChecksumError, FileStorage, Storage
+from whoosh.filedb.filestore import StorageError
 from whoosh.system import emptybytes
 from whoosh.util import random_name
 
 
+# Size of the pieces in which files are read to compute checksums
+_CHECKSUM_CHUNK = 1024 * 1024
+
+
+def _crc(data, crc=0):
+    return zlib.crc32(data, crc) & 0xffffffff
+
+
+# Background verification of compound files. The first time a compound file
+# is opened, it's queued to be checked by a single worker thread, which opens
+# its own copy of the file so it doesn't matter if the reader that queued it
+# is closed in the meantime. The results are kept by key so later storage
+# objects for the same file know which of its files are corrupt
+
+_verify_lock = Lock()
+_verify_results = {}
+_verify_pending = []
+_verify_worker = None
+
+
+def _verify_in_background(key, reopen):
+    global _verify_worker
+
+    with _verify_lock:
+        if key in _verify_results:
+            return
+        _verify_results[key] = frozenset()
+        _verify_pending.append((key, reopen))
+        if _verify_worker is None:
+            _verify_worker = Thread(target=_run_verify_worker)
+            _verify_worker.daemon = True
+            _verify_worker.start()
+
+
+def _run_verify_worker():
+    global _verify_worker
+
+    while True:
+        with _verify_lock:
+            if not _verify_pending:
+                _verify_worker = None
+                return
+            key, reopen = _verify_pending.pop(0)
+
+        try:
+            cstore = reopen()
+            try:
+                bad = cstore.verify()
+            finally:
+                cstore.close()
+        except Exception:
+            # The file couldn't be read (for example it was deleted by a
+            # merge before we got to it), so try again the next time it's
+            # opened
+            with _verify_lock:
+                _verify_results.pop(key, None)
+            continue
+
+        if bad:
+            with _verify_lock:
+                _verify_results[key] = frozenset(bad)
+
+
 class CompoundStorage(FileStorage):
+    """Reads the files stored in a single compound file.
+
+    The directory at the end of a compound file records the CRC-32 checksum
+    of each file (compound files written by older versions don't have them).
+    Use :meth:`CompoundStorage.verify` to check the files against them.
+    """
+
     readonly = True
 
     def __init__(self, dbfile, use_mmap=True, basepos=0):
         self._file = dbfile
+        self._verifykey = None
         self.is_closed = False
 
         # Seek to the end to get total file size (to check if mmap is OK)
@@ -110,15 +182,72 @@ class CompoundStorage(FileStorage):
             raise NameError("Unknown file %r" % (name,))
         return fileinfo["offset"], fileinfo["length"]
 
+    def verify(self, names=None):
+        """Checks the contents of the files in this compound file against the
+        checksums recorded when it was written, and returns a list of the
+        names of files that don't match. Files without a recorded checksum
+        are not checked.
+
+        :param names: the names of the files to check. The default is to
+            check all the files.
+        """
+
+        bad = []
+        for name in sorted(names or self._dir):
+            info = self._dir[name]
+            if "crc" not in info:
+                continue
+            if self._file_crc(info["offset"], info["length"]) != info["crc"]:
+                bad.append(name)
+        return bad
+
+    def _file_crc(self, offset, length):
+        crc = 0
+        pos = offset
+        end = offset + length
+        while pos < end:
+            size = min(_CHECKSUM_CHUNK, end - pos)
+            if self._source is not None:
+                chunk = self._source[pos:pos + size]
+            else:
+                self._file.seek(pos)
+                chunk = self._file.read(size)
+            if not chunk:
+                # The file is shorter than the directory says it should be
+                return None
+            crc = _crc(chunk, crc)
+            pos += len(chunk)
+        return crc
+
+    def verify_in_background(self, key, reopen):
+        """Queues this compound file to be checked by a background thread,
+        unless a file with the given key was already checked (or queued)
+        in this process. After the check, opening a file that failed it
+        raises :class:`whoosh.filedb.filestore.ChecksumError`.
+
+        :param key: a hashable object identifying the compound file.
+        :param reopen: a function that returns a new ``CompoundStorage``
+            object for the same file. The background thread reads from its
+            own copy so it doesn't share a file handle with readers.
+        """
+
+        self._verifykey = key
+        _verify_in_background(key, reopen)
+
     def open_file(self, name, *args, **kwargs):
         if self.is_closed:
             raise StorageError("Storage was closed")
+        if (self._verifykey is not None
+                and name in _verify_results.get(self._verifykey, ())):
+            raise ChecksumError("%r in a compound file failed its checksum"
+                                % name)
 
         offset, length = self.range(name)
         if self._source:
             # Create a memoryview/buffer from the mmap
             buf = memoryview_(self._source, offset, length)
-            f = BufferFile(buf, name=name)
+            f = BufferFile(buf, name=name, mapping=self._source,
+                           mapoffset=offset)
         elif hasattr(self._file, "subset"):
             f = self._file.subset(offset, length, name=name)
         else:
@@ -164,9 +293,17 @@ class CompoundStorage(FileStorage):
             modified = store.file_modified(name)
             directory[name] = {"offset": offset, "length": length,
                                "modified": modified}
+            # Copy the file, computing its checksum as we go
+            crc = 0
             f = store.open_file(name)
-            copyfileobj(f, dbfile)
+            while True:
+                chunk = f.read(_CHECKSUM_CHUNK)
+                if not chunk:
+                    break
+                crc = _crc(chunk, crc)
+                dbfile.write(chunk)
             f.close()
+            directory[name]["crc"] = crc
 
         CompoundStorage.write_dir(dbfile, basepos, directory, options)
 
@@ -232,6 +369,12 @@ class SubFile(object):
         self._pos += len(data)
         return data
 
+    def advise(self, advice, position=0, length=0):
+        if not length:
+            length = self._length - position
+        if hasattr(self._file, "advise"):
+            self._file.advise(advice, self._offset + position, length)
+
     def seek(self, where, whence=0):
         if whence == 0:  # Absolute
             pos = where
@@ -329,3 +472,280 @@ class CompoundWriter(object):
             length = bio.tell()
             if length:
                 self.blocks.append((bio, 0, length))
+
+
+class StreamingCompoundStorage(Storage):
+    """A write-only storage that streams the files of a new segment straight
+    into a single compound file (in the format read by
+    :class:`CompoundStorage`), instead of writing separate files and copying
+    them into a compound file when the segment is finished.
+
+    Only one file at a time can be appended directly to the compound file.
+    Each file starts out buffered in memory. When a file outgrows its buffer
+    it is moved to the end of the compound file if no other file is being
+    written there, otherwise it continues in a temporary file and is copied
+    into the compound file after the file currently being written directly
+    is closed. Small files that never outgrow the buffer are copied in when
+    they're closed.
+
+    Files that have been closed can be opened for reading before the
+    compound file is finished (the writer reads field lengths back while it
+    writes the postings). Call :meth:`StreamingCompoundStorage.close` to
+    write the directory and close the compound file.
+    """
+
+    def __init__(self, storage, name, tempstorage=None, buffersize=64 * 1024):
+        """
+        :param storage: the storage in which to create the compound file.
+        :param name: the name of the compound file.
+        :param tempstorage: a storage for temporary files. If you don't
+            supply one, this object creates one with ``storage.temp_storage()``
+            when it first needs it, and destroys it when it's closed.
+        :param buffersize: files smaller than this are kept in memory until
+            they can be copied into the compound file.
+        """
+
+        self._storage = storage
+        self._name = name
+        self._tempstorage = tempstorage
+        self._owntemp = tempstorage is None
+        self._buffersize = buffersize
+
+        # Open the file for reading as well as writing so closed files can be
+        # read back while the rest of the segment is written
+        self._dbfile = storage.create_file(name, mode="w+b")
+        self._dbfile.write_long(0)  # Directory offset
+        self._dbfile.write_int(0)  # Directory length
+        self._end = self._dbfile.tell()
+
+        self._directory = {}
+        # The stream currently being appended to the compound file
+        self._direct = None
+        # Closed streams waiting to be copied into the compound file
+        self._pending = []
+        self._streams = {}
+        self._tempfiles = []
+        self.is_closed = False
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self._name)
+
+    def create_file(self, name, **kwargs):
+        if self.is_closed:
+            raise StorageError("Storage was closed")
+        if name in self._streams or name in self._directory:
+            raise NameError("File %r already exists" % name)
+
+        stream = _SegmentStream(self, name)
+        self._streams[name] = stream
+        return StructFile(stream, name=name)
+
+    def _spill(self, stream):
+        # Called by a stream when it outgrows its memory buffer
+        data = stream._f.getvalue()[:stream._length]
+        if self._direct is None:
+            # Move the stream to the end of the compound file and let it
+            # write there directly from now on
+            self._direct = stream
+            stream._f = self._dbfile
+            stream._base = self._end
+        else:
+            if self._tempstorage is None:
+                self._tempstorage = self._storage.temp_storage()
+            tempname = "%s.stmp" % random_name()
+            tempfile = self._tempstorage.create_file(tempname, mode="w+b")
+            self._tempfiles.append((tempname, tempfile))
+            stream._f = tempfile
+            stream._base = 0
+        stream._f.seek(stream._base)
+        stream._f.write(data)
+
+    def _finished(self, stream):
+        # Called by a stream when it's closed
+        del self._streams[stream.name]
+        if stream is self._direct:
+            self._direct = None
+            self._add_entry(stream, stream._base)
+            self._end = stream._base + stream._length
+            # Copy in the files that finished while this one was writing
+            pending = self._pending
+            self._pending = []
+            for stream in pending:
+                self._copy_in(stream)
+        elif self._direct is None:
+            self._copy_in(stream)
+        else:
+            self._pending.append(stream)
+
+    def _copy_in(self, stream):
+        # Copy the contents of a closed, buffered stream to the end of the
+        # compound file
+        dbfile = self._dbfile
+        offset = self._end
+        dbfile.seek(offset)
+        f = stream._f
+        f.seek(0)
+        crc = 0
+        remaining = stream._length
+        while remaining > 0:
+            chunk = f.read(min(remaining, self._buffersize))
+            if not chunk:
+                break
+            crc = _crc(chunk, crc)
+            dbfile.write(chunk)
+            remaining -= len(chunk)
+        self._end = dbfile.tell()
+        stream._crc = crc
+        stream._sequential = True
+
+        # Read the file from its new position from now on. Don't close the
+        # temporary file yet, since a reader might already have it open
+        stream._f = dbfile
+        stream._base = offset
+        self._add_entry(stream, offset)
+
+    def _add_entry(self, stream, offset):
+        length = stream._length
+        crc = stream._crc
+        if not stream._sequential:
+            # The stream went back and overwrote some of its data, so the
+            # running checksum is wrong and we have to read the data back
+            crc = 0
+            f = stream._f
+            f.seek(stream._base)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(remaining, _CHECKSUM_CHUNK))
+                if not chunk:
+                    break
+                crc = _crc(chunk, crc)
+                remaining -= len(chunk)
+        self._directory[stream.name] = {"offset": offset, "length": length,
+                                        "modified": -1, "crc": crc}
+
+    def _closed_stream(self, name):
+        for stream in self._pending:
+            if stream.name == name:
+                return stream
+        return None
+
+    def open_file(self, name, *args, **kwargs):
+        if name in self._directory:
+            info = self._directory[name]
+            f, offset, length = self._dbfile, info["offset"], info["length"]
+        else:
+            stream = self._closed_stream(name)
+            if stream is None:
+                raise NameError(name)
+            f, offset, length = stream._f, stream._base, stream._length
+        return StructFile(SubFile(f, offset, length), name=name)
+
+    def list(self):
+        return list(self._directory) + [s.name for s in self._pending]
+
+    def file_exists(self, name):
+        return (name in self._directory
+                or self._closed_stream(name) is not None)
+
+    def file_length(self, name):
+        if name in self._directory:
+            return self._directory[name]["length"]
+        stream = self._closed_stream(name)
+        if stream is None:
+            raise NameError(name)
+        return stream._length
+
+    def file_modified(self, name):
+        return -1
+
+    def lock(self, name):
+        return self._storage.lock(name)
+
+    def temp_storage(self, name=None):
+        return self._storage.temp_storage(name)
+
+    def close(self):
+        """Copies any remaining files into the compound file, writes the
+        directory, and closes the compound file. All the files created in
+        this storage must be closed first.
+        """
+
+        if self.is_closed:
+            return
+        if self._streams:
+            raise StorageError("Files still open: %r"
+                               % sorted(self._streams))
+        self.is_closed = True
+        self._dbfile.seek(self._end)
+        CompoundStorage.write_dir(self._dbfile, 0, self._directory)
+
+        for tempname, tempfile in self._tempfiles:
+            tempfile.close()
+            try:
+                self._tempstorage.delete_file(tempname)
+            except OSError:
+                pass
+        if self._owntemp and self._tempstorage is not None:
+            self._tempstorage.destroy()
+
+
+class _SegmentStream(object):
+    # A file-like object for a file being written by StreamingCompoundStorage.
+    # The file's data is at _base in the file object _f, which is a BytesIO
+    # buffer, a temporary file, or the compound file itself
+
+    def __init__(self, owner, name):
+        self._owner = owner
+        self.name = name
+        self._f = BytesIO()
+        self._base = 0
+        self._pos = 0
+        self._length = 0
+        self._buffered = True
+        # Running checksum of the data, which is only valid as long as the
+        # data is written sequentially
+        self._crc = 0
+        self._sequential = True
+        self.closed = False
+
+    def write(self, data):
+        end = self._pos + len(data)
+        if self._buffered and end > self._owner._buffersize:
+            self._owner._spill(self)
+            self._buffered = False
+
+        if self._sequential:
+            if self._pos == self._length:
+                self._crc = _crc(data, self._crc)
+            else:
+                self._sequential = False
+
+        f = self._f
+        target = self._base + self._pos
+        if f.tell() != target:
+            f.seek(target)
+        f.write(data)
+        self._pos = end
+        if end > self._length:
+            self._length = end
+
+    def seek(self, where, whence=0):
+        if whence == 0:  # Absolute
+            self._pos = where
+        elif whence == 1:  # Relative
+            self._pos += where
+        elif whence == 2:  # From end
+            self._pos = self._length + where
+        else:
+            raise ValueError
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._owner._finished(self)
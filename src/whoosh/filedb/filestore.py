@@ -46,6 +46,12 @@ class ReadOnlyError(StorageError):
     pass
 
 
+class ChecksumError(StorageError):
+    """Raised when the contents of a file don't match the checksum that was
+    recorded when the file was written.
+    """
+
+
 # Base class
 
 class Storage(object):
@@ -26,13 +26,14 @@
 # policies, either expressed or implied, of Matt Chaput.
 
 """This module defines writer and reader classes for a fast, immutable
-on-disk key-value database format. The current format is based heavily on
-D. J. Bernstein's CDB format (http://cr.yp.to/cdb.html).
+on-disk key-value database format. The hash format is based heavily on
+D. J. Bernstein's CDB format (http://cr.yp.to/cdb.html). The sorted block
+format stores ordered keys in prefix-compressed blocks.
 """
 
 import os, struct
 from binascii import crc32
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right
 from hashlib import md5  # @UnresolvedImport
 
 from whoosh.compat import b, bytes_type
@@ -502,6 +503,10 @@ class OrderedBase(HashReader):
 
 
 class OrderedHashReader(OrderedBase):
+    # Every Nth key in the file is kept in memory, so finding the closest key
+    # only needs a binary search of the N positions between two samples
+    sampleinterval = 32
+
     def _read_extras(self):
         dbfile = self.dbfile
 
@@ -510,6 +515,7 @@ class OrderedHashReader(OrderedBase):
 
         # Set up for reading the index array
         indextype = self.extras["indextype"]
+        self.indextype = indextype
         self.indexbase = dbfile.tell()
         self.indexlen = self.extras["indexlen"]
         self.indexsize = struct.calcsize(indextype)
@@ -527,20 +533,50 @@ class OrderedHashReader(OrderedBase):
         else:
             raise Exception("Unknown index type %r" % indextype)
 
+        # The sampled keys are loaded the first time they're needed
+        self._samplekeys = None
+        self._sampleposes = None
+
+    def _load_samples(self):
+        # Reads the index array in one go and keeps the key and position of
+        # every Nth key
+        dbfile = self.dbfile
+        poses = dbfile.get_array(self.indexbase, self.indextype,
+                                 self.indexlen)[::self.sampleinterval]
+        _key_at = self._key_at
+        samplekeys = [_key_at(pos) for pos in poses]
+        self._sampleposes = poses
+        self._samplekeys = samplekeys
+
     def _closest_key_pos(self, key):
         # Given a key, return the position of that key OR the next highest key
         # if the given key does not exist
         if not isinstance(key, bytes_type):
             raise TypeError("Key %r should be bytes" % key)
 
+        if not self.indexlen:
+            return None
+        if self._samplekeys is None:
+            self._load_samples()
+
+        # Find the last sampled key less than or equal to the key in memory
+        samplekeys = self._samplekeys
+        snum = bisect_right(samplekeys, key) - 1
+        if snum < 0:
+            # The key is before the first key
+            return self._sampleposes[0]
+        if samplekeys[snum] == key:
+            return self._sampleposes[snum]
+
         indexbase = self.indexbase
         indexsize = self.indexsize
         _key_at = self._key_at
         _get_pos = self._get_pos
 
-        # Do a binary search of the positions in the index array
-        lo = 0
-        hi = self.indexlen
+        # Do a binary search of the positions in the index array between this
+        # sample and the next one
+        lo = snum * self.sampleinterval + 1
+        hi = min(lo - 1 + self.sampleinterval, self.indexlen)
         while lo < hi:
             mid = (lo + hi) // 2
             midkey = _key_at(_get_pos(indexbase + mid * indexsize))
@@ -556,6 +592,464 @@ class OrderedHashReader(OrderedBase):
         return _get_pos(indexbase + lo * indexsize)
 
 
+# Sorted block file
+
+# The number of keys at the start of each block
+_block_count = struct.Struct("!H")
+# The end of a sorted block file, giving the positions of the extras and the
+# block index, the total number of keys, and the number of blocks
+_block_trailer = struct.Struct("!qqqi")
+
+
+_block_headers = {}
+
+
+def _block_header(count):
+    # After the count, each block has an array of the number of bytes each key
+    # shares with the first key of the block, then arrays of the offsets in the
+    # block of the rest of each key (plus the end of the block) and of each
+    # value. Since each key only depends on the first key, a reader can do a
+    # binary search of the block without decoding every key
+    try:
+        return _block_headers[count]
+    except KeyError:
+        header = struct.Struct("!%dB%dI%dI" % (count, count + 1, count))
+        _block_headers[count] = header
+        return header
+
+
+class SortedBlockWriter(object):
+    """Implements an on-disk key-value store where the keys must be added in
+    increasing order, as an alternative to :class:`OrderedHashWriter` for
+    large tables such as term dictionaries.
+
+    Instead of hash tables, the keys and values are written in blocks of
+    ``blockkeys`` keys, where each key only stores the bytes that differ from
+    the first key of the block. While writing, this object only keeps the
+    current block and the first key of each block in memory (the hash writers
+    keep a pointer to every key until they're closed). A
+    :class:`SortedBlockReader` keeps the first keys in memory so it can find
+    the block containing a key with a binary search, without hashing the key.
+
+    Keys must be unique, and each key and value must be less than 4 GB in
+    length.
+    """
+
+    def __init__(self, dbfile, magic=b("SBK1"), blockkeys=32):
+        """
+        :param dbfile: a :class:`~whoosh.filedb.structfile.StructFile` object
+            to write to.
+        :param magic: the format tag bytes to write at the start of the file.
+        :param blockkeys: the maximum number of keys in each block. Larger
+            blocks make the index the reader keeps in memory smaller, but
+            each lookup has to decode more keys.
+        """
+
+        if not 0 < blockkeys < 65536:
+            raise ValueError("blockkeys must be between 1 and 65535")
+
+        self.dbfile = dbfile
+        self.blockkeys = blockkeys
+        # A place for subclasses to put extra metadata
+        self.extras = {}
+
+        self.startoffset = dbfile.tell()
+        # Write format tag
+        dbfile.write(magic)
+        # Unused future expansion bits
+        dbfile.write_int(0)
+
+        # The keys and values of the current block
+        self._keys = []
+        self._values = []
+        # The first key and position of each block written so far
+        self._firstkeys = []
+        self._positions = GrowableArray("H")
+        self.keycount = 0
+        self.lastkey = None
+
+    def tell(self):
+        return self.dbfile.tell()
+
+    def add(self, key, value):
+        """Adds a key/value pair to the file. Keys must be added in increasing
+        order.
+        """
+
+        assert isinstance(key, bytes_type)
+        assert isinstance(value, bytes_type)
+
+        if self.lastkey is not None and key <= self.lastkey:
+            raise ValueError("Keys must increase: %r..%r"
+                             % (self.lastkey, key))
+        self._keys.append(key)
+        self._values.append(value)
+        self.keycount += 1
+        self.lastkey = key
+
+        if len(self._keys) >= self.blockkeys:
+            self._write_block()
+
+    def add_all(self, items):
+        """Convenience method to add a sequence of ``(key, value)`` pairs. This
+        is the same as calling :meth:`SortedBlockWriter.add` on each pair in
+        the sequence.
+        """
+
+        add = self.add
+        for key, value in items:
+            add(key, value)
+
+    def _write_block(self):
+        dbfile = self.dbfile
+        keys = self._keys
+        values = self._values
+        count = len(keys)
+
+        self._firstkeys.append(keys[0])
+        self._positions.append(dbfile.tell())
+
+        first = keys[0]
+        header = _block_header(count)
+        prefixes = []
+        keystarts = []
+        valstarts = []
+        pieces = []
+        pos = _block_count.size + header.size
+        for key, value in zip(keys, values):
+            limit = min(len(first), len(key), 255)
+            i = 0
+            while i < limit and first[i:i + 1] == key[i:i + 1]:
+                i += 1
+            prefixes.append(i)
+            keystarts.append(pos)
+            pos += len(key) - i
+            valstarts.append(pos)
+            pos += len(value)
+            pieces.append(key[i:])
+            pieces.append(value)
+        keystarts.append(pos)
+
+        dbfile.write(_block_count.pack(count))
+        dbfile.write(header.pack(*(prefixes + keystarts + valstarts)))
+        dbfile.write(emptybytes.join(pieces))
+
+        self._keys = []
+        self._values = []
+
+    def _write_extras(self):
+        self.dbfile.write_pickle(self.extras)
+
+    def _write_index(self):
+        # Writes the first key and the position of each block
+        dbfile = self.dbfile
+        firstkeys = self._firstkeys
+        count = len(firstkeys)
+        dbfile.write(struct.pack("!%dI" % count,
+                                 *[len(key) for key in firstkeys]))
+        dbfile.write(emptybytes.join(firstkeys))
+        dbfile.write(struct.pack("!%dq" % count, *self._positions))
+
+    def close(self):
+        dbfile = self.dbfile
+
+        # Write the last, partial block
+        if self._keys:
+            self._write_block()
+
+        expos = dbfile.tell()
+        self._write_extras()
+        ixpos = dbfile.tell()
+        self._write_index()
+        dbfile.write(_block_trailer.pack(expos, ixpos, self.keycount,
+                                         len(self._firstkeys)))
+
+        endpos = dbfile.tell()
+        dbfile.close()
+        return endpos
+
+
+class SortedBlockReader(object):
+    """Reader for the on-disk key-value files created by
+    :class:`SortedBlockWriter`. This object supports the same lookup and
+    ordered iteration methods as :class:`OrderedHashReader`.
+    """
+
+    def __init__(self, dbfile, length=None, magic=b("SBK1"), startoffset=0,
+                 cachesize=64):
+        """
+        :param dbfile: a :class:`~whoosh.filedb.structfile.StructFile` object
+            to read from.
+        :param length: the length of the file data. This is necessary since
+            the block index is written at the end of the file.
+        :param magic: the format tag bytes to look for at the start of the
+            file. If the file's format tag does not match these bytes, the
+            object raises a :class:`FileFormatError` exception.
+        :param startoffset: the starting point of the file data.
+        :param cachesize: the number of decoded blocks to keep in memory.
+        """
+
+        self.dbfile = dbfile
+        self.startoffset = startoffset
+        self.is_closed = False
+
+        if length is None:
+            dbfile.seek(0, os.SEEK_END)
+            length = dbfile.tell() - startoffset
+
+        dbfile.seek(startoffset)
+        # Check format tag
+        filemagic = dbfile.read(4)
+        if filemagic != magic:
+            raise FileFormatError("Unknown file header %r" % filemagic)
+        # Skip unused future expansion bits
+        dbfile.read_int()
+        self.startofdata = dbfile.tell()
+
+        trailerpos = startoffset + length - _block_trailer.size
+        expos, ixpos, self.keycount, blockcount = _block_trailer.unpack(
+            dbfile.get(trailerpos, _block_trailer.size))
+        self.endofdata = expos
+
+        dbfile.seek(expos)
+        self._read_extras()
+
+        # Read the first key and position of each block into memory
+        lenssize = blockcount * _INT_SIZE
+        keylens = struct.unpack("!%dI" % blockcount,
+                                dbfile.get(ixpos, lenssize))
+        keydata = dbfile.get(ixpos + lenssize, sum(keylens))
+        firstkeys = []
+        pos = 0
+        for keylen in keylens:
+            firstkeys.append(keydata[pos:pos + keylen])
+            pos += keylen
+        self._firstkeys = firstkeys
+        positions = struct.unpack("!%dq" % blockcount,
+                                  dbfile.get(ixpos + lenssize + pos,
+                                             blockcount * 8))
+        # Add the end of the last block so the length of block n is always
+        # _blockpos[n + 1] - _blockpos[n]
+        self._blockpos = list(positions) + [expos]
+
+        self._cache = {}
+        self._cachesize = cachesize
+
+    @classmethod
+    def open(cls, storage, name):
+        """Convenience method to open a sorted block file given a
+        :class:`whoosh.filedb.filestore.Storage` object and a name. This
+        takes care of opening the file and passing its length to the
+        initializer.
+        """
+
+        length = storage.file_length(name)
+        dbfile = storage.open_file(name)
+        return cls(dbfile, length)
+
+    def file(self):
+        return self.dbfile
+
+    def _read_extras(self):
+        try:
+            self.extras = self.dbfile.read_pickle()
+        except EOFError:
+            self.extras = {}
+
+    def close(self):
+        if self.is_closed:
+            raise Exception("Tried to close %r twice" % self)
+        self.dbfile.close()
+        self._cache = {}
+        self.is_closed = True
+
+    def __len__(self):
+        return self.keycount
+
+    def _read_block(self, blocknum):
+        # Returns a tuple of the data of the given block, the base position
+        # of the data in the file, and the arrays of key prefix lengths, key
+        # offsets and value offsets (see _block_header)
+        start = self._blockpos[blocknum]
+        data = self.dbfile.get(start, self._blockpos[blocknum + 1] - start)
+        count = _block_count.unpack(data[:_block_count.size])[0]
+        header = _block_header(count)
+        nums = header.unpack(data[_block_count.size:
+                                  _block_count.size + header.size])
+        # The length of value n is keystarts[n + 1] - valstarts[n]
+        return (data, start, nums[:count], nums[count:count * 2 + 1],
+                nums[count * 2 + 1:])
+
+    def _block(self, blocknum):
+        # Returns the block from the cache, or reads and caches it
+        cache = self._cache
+        try:
+            return cache[blocknum]
+        except KeyError:
+            pass
+
+        block = self._read_block(blocknum)
+        if len(cache) >= self._cachesize:
+            cache.clear()
+        cache[blocknum] = block
+        return block
+
+    def _scan(self, blocknum=0, index=0):
+        # Yields (key, datapos, datalen) tuples starting at the given key in
+        # the given block. Scanning doesn't add blocks to the cache, so a
+        # long scan doesn't push out the blocks used for lookups
+        cache = self._cache
+        firstkeys = self._firstkeys
+        for bn in xrange(blocknum, len(firstkeys)):
+            first = firstkeys[bn]
+            block = cache.get(bn) or self._read_block(bn)
+            data, start, prefixes, keystarts, valstarts = block
+            for i in xrange(index, len(prefixes)):
+                vs = valstarts[i]
+                key = first[:prefixes[i]] + data[keystarts[i]:vs]
+                yield key, start + vs, keystarts[i + 1] - vs
+            index = 0
+
+    def _locate(self, key):
+        # Returns the block number and the index in the block of the given
+        # key, or of the next highest key if the key doesn't exist, the
+        # block, and whether the key at that index is the given key
+        if not isinstance(key, bytes_type):
+            raise TypeError("Key %r should be bytes" % key)
+
+        blocknum = max(0, bisect_right(self._firstkeys, key) - 1)
+        first = self._firstkeys[blocknum]
+        block = self._block(blocknum)
+        data, _, prefixes, keystarts, valstarts = block
+
+        # Binary search of the keys in the block
+        lo = 0
+        hi = len(prefixes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            midkey = first[:prefixes[mid]] + data[keystarts[mid]:
+                                                  valstarts[mid]]
+            if midkey < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        found = (lo < len(prefixes) and
+                 first[:prefixes[lo]] + data[keystarts[lo]:valstarts[lo]]
+                 == key)
+        return blocknum, lo, block, found
+
+    def range_for_key(self, key):
+        """Returns a ``(datapos, datalength)`` tuple for the given key, or
+        raises ``KeyError`` if the key is not in the file.
+        """
+
+        if not self._firstkeys:
+            if not isinstance(key, bytes_type):
+                raise TypeError("Key %r should be bytes" % key)
+            raise KeyError(key)
+
+        _, i, block, found = self._locate(key)
+        if not found:
+            raise KeyError(key)
+        _, start, _, keystarts, valstarts = block
+        vs = valstarts[i]
+        return start + vs, keystarts[i + 1] - vs
+
+    def ranges_for_key(self, key):
+        """Yields a sequence of ``(datapos, datalength)`` tuples associated
+        with the given key (since keys are unique, there's at most one).
+        """
+
+        try:
+            yield self.range_for_key(key)
+        except KeyError:
+            pass
+
+    def __getitem__(self, key):
+        if not self._firstkeys:
+            raise KeyError(key)
+
+        _, i, block, found = self._locate(key)
+        if not found:
+            raise KeyError(key)
+        # Take the value from the cached block instead of reading the file
+        data, _, _, keystarts, valstarts = block
+        return data[valstarts[i]:keystarts[i + 1]]
+
+    def __contains__(self, key):
+        try:
+            self.range_for_key(key)
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def all(self, key):
+        """Yields a sequence of values associated with the given key (since
+        keys are unique, there's at most one).
+        """
+
+        dbfile = self.dbfile
+        for datapos, datalen in self.ranges_for_key(key):
+            yield dbfile.get(datapos, datalen)
+
+    def __iter__(self):
+        return self.items()
+
+    def keys(self):
+        for key, _, _ in self._scan():
+            yield key
+
+    def values(self):
+        dbfile = self.dbfile
+        for _, datapos, datalen in self._scan():
+            yield dbfile.get(datapos, datalen)
+
+    def items(self):
+        dbfile = self.dbfile
+        for key, datapos, datalen in self._scan():
+            yield key, dbfile.get(datapos, datalen)
+
+    def _scan_from(self, key):
+        if not self._firstkeys:
+            return iter(())
+        blocknum, i, _, _ = self._locate(key)
+        return self._scan(blocknum, i)
+
+    def closest_key(self, key):
+        """Returns the closest key equal to or greater than the given key. If
+        there is no key in the file equal to or greater than the given key,
+        returns None.
+        """
+
+        for k, _, _ in self._scan_from(key):
+            return k
+        return None
+
+    def keys_from(self, key):
+        """Yields an ordered series of keys equal to or greater than the given
+        key.
+        """
+
+        for k, _, _ in self._scan_from(key):
+            yield k
+
+    def items_from(self, key):
+        """Yields an ordered series of ``(key, value)`` tuples for keys equal
+        to or greater than the given key.
+        """
+
+        dbfile = self.dbfile
+        for k, datapos, datalen in self._scan_from(key):
+            yield k, dbfile.get(datapos, datalen)
+
+
 # Fielded Ordered hash file
 
 class FieldedOrderedHashWriter(HashWriter):
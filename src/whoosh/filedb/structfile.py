@@ -25,6 +25,7 @@
 # those of the authors and should not be interpreted as representing official
 # policies, either expressed or implied, of Matt Chaput.
 
+import os
 from array import array
 from copy import copy
 from struct import calcsize
@@ -53,6 +54,32 @@ _types = (("sbyte", "b"), ("ushort", "H"), ("int", "i"),
           ("long", "q"), ("float", "f"))
 
 
+# Access pattern hints accepted by StructFile.advise()
+
+NORMAL = "normal"
+RANDOM = "random"
+SEQUENTIAL = "sequential"
+WILLNEED = "willneed"
+
+try:
+    _FADVISE = {NORMAL: os.POSIX_FADV_NORMAL,
+                RANDOM: os.POSIX_FADV_RANDOM,
+                SEQUENTIAL: os.POSIX_FADV_SEQUENTIAL,
+                WILLNEED: os.POSIX_FADV_WILLNEED}
+except AttributeError:
+    _FADVISE = {}
+
+try:
+    import mmap
+    _MADVISE = {NORMAL: mmap.MADV_NORMAL,
+                RANDOM: mmap.MADV_RANDOM,
+                SEQUENTIAL: mmap.MADV_SEQUENTIAL,
+                WILLNEED: mmap.MADV_WILLNEED}
+    _PAGESIZE = mmap.PAGESIZE
+except (ImportError, AttributeError):
+    _MADVISE = {}
+
+
 # Main function
 
 class StructFile(object):
@@ -127,6 +154,29 @@ class StructFile(object):
             self.file.close()
         self.is_closed = True
 
+    def advise(self, advice, position=0, length=0):
+        """Tells the operating system how the given region of the file is
+        going to be accessed, so it can read ahead or drop pages accordingly.
+        This is only a hint: it does nothing if the platform or the wrapped
+        file doesn't support it.
+
+        :param advice: one of ``NORMAL``, ``RANDOM``, ``SEQUENTIAL`` or
+            ``WILLNEED`` (from this module).
+        :param position: the start of the region.
+        :param length: the length of the region, or 0 to mean the rest of the
+            file.
+        """
+
+        if self.is_real:
+            flag = _FADVISE.get(advice)
+            if flag is not None:
+                try:
+                    os.posix_fadvise(self.fileno(), position, length, flag)
+                except (OSError, ValueError):
+                    pass
+        elif hasattr(self.file, "advise"):
+            self.file.advise(advice, position, length)
+
     def subset(self, offset, length, name=None):
         from whoosh.filedb.compound import SubFile
 
@@ -351,11 +401,21 @@ class StructFile(object):
 
 
 class BufferFile(StructFile):
-    def __init__(self, buf, name=None, onclose=None):
+    def __init__(self, buf, name=None, onclose=None, mapping=None,
+                 mapoffset=0):
+        """
+        :param buf: the buffer to read from.
+        :param mapping: if the buffer is a view of an ``mmap.mmap`` object,
+            the map, so :meth:`StructFile.advise` can pass hints to it.
+        :param mapoffset: the position of the start of the buffer in the map.
+        """
+
         self._buf = buf
         self._name = name
         self.file = BytesIO(buf)
         self.onclose = onclose
+        self._mapping = mapping
+        self._mapoffset = mapoffset
 
         self.is_real = False
         self.is_closed = False
@@ -364,6 +424,22 @@ class BufferFile(StructFile):
         name = name or self._name
         return BufferFile(self.get(position, length), name=name)
 
+    def advise(self, advice, position=0, length=0):
+        mapping = self._mapping
+        flag = _MADVISE.get(advice)
+        if mapping is None or flag is None or not hasattr(mapping, "madvise"):
+            return
+
+        if not length:
+            length = len(self._buf) - position
+        # madvise() needs the start of the region to be on a page boundary
+        start = self._mapoffset + position
+        aligned = start - (start % _PAGESIZE)
+        try:
+            mapping.madvise(flag, aligned, length + start - aligned)
+        except (OSError, ValueError):
+            pass
+
     def get(self, position, length):
         return bytes_type(self._buf[position:position + length])
 
@@ -30,18 +30,20 @@ an index.
 """
 
 from __future__ import division
-import os.path, re, sys
+import copy, os.path, re, sys
+from hashlib import sha1  # @UnresolvedImport
+from threading import Lock
 from time import time, sleep
 
 from whoosh import __version__
 from whoosh.legacy import toc_loaders
-from whoosh.compat import pickle, string_type
+from whoosh.compat import pickle, string_type, xrange
 from whoosh.fields import ensure_schema
 from whoosh.system import _INT_SIZE, _FLOAT_SIZE, _LONG_SIZE
 
 
 _DEF_INDEX_NAME = "MAIN"
-_CURRENT_TOC_VERSION = -111
+_CURRENT_TOC_VERSION = -112
 
 
 # Exceptions
@@ -210,6 +212,47 @@ def version(storage, indexname=None):
         return (None, e.version)
 
 
+def verify(ix, parallel=1):
+    """Checks the files of every segment in the given index against the
+    checksums recorded when they were written, and returns a list of
+    ``(segment_id, filename)`` tuples for the files that failed. An empty list
+    means every checksum matched.
+
+    >>> problems = verify(ix, parallel=8)
+    >>> if problems:
+    ...     print("Corrupt files:", problems)
+
+    Only compound segments (the default) have checksums, so the files of
+    other segments aren't checked.
+
+    :param ix: the :class:`FileIndex` to check.
+    :param parallel: the number of segments to check at the same time. The
+        checksums are computed in threads, which run in parallel since the
+        checksum function doesn't hold the interpreter lock.
+    """
+
+    storage = ix.storage
+    segments = ix._segments()
+
+    def check(segment):
+        return [(segment.segment_id(), name)
+                for name in segment.verify(storage)]
+
+    if parallel > 1 and len(segments) > 1:
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(min(parallel, len(segments)))
+        try:
+            results = pool.map(check, segments)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [check(segment) for segment in segments]
+
+    return [problem for result in results for problem in result]
+
+
 # Index base class
 
 class Index(object):
@@ -470,8 +513,9 @@ class FileIndex(Index):
 
         return self.storage.lock(self.indexname + "_" + name)
 
-    def _read_toc(self):
-        return TOC.read(self.storage, self.indexname, schema=self._schema)
+    def _read_toc(self, cached=True):
+        return TOC.read(self.storage, self.indexname, schema=self._schema,
+                        cached=cached)
 
     def _segments(self):
         return self._read_toc().segments
@@ -506,9 +550,10 @@ class FileIndex(Index):
 
             if reuse:
                 # Put all atomic readers in a dictionary keyed by their
-                # generation, so we can re-use them if them if possible
+                # segment ID, so we can re-use them if them if possible
                 readers = [r for r, _ in reuse.leaf_readers()]
-                reusable = dict((r.generation(), r) for r in readers)
+                reusable = dict((r.segment().segment_id(), r) for r in readers
+                                if r.segment() is not None)
 
             # Make a function to open readers, which reuses reusable readers.
             # It removes any readers it reuses from the "reusable" dictionary,
@@ -516,9 +561,18 @@ class FileIndex(Index):
             def segreader(segment):
                 segid = segment.segment_id()
                 if segid in reusable:
-                    r = reusable[segid]
-                    del reusable[segid]
-                    return r
+                    r = reusable.pop(segid)
+                    # Share the open files of the old reader. If documents in
+                    # the segment were deleted since the old reader was
+                    # opened, the new reader uses the new deletions
+                    if (r.segment().deletion_generation()
+                            == segment.deletion_generation()):
+                        newr = r.reopen(generation=generation)
+                    else:
+                        newr = r.reopen(segment, generation=generation)
+                    newr.schema = schema
+                    r.close()
+                    return newr
                 else:
                     return SegmentReader(storage, schema, segment,
                                          generation=generation)
@@ -558,13 +612,173 @@ class FileIndex(Index):
                 sleep(0.05)
 
 
+# Reader manager
+
+class ReaderManager(object):
+    """Keeps the segment readers of an index open between generations of the
+    index, so getting a reader for a new generation only opens the segments
+    that were added since the last generation::
+
+        manager = ReaderManager(myindex)
+
+        # Call this periodically (e.g. once a second) to pick up changes
+        manager.refresh()
+
+        # Each request gets a searcher for the latest refreshed generation
+        with manager.searcher() as s:
+            results = s.search(myquery)
+
+        # When the application shuts down
+        manager.close()
+
+    The manager keeps one open reader for each segment, keyed by the segment
+    ID and the segment's deletion generation (see
+    :meth:`whoosh.codec.base.Segment.deletion_generation`). If documents in a
+    segment are deleted, the new reader for the segment shares the open files
+    of the old one and only uses the new set of deleted documents.
+
+    The readers returned by :meth:`ReaderManager.reader` share open files with
+    the manager's readers using reference counting, so you should close them
+    when you're done with them, but closing them doesn't affect other readers.
+    Files for segments that no longer exist in the index (for example, because
+    they were merged) are closed when the last reader using them is closed.
+    """
+
+    def __init__(self, ix):
+        """
+        :param ix: the :class:`FileIndex` to read.
+        """
+
+        from threading import Lock
+
+        self.ix = ix
+        self.is_closed = False
+        self._lock = Lock()
+        self._reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def refresh(self):
+        """Updates the manager's readers to the latest generation of the
+        index. Returns True if the index changed since the last refresh.
+        """
+
+        from whoosh.reading import ReaderClosed
+
+        with self._lock:
+            if self.is_closed:
+                raise ReaderClosed
+            current = self._reader
+            if (current is not None
+                    and current.generation() == self.ix.latest_generation()):
+                return False
+
+            # Get a new reader, reusing the open segment readers of the current
+            # reader (this closes the current reader's segment readers)
+            self._reader = self.ix.reader(reuse=current)
+            return True
+
+    def _share(self, reader):
+        from whoosh.reading import EmptyReader, MultiReader
+
+        if reader.is_atomic():
+            if reader.segment() is None:
+                return EmptyReader(reader.schema)
+            return reader.reopen()
+
+        readers = [r.reopen() for r, _ in reader.leaf_readers()]
+        return MultiReader(readers, generation=reader.generation())
+
+    def reader(self):
+        """Returns a reader for the generation of the index as of the last
+        call to :meth:`ReaderManager.refresh`. The returned reader shares open
+        files with the manager's readers. Close it when you are done with it.
+        """
+
+        if self._reader is None:
+            self.refresh()
+        with self._lock:
+            return self._share(self._reader)
+
+    def searcher(self, **kwargs):
+        """Returns a :class:`whoosh.searching.Searcher` for the generation of
+        the index as of the last call to :meth:`ReaderManager.refresh`.
+        Keyword arguments are passed to the Searcher object's constructor.
+        """
+
+        from whoosh.searching import Searcher
+
+        return Searcher(self.reader(), fromindex=self.ix, **kwargs)
+
+    def close(self):
+        """Closes the manager's readers. Readers and searchers returned by the
+        manager keep working until they are closed.
+        """
+
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            self.is_closed = True
+
+
 # TOC class
 
+def _copy_schema(schema):
+    # Returns a copy of a cached schema with its own field dictionaries, so
+    # adding or removing fields doesn't change the cached schema. The field
+    # objects (and their analyzers) are shared with the cached schema
+    schema = copy.copy(schema)
+    schema._fields = schema._fields.copy()
+    schema._dyn_fields = schema._dyn_fields.copy()
+    return schema
+
+
+class _TOCCache(object):
+    # A process-wide cache of objects unpickled from TOC files, keyed by the
+    # pickled bytes (or a fingerprint of them). Objects from the cache are
+    # shared, so they must not be modified. When the cache is full it is
+    # simply cleared
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._objects = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        return self._objects.get(key)
+
+    def put(self, key, obj):
+        with self._lock:
+            if len(self._objects) >= self.limit:
+                self._objects.clear()
+            self._objects[key] = obj
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+
 class TOC(object):
     """Object representing the state of the index after a commit. Essentially
     a container for the index's schema and the list of segment objects.
+
+    The TOC file stores a fingerprint of the pickled schema and pickles each
+    segment separately. When reading, the unpickled schema and segments are
+    cached for the whole process (see ``TOC.read``), so opening a new
+    generation of an index doesn't rebuild the schema's analyzers or the
+    objects for segments that haven't changed.
     """
 
+    # Unpickled schemas keyed by fingerprint
+    schema_cache = _TOCCache(32)
+    # Unpickled segments keyed by their pickled bytes
+    segment_cache = _TOCCache(1024)
+
     def __init__(self, schema, segments, generation,
                  version=_CURRENT_TOC_VERSION, release=__version__):
         self.schema = schema
@@ -572,6 +786,11 @@ class TOC(object):
         self.generation = generation
         self.version = version
         self.release = release
+        # The pickled schema as read from the TOC file. If this is set when
+        # the TOC is written, the bytes are written as-is, so the schema's
+        # fingerprint stays the same from generation to generation (pickling
+        # the same schema twice doesn't always produce the same bytes)
+        self.schemabytes = None
 
     @classmethod
     def _filename(cls, indexname, gen):
@@ -611,7 +830,20 @@ class TOC(object):
         toc.write(storage, indexname)
 
     @classmethod
-    def read(cls, storage, indexname, gen=None, schema=None):
+    def read(cls, storage, indexname, gen=None, schema=None, cached=True):
+        """Reads the TOC file for the given generation of the index (or the
+        latest generation).
+
+        :param schema: if not None, use this schema object instead of the one
+            stored in the TOC file.
+        :param cached: if True, the segment objects and the schema's field
+            objects may be shared with other ``TOC`` objects in the process,
+            so they must not be modified (each ``TOC`` gets its own copy of
+            the schema, so adding and removing fields is safe). Use
+            ``cached=False`` to get private copies you can modify (for
+            example, in a writer).
+        """
+
         if gen is None:
             gen = cls._latest_generation(storage, indexname)
             if gen < 0:
@@ -619,6 +851,7 @@ class TOC(object):
                                       % (indexname, storage))
 
         # Read the content of this index from the .toc file.
+        schemabytes = None
         tocfilename = cls._filename(indexname, gen)
         stream = storage.open_file(tocfilename)
 
@@ -648,12 +881,22 @@ class TOC(object):
                 raise IndexVersionError("Can't read format %s" % version,
                                         version)
         else:
-            # If the user supplied a schema object with the constructor, don't
+            # If the user supplied a schema object with the constructor, or
+            # the schema with the same fingerprint was already unpickled, don't
             # load the pickled schema from the saved index.
+            fingerprint = stream.read_string()
+            if not schema and cached:
+                schema = cls.schema_cache.get(fingerprint)
+                if schema:
+                    schema = _copy_schema(schema)
             if schema:
                 stream.skip_string()
             else:
-                schema = pickle.loads(stream.read_string())
+                schemabytes = stream.read_string()
+                schema = pickle.loads(schemabytes)
+                if cached:
+                    cls.schema_cache.put(fingerprint, schema)
+                    schema = _copy_schema(schema)
             schema = ensure_schema(schema)
 
             # Generation
@@ -661,10 +904,22 @@ class TOC(object):
             assert gen == index_gen
 
             _ = stream.read_int()  # Unused
-            segments = stream.read_pickle()
+
+            # Table of pickled segments
+            segments = []
+            for _ in xrange(stream.read_varint()):
+                segbytes = stream.read_string()
+                segment = cls.segment_cache.get(segbytes) if cached else None
+                if segment is None:
+                    segment = pickle.loads(segbytes)
+                    if cached:
+                        cls.segment_cache.put(segbytes, segment)
+                segments.append(segment)
 
         stream.close()
-        return cls(schema, segments, gen, version=version, release=release)
+        toc = cls(schema, segments, gen, version=version, release=release)
+        toc.schemabytes = schemabytes
+        return toc
 
     def write(self, storage, indexname):
         schema = ensure_schema(self.schema)
@@ -685,7 +940,7 @@ class TOC(object):
             stream.write_varint(num)
 
         try:
-            stream.write_string(pickle.dumps(schema, -1))
+            schemabytes = self.schemabytes or pickle.dumps(schema, -1)
         except pickle.PicklingError:
             # Try to narrow down the error to a single field
             for fieldname, field in schema.items():
@@ -696,10 +951,14 @@ class TOC(object):
                     raise pickle.PicklingError("%s %s=%r" % (e, fieldname, field))
             # Otherwise, re-raise the original exception
             raise
+        stream.write_string(sha1(schemabytes).digest())
+        stream.write_string(schemabytes)
 
         stream.write_int(self.generation)
         stream.write_int(0)  # Unused
-        stream.write_pickle(self.segments)
+        stream.write_varint(len(self.segments))
+        for segment in self.segments:
+            stream.write_string(pickle.dumps(segment, -1))
         stream.close()
 
         # Rename temporary file to the proper filename
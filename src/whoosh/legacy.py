@@ -30,6 +30,7 @@ This module contains code for maintaining backwards compatibility with old
 index formats.
 """
 
+from whoosh.compat import pickle
 from whoosh.util.loading import RenamingUnpickler
 
 
@@ -69,8 +70,26 @@ def load_110_toc(stream, gen, schema, version):
     return schema, segments
 
 
+def load_111_toc(stream, gen, schema, version):
+    # Version -111 didn't store a fingerprint of the schema and pickled the
+    # list of segments as a single object
+
+    if schema:
+        stream.skip_string()
+    else:
+        schema = pickle.loads(stream.read_string())
+    # Read the generation number
+    index_gen = stream.read_int()
+    assert gen == index_gen
+    # Unused number
+    _ = stream.read_int()
+    # Unpickle the list of segment objects
+    segments = stream.read_pickle()
+    return schema, segments
+
+
 # Map TOC version numbers to functions to load that version
-toc_loaders = {-110: load_110_toc}
+toc_loaders = {-110: load_110_toc, -111: load_111_toc}
 
 
 # Map segment class names to functions to load the segment
@@ -170,6 +170,10 @@ class MpWriter(SegmentWriter):
         # If multisegment is True, don't merge the segments created by the
         # sub-writers, just add them directly to the TOC
         self.multisegment = multisegment
+        if not multisegment:
+            # This writer reads the files of the sub-writers' segments
+            # directly to merge them, so they must not be compound
+            self.subargs = dict(self.subargs, compound=False)
 
         # A list to hold the sub-task Process objects
         self.tasks = []
@@ -291,6 +295,7 @@ class MpWriter(SegmentWriter):
             # postings into this writer
             self._merge_subsegments(results, mergetype)
             self._close_segment()
+            self._sort_segment()
             self._assemble_segment()
             finalsegments.append(self.get_segment())
             assert self.perdocwriter.is_closed
@@ -344,7 +349,7 @@ class SerialMpWriter(MpWriter):
 
         self.procs = procs or cpu_count()
         self.batchsize = batchsize
-        self.subargs = subargs if subargs else kwargs
+        self.subargs = dict(subargs if subargs else kwargs, compound=False)
         self.tasks = [SegmentWriter(ix, _lk=False, **self.subargs)
                       for _ in xrange(self.procs)]
         self.pointer = 0
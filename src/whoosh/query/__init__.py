@@ -34,3 +34,4 @@ from whoosh.query.wrappers import *
 from whoosh.query.nested import *
 from whoosh.query.qcolumns import *
 from whoosh.query.spans import *
+from whoosh.query.planning import *
@@ -0,0 +1,278 @@
+# Copyright 2012 Matt Chaput. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY MATT CHAPUT ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL MATT CHAPUT OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Matt Chaput.
+
+"""
+This module contains a simple cost-based query planner, which rewrites a query
+into an equivalent query that's cheaper to run on a given searcher, using the
+queries' ``estimate_size()`` methods as the cost model.
+
+:meth:`whoosh.searching.Searcher.search` plans queries automatically (unless
+you pass ``optimize=False``). Use
+:meth:`whoosh.searching.Searcher.explain_plan` to see what the planner does
+with a query::
+
+    plan = mysearcher.explain_plan(myquery)
+    print(plan.explain())
+"""
+
+import copy
+
+from whoosh.compat import xrange
+from whoosh.query import qcore
+from whoosh.query.compound import And, AndMaybe, AndNot, Or, Require
+from whoosh.query.ranges import NumericRange
+from whoosh.query.terms import MultiTerm
+from whoosh.query.wrappers import CachedFilter, ConstantScoreQuery, Not
+
+
+# Query types the planner can rewrite. Planning any other query would only
+# cost time estimating its size
+_compound_types = (And, AndMaybe, AndNot, Or, Require)
+
+
+class QueryPlan(object):
+    """The result of planning a query with :class:`QueryPlanner`.
+
+    :ivar original: the query that was planned.
+    :ivar query: the rewritten query that should actually be run.
+    :ivar notes: a list of strings describing the changes the planner made.
+    """
+
+    def __init__(self, original, query, notes, reader):
+        self.original = original
+        self.query = query
+        self.notes = notes
+        self._reader = reader
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.query)
+
+    def explain(self):
+        """Returns a human-readable, multi-line description of the planned
+        query tree (with the estimated number of matching documents for each
+        node) and the changes the planner made.
+        """
+
+        lines = []
+        self._explain_node(self.query, 0, lines)
+        if self.notes:
+            lines.append("Changes:")
+            lines.extend("  " + note for note in self.notes)
+        return "\n".join(lines)
+
+    def _explain_node(self, q, depth, lines):
+        size = _estimate(q, self._reader)
+        if q.is_leaf() or isinstance(q, CachedFilter):
+            desc = repr(q)
+        else:
+            desc = q.__class__.__name__
+        lines.append("%s%s  (est. %s)" % ("  " * depth, desc,
+                                          "?" if size is None else size))
+        if not q.is_leaf() and not isinstance(q, CachedFilter):
+            for child in q.children():
+                self._explain_node(child, depth + 1, lines)
+
+
+def _estimate(q, reader):
+    # Returns the estimated size of the query, or None if the query can't
+    # estimate its size
+    try:
+        return q.estimate_size(reader)
+    except NotImplementedError:
+        return None
+
+
+class _PlanContext(object):
+    # The state of one call to QueryPlanner.plan()
+
+    def __init__(self, reader, scored, filters):
+        self.reader = reader
+        self.doccount = reader.doc_count()
+        self.scored = scored
+        self.filters = filters
+        self.sizes = {}
+        self.notes = []
+
+
+class QueryPlanner(object):
+    """Rewrites a query into an equivalent query that should be faster to run,
+    based on the estimated number of documents each part of the query matches
+    (:meth:`whoosh.query.Query.estimate_size`). The planner:
+
+    * Replaces sub-queries that provably can't match anything (their size
+      estimate, which is never an underestimate, is 0) with ``NullQuery``,
+      and short-circuits the compound queries that contain them (for example
+      an ``And`` with an empty clause is empty).
+
+    * Orders the clauses of ``And`` queries from the rarest to the most
+      frequent.
+
+    * Converts ``And`` clauses that match a large fraction of the index into
+      :class:`whoosh.query.CachedFilter` queries, which are cached on the
+      searcher, as long as this doesn't change the scores: either the search
+      isn't scored, or the clause gives every match the same score (for
+      example a constant-scoring ``NumericRange``).
+
+    The planner doesn't estimate the sizes of multi-term queries such as
+    ``Prefix`` (or of compound queries containing them), because that would
+    mean expanding them into their terms. It leaves queries that aren't
+    compound unchanged.
+    """
+
+    def __init__(self, filter_ratio=0.25, use_filters=True):
+        """
+        :param filter_ratio: an ``And`` clause whose estimated size is at
+            least this fraction of the number of documents in the index is
+            converted into a cached filter.
+        :param use_filters: if False, never convert clauses into filters.
+        """
+
+        self.filter_ratio = filter_ratio
+        self.use_filters = use_filters
+
+    def plan(self, q, searcher, scored=True, filters=True):
+        """Returns a :class:`QueryPlan` for the given query on the given
+        searcher.
+
+        :param q: the :class:`whoosh.query.Query` to plan.
+        :param searcher: the :class:`whoosh.searching.Searcher` the query will
+            run on.
+        :param scored: whether the search computes scores. If False, any
+            clause can become a cached filter.
+        :param filters: if False, don't convert clauses into filters (for
+            example, because the search records the matched terms).
+        """
+
+        reader = searcher.reader()
+        if not isinstance(q, _compound_types):
+            return QueryPlan(q, q, [], reader)
+
+        # The planner is shared by every search on the searcher (possibly in
+        # several threads), so keep the state of this call in a context
+        ctx = _PlanContext(reader, scored, filters and self.use_filters)
+        planned = self._plan(q, ctx)
+        return QueryPlan(q, planned, ctx.notes, reader)
+
+    def _size(self, q, ctx):
+        # Estimating the size of a multi-term query can mean expanding it, so
+        # remember the estimates while planning
+        sizes = ctx.sizes
+        try:
+            return sizes[q]
+        except KeyError:
+            if any(isinstance(leaf, MultiTerm) for leaf in q.leaves()):
+                size = None
+            else:
+                size = _estimate(q, ctx.reader)
+            sizes[q] = size
+            return size
+
+    def _plan(self, q, ctx):
+        if q is qcore.NullQuery or isinstance(q, Not):
+            return q
+
+        size = self._size(q, ctx)
+        if size == 0:
+            ctx.notes.append("%s can't match any documents" % (q,))
+            return qcore.NullQuery
+
+        if isinstance(q, And):
+            return self._plan_and(q, ctx)
+        elif isinstance(q, Or):
+            # Empty clauses are left in place (they're cheap to run) because
+            # removing them could change the coordination scores
+            subs = [self._plan(sub, ctx) for sub in q.subqueries]
+            if all(sub is qcore.NullQuery for sub in subs):
+                return qcore.NullQuery
+            return self._copy_with(q, subs)
+        elif isinstance(q, (AndNot, AndMaybe, Require)):
+            a = self._plan(q.a, ctx)
+            if a is qcore.NullQuery:
+                return a
+            b = q.b
+            if not isinstance(q, AndNot):
+                b = self._plan(b, ctx)
+                if b is qcore.NullQuery and isinstance(q, Require):
+                    return b
+            return q.__class__(a, b)
+        return q
+
+    def _copy_with(self, q, subqueries):
+        q = copy.copy(q)
+        q.subqueries = subqueries
+        return q
+
+    def _plan_and(self, q, ctx):
+        notes = ctx.notes
+        subs = []
+        for sub in q.subqueries:
+            sub = self._plan(sub, ctx)
+            if sub is qcore.NullQuery:
+                notes.append("%s is empty because a required clause can't "
+                             "match" % (q,))
+                return sub
+            subs.append(sub)
+
+        # Order the clauses from rarest to most frequent. Clauses that can't
+        # estimate their size go last
+        sizes = [self._size(sub, ctx) for sub in subs]
+        order = sorted(xrange(len(subs)),
+                       key=lambda i: (sizes[i] is None, sizes[i] or 0))
+        if order != list(xrange(len(subs))):
+            notes.append("reordered clauses of %s by estimated size" % (q,))
+        subs = [subs[i] for i in order]
+        sizes = [sizes[i] for i in order]
+
+        # Convert frequent clauses into cached filters. The rarest clause
+        # drives the intersection, so it is never converted
+        if ctx.filters and len(subs) > 1:
+            limit = self.filter_ratio * ctx.doccount
+            for i in xrange(1, len(subs)):
+                size = sizes[i]
+                if size is None or size < limit:
+                    continue
+                score = self._filter_score(subs[i], ctx)
+                if score is not None:
+                    notes.append("converted %s into a cached filter"
+                                 % (subs[i],))
+                    subs[i] = CachedFilter(subs[i], score)
+
+        return self._copy_with(q, subs)
+
+    def _filter_score(self, q, ctx):
+        # Returns the constant score to give documents matching the query when
+        # it's converted to a filter, or None if converting it would change
+        # the scores of the search
+        if isinstance(q, (Not, CachedFilter)):
+            return None
+        if not ctx.scored:
+            return 1.0
+        if isinstance(q, ConstantScoreQuery):
+            return q.score
+        if isinstance(q, NumericRange) and q.constantscore:
+            return q.boost
+        return None
@@ -140,7 +140,8 @@ class TermRange(RangeMixin, terms.MultiTerm):
     """
 
     def __init__(self, fieldname, start, end, startexcl=False, endexcl=False,
-                 boost=1.0, constantscore=True):
+                 boost=1.0, constantscore=True, rewrite=None, topterms=None,
+                 maxterms=None, truncate=None):
         """
         :param fieldname: The name of the field to search.
         :param start: Match terms equal to or greater than this.
@@ -151,6 +152,14 @@ class TermRange(RangeMixin, terms.MultiTerm):
             range end is inclusive.
         :param boost: Boost factor that should be applied to the raw score of
             results matched by this query.
+        :param rewrite: how to turn the expanded terms into a matcher, one of
+            the ``*_REWRITE`` constants on
+            :class:`whoosh.query.MultiTerm`.
+        :param topterms: the number of terms to keep with
+            ``MultiTerm.TOP_TERMS_REWRITE``.
+        :param maxterms: the maximum number of terms the query may expand to.
+        :param truncate: if True, ignore terms beyond ``maxterms`` instead of
+            raising :class:`whoosh.query.TooManyTerms`.
         """
 
         self.fieldname = fieldname
@@ -160,6 +169,7 @@ class TermRange(RangeMixin, terms.MultiTerm):
         self.endexcl = endexcl
         self.boost = boost
         self.constantscore = constantscore
+        self._set_rewrite(rewrite, topterms, maxterms, truncate)
 
     def normalize(self):
         if self.start in ('', None) and self.end in (u('\uffff'), None):
@@ -172,7 +182,7 @@ class TermRange(RangeMixin, terms.MultiTerm):
         else:
             return TermRange(self.fieldname, self.start, self.end,
                              self.startexcl, self.endexcl,
-                             boost=self.boost)
+                             boost=self.boost, **self._rewrite_kwargs())
 
     #def replace(self, fieldname, oldtext, newtext):
     #    q = self.copy()
@@ -224,10 +234,16 @@ class NumericRange(RangeMixin, qcore.Query):
 
     >>> # Match numbers from 10 to 5925 in the "number" field.
     >>> nr = NumericRange("number", 10, 5925)
+
+    If the field has a points column (see
+    :class:`whoosh.columns.PointsColumn`), a constant-scoring range is instead
+    answered by looking up the range in the points index of each segment,
+    which is much faster than reading the postings of the tiered terms for
+    large ranges.
     """
 
     def __init__(self, fieldname, start, end, startexcl=False, endexcl=False,
-                 boost=1.0, constantscore=True):
+                 boost=1.0, constantscore=True, usecolumn=None):
         """
         :param fieldname: The name of the field to search.
         :param start: Match terms equal to or greater than this number. This
@@ -245,6 +261,12 @@ class NumericRange(RangeMixin, qcore.Query):
             actually scoring the matched terms. This gives a nice speed boost
             and won't affect the results in most cases since numeric ranges
             will almost always be used as a filter.
+        :param usecolumn: whether to find the matching documents using the
+            field's column instead of the tiered terms. The default (None)
+            uses the column if it is a points column. True also scans plain
+            numeric columns, which can be faster than the terms for very wide
+            ranges. False always uses the terms. The column is only used when
+            ``constantscore`` is True.
         """
 
         self.fieldname = fieldname
@@ -254,6 +276,7 @@ class NumericRange(RangeMixin, qcore.Query):
         self.endexcl = endexcl
         self.boost = boost
         self.constantscore = constantscore
+        self.usecolumn = usecolumn
 
     def simplify(self, ixreader):
         return self._compile_query(ixreader).simplify(ixreader)
@@ -265,8 +288,71 @@ class NumericRange(RangeMixin, qcore.Query):
         return self._compile_query(ixreader).estimate_min_size(ixreader)
 
     def docs(self, searcher):
-        q = self._compile_query(searcher.reader())
-        return q.docs(searcher)
+        leafdocs = []
+        for reader, offset in searcher.reader().leaf_readers():
+            docnums = self._column_docs(reader)
+            if docnums is None:
+                # At least one segment can't use the column, so just use the
+                # terms for everything
+                q = self._compile_query(searcher.reader())
+                return q.docs(searcher)
+            leafdocs.append((docnums, offset))
+        return (offset + docnum for docnums, offset in leafdocs
+                for docnum in docnums)
+
+    def _column_docs(self, reader):
+        # Returns a sorted array of the undeleted documents in the given
+        # (leaf) reader matching this range using the field's column, or None
+        # if the column can't be used
+        from array import array
+        from whoosh.fields import NUMERIC
+
+        usecolumn = self.usecolumn
+        fieldname = self.fieldname
+        if usecolumn is False or not self.constantscore:
+            return None
+        field = reader.schema[fieldname]
+        if (not isinstance(field, NUMERIC) or not field.column_type or
+                not reader.has_column(fieldname)):
+            return None
+
+        creader = reader.column_reader(fieldname, translate=False)
+        if not hasattr(creader, "docs_in_range"):
+            return None
+        if not usecolumn and not creader.fast_ranges:
+            return None
+
+        # Convert the bounds into the column's representation. Open ends
+        # become the smallest and largest values the field can hold
+        tocolumn = field.number_to_column_value
+        start = self.start
+        if start is None:
+            low = tocolumn(field.prepare_number(field.min_value))
+        else:
+            low = tocolumn(field.prepare_number(start))
+            if self.startexcl:
+                low += 1
+        end = self.end
+        if end is None:
+            high = tocolumn(field.prepare_number(field.max_value))
+        else:
+            high = tocolumn(field.prepare_number(end))
+            if self.endexcl:
+                high -= 1
+
+        # Documents without a value have the column's default, which the
+        # column can't tell apart from a real value, so if the range covers
+        # the default fall back to the terms
+        default = field.column_type.default_value()
+        if low <= default <= high:
+            return None
+
+        docnums = creader.docs_in_range(low, high)
+        if docnums and reader.has_deletions():
+            is_deleted = reader.is_deleted
+            docnums = array("I", (docnum for docnum in docnums
+                                  if not is_deleted(docnum)))
+        return docnums
 
     def _compile_query(self, ixreader):
         from whoosh.fields import NUMERIC
@@ -311,6 +397,14 @@ class NumericRange(RangeMixin, qcore.Query):
         return q
 
     def matcher(self, searcher, context=None):
+        from whoosh.matching import ListMatcher, NullMatcher
+
+        docnums = self._column_docs(searcher.reader())
+        if docnums is not None:
+            if not docnums:
+                return NullMatcher()
+            return ListMatcher(docnums, all_weights=self.boost)
+
         q = self._compile_query(searcher.reader())
         return q.matcher(searcher, context)
 
@@ -327,7 +421,7 @@ class DateRange(NumericRange):
     """
 
     def __init__(self, fieldname, start, end, startexcl=False, endexcl=False,
-                 boost=1.0, constantscore=True):
+                 boost=1.0, constantscore=True, usecolumn=None):
         self.startdate = start
         self.enddate = end
         if start:
@@ -337,7 +431,8 @@ class DateRange(NumericRange):
         super(DateRange, self).__init__(fieldname, start, end,
                                         startexcl=startexcl, endexcl=endexcl,
                                         boost=boost,
-                                        constantscore=constantscore)
+                                        constantscore=constantscore,
+                                        usecolumn=usecolumn)
 
     def __repr__(self):
         return '%s(%r, %r, %r, %s, %s, boost=%s)' % (self.__class__.__name__,
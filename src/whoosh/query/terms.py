@@ -33,8 +33,10 @@ from collections import defaultdict
 
 from whoosh import matching
 from whoosh.analysis import Token
+from whoosh.automata.fsa import UnsupportedPattern, find_all_matches
 from whoosh.compat import bytes_type, text_type, u
 from whoosh.lang.morph_en import variations
+from whoosh.util.text import utf8decode, utf8encode
 from whoosh.query import qcore
 
 
@@ -143,16 +145,101 @@ class Term(qcore.Query):
             return matching.NullMatcher()
 
 
+class TooManyTerms(qcore.QueryError):
+    """Raised when a multi-term query expands to more terms than its
+    ``maxterms`` setting allows (and ``truncate`` is False).
+    """
+
+
 class MultiTerm(qcore.Query):
     """Abstract base class for queries that operate on multiple terms in the
     same field.
+
+    The ``rewrite`` attribute controls how the terms the query expands to are
+    turned into a matcher:
+
+    ``MultiTerm.AUTO_REWRITE``
+        Use ``BOOLEAN_REWRITE`` if the query expands to at most
+        ``BOOLEAN_TERM_LIMIT`` terms, otherwise use ``CONSTANT_SCORE_REWRITE``
+        if the query is constant scoring (and the search doesn't need the
+        individual term matchers, e.g. for highlighting).
+
+    ``MultiTerm.BOOLEAN_REWRITE``
+        Or together a scored matcher for every expanded term.
+
+    ``MultiTerm.TOP_TERMS_REWRITE``
+        Or together matchers for only the ``topterms`` expanded terms with the
+        highest document frequencies.
+
+    ``MultiTerm.CONSTANT_SCORE_REWRITE``
+        Read the postings of every expanded term in one pass into a
+        :class:`whoosh.idsets.BitSet` and match the documents in the set with
+        a constant score (the query's boost).
+
+    If ``maxterms`` is not None, the query raises :class:`TooManyTerms` when it
+    expands to more than that many terms, or if ``truncate`` is True, silently
+    ignores the terms after the first ``maxterms``.
     """
 
     constantscore = False
 
+    # Strategies for turning the expanded terms into a matcher
+    AUTO_REWRITE = 0
+    BOOLEAN_REWRITE = 1
+    TOP_TERMS_REWRITE = 2
+    CONSTANT_SCORE_REWRITE = 3
+
+    rewrite = AUTO_REWRITE
+    # AUTO_REWRITE switches from BOOLEAN_REWRITE to CONSTANT_SCORE_REWRITE
+    # when the query expands to more than this many terms
+    BOOLEAN_TERM_LIMIT = 128
+    # The number of terms to keep in TOP_TERMS_REWRITE
+    topterms = 50
+    # The maximum number of terms the query may expand to
+    maxterms = None
+    # Whether to ignore terms beyond maxterms instead of raising TooManyTerms
+    truncate = False
+
+    def _set_rewrite(self, rewrite=None, topterms=None, maxterms=None,
+                     truncate=None):
+        # Only set instance attributes for options that were given, so the
+        # class attributes act as defaults
+        if rewrite is not None:
+            self.rewrite = rewrite
+        if topterms is not None:
+            self.topterms = topterms
+        if maxterms is not None:
+            self.maxterms = maxterms
+        if truncate is not None:
+            self.truncate = truncate
+
+    def _rewrite_kwargs(self):
+        # Returns the rewrite options set on this instance, for passing to the
+        # constructor of a normalized copy of this query
+        d = self.__dict__
+        return dict((key, d[key]) for key in
+                    ("rewrite", "topterms", "maxterms", "truncate")
+                    if key in d)
+
     def _btexts(self, ixreader):
         raise NotImplementedError(self.__class__.__name__)
 
+    def _limited_btexts(self, ixreader):
+        # Applies the maxterms limit to the expansion
+        maxterms = self.maxterms
+        if maxterms is None:
+            for btext in self._btexts(ixreader):
+                yield btext
+            return
+
+        for i, btext in enumerate(self._btexts(ixreader)):
+            if i >= maxterms:
+                if self.truncate:
+                    return
+                raise TooManyTerms("%r expanded to more than %d terms"
+                                   % (self, maxterms))
+            yield btext
+
     def expanded_terms(self, ixreader, phrases=False):
         fieldname = self.field()
         if fieldname:
@@ -202,13 +289,46 @@ class MultiTerm(qcore.Query):
                    for text in self._btexts(ixreader))
 
     def matcher(self, searcher, context=None):
+        reader = searcher.reader()
+        btexts = self._limited_btexts(reader)
+        rewrite = self.rewrite
+
+        if rewrite == self.TOP_TERMS_REWRITE:
+            return self._top_terms_matcher(searcher, context, btexts)
+        elif rewrite == self.CONSTANT_SCORE_REWRITE:
+            return self._constant_score_matcher(searcher, btexts)
+        elif rewrite == self.BOOLEAN_REWRITE:
+            return self._boolean_matcher(searcher, context, list(btexts))
+        elif rewrite != self.AUTO_REWRITE:
+            raise ValueError("Unknown rewrite %r" % rewrite)
+
+        # Read terms up to the limit to find out how big the expansion is
+        limit = self.BOOLEAN_TERM_LIMIT
+        words = []
+        for btext in btexts:
+            words.append(btext)
+            if len(words) > limit:
+                break
+
+        needs_current = context.needs_current if context else True
+        if (len(words) <= limit or not self.constantscore
+                or needs_current):
+            words.extend(btexts)
+            return self._boolean_matcher(searcher, context, words)
+        else:
+            # Switch to filling a bit set with the terms we've already read
+            # and the rest of the expansion
+            from itertools import chain
+
+            return self._constant_score_matcher(searcher, chain(words, btexts))
+
+    def _boolean_matcher(self, searcher, context, words):
         from whoosh.query import Or
 
         fieldname = self.field()
         constantscore = self.constantscore
 
-        reader = searcher.reader()
-        qs = [Term(fieldname, word) for word in self._btexts(reader)]
+        qs = [Term(fieldname, word) for word in words]
         if not qs:
             return matching.NullMatcher()
 
@@ -228,6 +348,42 @@ class MultiTerm(qcore.Query):
             m = Or(qs, boost=self.boost).matcher(searcher, context)
         return m
 
+    def _top_terms_matcher(self, searcher, context, btexts):
+        # Keep a bounded heap of the terms with the highest doc frequencies
+        from heapq import heappush, heapreplace
+
+        fieldname = self.field()
+        reader = searcher.reader()
+        topterms = self.topterms
+
+        heap = []
+        for btext in btexts:
+            df = reader.doc_frequency(fieldname, btext)
+            if len(heap) < topterms:
+                heappush(heap, (df, btext))
+            elif df > heap[0][0]:
+                heapreplace(heap, (df, btext))
+
+        words = sorted(btext for _, btext in heap)
+        return self._boolean_matcher(searcher, context, words)
+
+    def _constant_score_matcher(self, searcher, btexts):
+        from array import array
+        from whoosh.idsets import BitSet
+
+        fieldname = self.field()
+        reader = searcher.reader()
+        docset = BitSet(size=searcher.doc_count_all())
+        add = docset.add
+        for btext in btexts:
+            for docnum in reader.postings(fieldname, btext).all_ids():
+                add(docnum)
+
+        ids = array("I", docset)
+        if not ids:
+            return matching.NullMatcher()
+        return matching.ListMatcher(ids, all_weights=self.boost)
+
 
 class PatternQuery(MultiTerm):
     """An intermediate base class for common methods of Prefix and Wildcard.
@@ -235,11 +391,29 @@ class PatternQuery(MultiTerm):
 
     __inittypes__ = dict(fieldname=str, text=text_type, boost=float)
 
-    def __init__(self, fieldname, text, boost=1.0, constantscore=True):
+    def __init__(self, fieldname, text, boost=1.0, constantscore=True,
+                 rewrite=None, topterms=None, maxterms=None, truncate=None):
+        """
+        :param fieldname: The name of the field to search.
+        :param text: The pattern to match.
+        :param boost: A boost factor to apply to scores of documents matching
+            this query.
+        :param constantscore: If True, the expanded terms don't need to be
+            scored individually.
+        :param rewrite: how to turn the expanded terms into a matcher, one of
+            the ``*_REWRITE`` constants on :class:`MultiTerm`.
+        :param topterms: the number of terms to keep with
+            ``MultiTerm.TOP_TERMS_REWRITE``.
+        :param maxterms: the maximum number of terms the query may expand to.
+        :param truncate: if True, ignore terms beyond ``maxterms`` instead of
+            raising :class:`TooManyTerms`.
+        """
+
         self.fieldname = fieldname
         self.text = text
         self.boost = boost
         self.constantscore = constantscore
+        self._set_rewrite(rewrite, topterms, maxterms, truncate)
 
     def __eq__(self, other):
         return (other and self.__class__ is other.__class__
@@ -271,9 +445,52 @@ class PatternQuery(MultiTerm):
                 break
         return text[:i]
 
+    def _get_automaton(self):
+        # Subclasses can override this method to return a DFA equivalent to
+        # the pattern, or raise UnsupportedPattern if there isn't one
+        raise UnsupportedPattern
+
+    def _automaton(self, field):
+        # Returns a compiled DFA for this query's pattern, or None if the
+        # pattern can't be converted or the field doesn't store UTF-8 text
+        from whoosh.fields import FieldType
+
+        if type(field).from_bytes != FieldType.from_bytes:
+            return None
+
+        cached = getattr(self, "_dfa", None)
+        if cached is None or cached[0] != self.text:
+            try:
+                dfa = self._get_automaton()
+            except UnsupportedPattern:
+                dfa = None
+            cached = self._dfa = (self.text, dfa)
+        return cached[1]
+
     def _btexts(self, ixreader):
         field = ixreader.schema[self.fieldname]
+        dfa = self._automaton(field)
+        if dfa is not None:
+            return self._automaton_btexts(ixreader, dfa)
+        else:
+            return self._scan_btexts(ixreader, field)
+
+    def _automaton_btexts(self, ixreader, dfa):
+        # Intersect the automaton with the sorted term dictionary, seeking
+        # past terms that can't match instead of testing every term
+        fieldname = self.fieldname
+
+        def keys_from(text):
+            btext = utf8encode(text)[0]
+            for fn, bterm in ixreader.terms_from(fieldname, btext):
+                if fn != fieldname:
+                    return
+                yield utf8decode(bterm)[0]
 
+        for text in find_all_matches(dfa, keys_from):
+            yield utf8encode(text)[0]
+
+    def _scan_btexts(self, ixreader, field):
         exp = re.compile(self._get_pattern())
         prefix = self._find_prefix(self.text)
         if prefix:
@@ -329,6 +546,11 @@ class Wildcard(PatternQuery):
     def _get_pattern(self):
         return fnmatch.translate(self.text)
 
+    def _get_automaton(self):
+        from whoosh.automata.glob import glob_automaton
+
+        return glob_automaton(self.text)
+
     def normalize(self):
         # If there are no wildcard characters in this "wildcard", turn it into
         # a simple Term
@@ -343,7 +565,8 @@ class Wildcard(PatternQuery):
               and text.find("*") == len(text) - 1):
             # If the only wildcard char is an asterisk at the end, convert to a
             # Prefix query.
-            return Prefix(self.fieldname, self.text[:-1], boost=self.boost)
+            return Prefix(self.fieldname, self.text[:-1], boost=self.boost,
+                          **self._rewrite_kwargs())
         else:
             return self
 
@@ -374,6 +597,11 @@ class Regex(PatternQuery):
     def _get_pattern(self):
         return self.text
 
+    def _get_automaton(self):
+        from whoosh.automata.reg import regex_automaton
+
+        return regex_automaton(self.text)
+
     def _find_prefix(self, text):
         if "|" in text:
             return ""
@@ -425,7 +653,8 @@ class FuzzyTerm(ExpandingTerm):
                          maxdist=float, prefixlength=int)
 
     def __init__(self, fieldname, text, boost=1.0, maxdist=1,
-                 prefixlength=1, constantscore=True):
+                 prefixlength=1, constantscore=True, rewrite=None,
+                 topterms=None, maxterms=None, truncate=None):
         """
         :param fieldname: The name of the field to search.
         :param text: The text to search for.
@@ -436,6 +665,13 @@ class FuzzyTerm(ExpandingTerm):
             characters with 'text'. For example, if text is "light" and
             prefixlength is 2, then only terms starting with "li" are checked
             for similarity.
+        :param rewrite: how to turn the expanded terms into a matcher, one of
+            the ``*_REWRITE`` constants on :class:`MultiTerm`.
+        :param topterms: the number of terms to keep with
+            ``MultiTerm.TOP_TERMS_REWRITE``.
+        :param maxterms: the maximum number of terms the query may expand to.
+        :param truncate: if True, ignore terms beyond ``maxterms`` instead of
+            raising :class:`TooManyTerms`.
         """
 
         self.fieldname = fieldname
@@ -444,6 +680,7 @@ class FuzzyTerm(ExpandingTerm):
         self.maxdist = maxdist
         self.prefixlength = prefixlength
         self.constantscore = constantscore
+        self._set_rewrite(rewrite, topterms, maxterms, truncate)
 
     def __eq__(self, other):
         return (other and self.__class__ is other.__class__
@@ -183,6 +183,67 @@ class ConstantScoreQuery(WrappingQuery):
                                         term=m.term())
 
 
+class CachedFilter(WrappingQuery):
+    """Wraps a query and matches the same documents, but reads all the matching
+    documents of each segment into a bit set the first time it's used, and
+    caches the bit set on the searcher so other searches using the same
+    filter on the same searcher don't have to run the wrapped query again.
+    Every matching document gets the same score.
+
+    This is useful for clauses that match a large part of the index and don't
+    need to contribute to the score, such as a wide date range in an ``And``.
+    The query planner (see :class:`whoosh.query.planning.QueryPlanner`)
+    converts such clauses to cached filters automatically.
+    """
+
+    def __init__(self, child, score=1.0):
+        WrappingQuery.__init__(self, child)
+        self.score = score
+
+    def __eq__(self, other):
+        return (other and self.__class__ is other.__class__
+                and self.child == other.child and self.score == other.score)
+
+    def __hash__(self):
+        return hash(self.__class__.__name__) ^ hash(self.child)
+
+    def __unicode__(self):
+        return text_type(self.child)
+
+    __str__ = __unicode__
+
+    def _rewrap(self, child):
+        return self.__class__(child, self.score)
+
+    def _docset(self, searcher):
+        from whoosh.idsets import BitSet
+
+        # The searcher's filter cache is shared with its sub-searchers, so
+        # key the cached set on the segments the searcher covers
+        key = None
+        states = searcher._segment_states()
+        if states is not None:
+            key = (self.child, states)
+            docset = searcher._filter_cache.get(key)
+            if docset is not None:
+                return docset
+
+        docset = BitSet(self.child.docs(searcher),
+                        size=searcher.doc_count_all())
+        if key is not None:
+            searcher._filter_cache.put(key, docset)
+        return docset
+
+    def docs(self, searcher):
+        return iter(self._docset(searcher))
+
+    def matcher(self, searcher, context=None):
+        docset = self._docset(searcher)
+        if not docset:
+            return matching.NullMatcher()
+        return matching.ListMatcher(array("I", docset), all_weights=self.score)
+
+
 class WeightingQuery(WrappingQuery):
     """Wraps a query and uses a specific :class:`whoosh.sorting.WeightingModel`
     to score documents that match the wrapped query.
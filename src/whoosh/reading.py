@@ -28,12 +28,15 @@
 """This module contains classes that allow reading from an index.
 """
 
+import copy
 from math import log
 from bisect import bisect_left, bisect_right
 from heapq import heapify, heapreplace, heappop, nlargest
+from threading import Lock
 
 from whoosh import columns, scoring
 from whoosh.automata import fst
+from whoosh.codec.base import DeletionsPerDocReader
 from whoosh.compat import abstractmethod
 from whoosh.compat import xrange, zip_, next, iteritems
 from whoosh.filedb.filestore import OverlayStorage
@@ -242,6 +245,7 @@ class IndexReader(object):
         """Yields terms in the given field that start with the given prefix.
         """
 
+        prefix = self._text_to_bytes(fieldname, prefix)
         for fn, text in self.terms_from(fieldname, prefix):
             if fn != fieldname or not text.startswith(prefix):
                 return
@@ -337,15 +341,27 @@ class IndexReader(object):
         raise NotImplementedError
 
     @abstractmethod
-    def stored_fields(self, docnum):
+    def stored_fields(self, docnum, fieldnames=None):
         """Returns the stored fields for the given document number.
 
-        :param numerickeys: use field numbers as the dictionary keys instead of
-            field names.
+        :param fieldnames: if not None, only the values of these fields are
+            returned. Depending on the codec, this can avoid reading the
+            values of other (possibly large) stored fields.
         """
 
         raise NotImplementedError
 
+    def prefetch_stored_fields(self, docnums):
+        """Hints that the stored fields of the given documents are about to be
+        read, so the storage can start loading them in one batch instead of
+        faulting them in one document at a time. This is only a hint and the
+        default implementation does nothing.
+
+        :param docnums: a sorted sequence of document numbers.
+        """
+
+        pass
+
     def all_stored_fields(self):
         """Yields the stored fields for all documents (including deleted
         documents).
@@ -421,6 +437,28 @@ class IndexReader(object):
             return p.id()
         raise TermNotFound((fieldname, text))
 
+    def unique_docnums(self, fieldname, tbytes_list):
+        """Returns a dictionary mapping each of the given terms (as bytes)
+        that appears in an undeleted document to the number of that document.
+        This is meant for fields marked ``unique`` in the schema, where each
+        term identifies at most one document. Segments that have a key index
+        for the field look up all the terms in one pass without reading their
+        postings.
+
+        :param fieldname: the name of the field.
+        :param tbytes_list: a sequence of terms as bytes.
+        """
+
+        result = {}
+        for tbytes in tbytes_list:
+            try:
+                p = self.postings(fieldname, tbytes)
+            except (KeyError, TermNotFound):
+                continue
+            if p.is_active():
+                result[tbytes] = p.id()
+        return result
+
     def iter_postings(self):
         """Low-level method, yields all postings in the reader as
         ``(fieldname, text, docnum, weight, valuestring)`` tuples.
@@ -611,6 +649,42 @@ class IndexReader(object):
 
 # Segment-based reader
 
+class _SegmentFiles(object):
+    # Holds the open files of a segment. The files are shared by a
+    # SegmentReader and the readers created from it with reopen(), and are
+    # closed when the last of those readers is closed
+
+    def __init__(self, storage, terms, perdoc):
+        self.storage = storage
+        self.terms = terms
+        self.perdoc = perdoc
+        self.graph = None
+        self.refs = 1
+        self.lock = Lock()
+
+    def incref(self):
+        with self.lock:
+            if self.refs <= 0:
+                raise ReaderClosed
+            self.refs += 1
+
+    def decref(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs:
+                return
+
+        self.terms.close()
+        self.perdoc.close()
+        if self.graph:
+            self.graph.close()
+
+        # It's possible some weird codec that doesn't use storage might have
+        # passed None instead of a storage object
+        if self.storage:
+            self.storage.close()
+
+
 class SegmentReader(IndexReader):
     def __init__(self, storage, schema, segment, generation=None, codec=None):
         self.schema = schema
@@ -638,12 +712,44 @@ class SegmentReader(IndexReader):
         self._terms = self._codec.terms_reader(self._storage, segment)
         self._perdoc = self._codec.per_document_reader(self._storage, segment)
         self._graph = None  # Lazy open with self._get_graph()
+        self._files = _SegmentFiles(self._storage, self._terms, self._perdoc)
 
     def _get_graph(self):
         if not self._graph:
-            self._graph = self._codec.graph_reader(self._storage, self._segment)
+            files = self._files
+            with files.lock:
+                if not files.graph:
+                    files.graph = self._codec.graph_reader(self._storage,
+                                                           self._segment)
+            self._graph = files.graph
         return self._graph
 
+    def reopen(self, segment=None, generation=None):
+        """Returns a new reader for this reader's segment that shares this
+        reader's open files. The files stay open until both readers are
+        closed.
+
+        :param segment: a later version of this reader's segment (the same
+            segment ID, but possibly with more deleted documents). The new
+            reader uses the deletions from this segment object.
+        :param generation: the index generation of the new reader.
+        """
+
+        if self.is_closed:
+            raise ReaderClosed
+        self._files.incref()
+
+        r = copy.copy(self)
+        if segment is not None and segment is not self._segment:
+            if segment.segment_id() != self._segid:
+                raise ValueError("%r is not a version of %r"
+                                 % (segment, self._segment))
+            r._segment = segment
+            r._perdoc = DeletionsPerDocReader(self._files.perdoc, segment)
+        if generation is not None:
+            r._gen = generation
+        return r
+
     def codec(self):
         return self._codec
 
@@ -692,27 +798,27 @@ class SegmentReader(IndexReader):
     def close(self):
         if self.is_closed:
             raise ReaderClosed("Reader already closed")
-        self._terms.close()
-        self._perdoc.close()
-        if self._graph:
-            self._graph.close()
-
-        # It's possible some weird codec that doesn't use storage might have
-        # passed None instead of a storage object
-        if self._storage:
-            self._storage.close()
-
         self.is_closed = True
+        # Close the files if no other reader is sharing them
+        self._files.decref()
 
-    def stored_fields(self, docnum):
+    def stored_fields(self, docnum, fieldnames=None):
         if self.is_closed:
             raise ReaderClosed
         assert docnum >= 0
         schema = self.schema
-        sfs = self._perdoc.stored_fields(docnum)
+        if fieldnames is None:
+            sfs = self._perdoc.stored_fields(docnum)
+        else:
+            sfs = self._perdoc.stored_field_values(docnum, fieldnames)
         # Double-check with schema to filter out removed fields
         return dict(item for item in iteritems(sfs) if item[0] in schema)
 
+    def prefetch_stored_fields(self, docnums):
+        # This is only a hint, so don't complain if the reader is closed
+        if not self.is_closed:
+            self._perdoc.prefetch_stored_fields(docnums)
+
     # Delegate doc methods to the per-doc reader
 
     def all_doc_ids(self):
@@ -832,6 +938,27 @@ class SegmentReader(IndexReader):
         except KeyError:
             return 0
 
+    def unique_docnums(self, fieldname, tbytes_list):
+        if self.is_closed:
+            raise ReaderClosed
+
+        terms = self._terms
+        if not terms.has_key_index(fieldname):
+            return IndexReader.unique_docnums(self, fieldname, tbytes_list)
+
+        is_deleted = self._perdoc.is_deleted
+        result = {}
+        for tbytes, docnums in terms.key_docnums(fieldname, tbytes_list):
+            if docnums is None:
+                result.update(IndexReader.unique_docnums(self, fieldname,
+                                                         [tbytes]))
+                continue
+            for docnum in docnums:
+                if not is_deleted(docnum):
+                    result[tbytes] = docnum
+                    break
+        return result
+
     def postings(self, fieldname, text, scorer=None):
         from whoosh.matching.wrappers import FilterMatcher
 
@@ -970,7 +1097,7 @@ class EmptyReader(IndexReader):
     def is_deleted(self, docnum):
         return False
 
-    def stored_fields(self, docnum):
+    def stored_fields(self, docnum, fieldnames=None):
         raise KeyError("No document number %s" % docnum)
 
     def all_stored_fields(self):
@@ -1211,6 +1338,21 @@ class MultiReader(IndexReader):
 
         raise TermNotFound((fieldname, text))
 
+    def unique_docnums(self, fieldname, tbytes_list):
+        # Check the newest segments first, and stop looking for a term as
+        # soon as an undeleted document is found for it
+        remaining = set(tbytes_list)
+        result = {}
+        for i in xrange(len(self.readers) - 1, -1, -1):
+            if not remaining:
+                break
+            found = self.readers[i].unique_docnums(fieldname, remaining)
+            offset = self.doc_offsets[i]
+            for tbytes, docnum in iteritems(found):
+                result[tbytes] = offset + docnum
+            remaining.difference_update(found)
+        return result
+
     # Deletion methods
 
     def has_deletions(self):
@@ -1220,9 +1362,18 @@ class MultiReader(IndexReader):
         segmentnum, segmentdoc = self._segment_and_docnum(docnum)
         return self.readers[segmentnum].is_deleted(segmentdoc)
 
-    def stored_fields(self, docnum):
+    def stored_fields(self, docnum, fieldnames=None):
         segmentnum, segmentdoc = self._segment_and_docnum(docnum)
-        return self.readers[segmentnum].stored_fields(segmentdoc)
+        return self.readers[segmentnum].stored_fields(segmentdoc, fieldnames)
+
+    def prefetch_stored_fields(self, docnums):
+        # Split the (sorted) document numbers into runs for each sub-reader
+        bysegment = {}
+        for docnum in docnums:
+            segmentnum, segmentdoc = self._segment_and_docnum(docnum)
+            bysegment.setdefault(segmentnum, []).append(segmentdoc)
+        for segmentnum, segmentdocs in iteritems(bysegment):
+            self.readers[segmentnum].prefetch_stored_fields(segmentdocs)
 
     # Per doc methods
 
@@ -32,9 +32,15 @@
 from __future__ import division
 import copy
 import weakref
+from heapq import nsmallest
+from datetime import date, datetime, timedelta
 from math import ceil
+from operator import itemgetter
+from threading import Lock
+from time import time
 
-from whoosh import classify, highlight, query, scoring
+from whoosh import classify, highlight, query, scoring, sorting
+from whoosh.compat import bytes_type, integer_types, string_type
 from whoosh.compat import iteritems, itervalues, iterkeys, xrange
 from whoosh.idsets import DocIdSet, BitSet
 from whoosh.reading import TermNotFound
@@ -60,6 +66,137 @@ class TimeLimit(Exception):
     pass
 
 
+# Result cache
+
+class ResultCache(object):
+    """Caches the results of :meth:`Searcher.search` so repeating a search
+    with the same arguments on the same version of the index doesn't have to
+    run the query again::
+
+        cache = ResultCache(maxsize=500, ttl=60)
+        with myindex.searcher(resultcache=cache) as s:
+            results = s.search(myquery, limit=10)
+
+    The cache key includes the normalized query, the search keyword arguments
+    (such as ``limit``, ``sortedby``, ``groupedby``, and ``filter``), the
+    weighting model, and the ID and deletion count of every segment in the
+    searcher. So a cached entry is only used by a searcher that sees exactly
+    the same segments with exactly the same deletions, and you can share one
+    cache between all the searchers of an index: when a segment changes or
+    gains deletions, entries that depend on the old version are simply not
+    used any more and eventually age out of the cache.
+
+    You can plug in a different cache implementation by passing any object
+    with ``get(key)`` and ``put(key, results)`` methods to the ``Searcher``.
+    """
+
+    def __init__(self, maxsize=1000, ttl=None):
+        """
+        :param maxsize: the maximum number of results to keep. When the cache
+            is full, the least recently used 10% of the entries are removed.
+        :param ttl: if not None, the number of seconds after which a cached
+            entry expires.
+        """
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._data = {}
+        self._lastused = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Returns the cached results for the given key, or None if the key
+        is not in the cache or the entry has expired.
+        """
+
+        with self._lock:
+            try:
+                created, results = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            now = time()
+            if self.ttl is not None and now - created > self.ttl:
+                del self._data[key]
+                del self._lastused[key]
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._lastused[key] = now
+            return results
+
+    def put(self, key, results):
+        """Adds results to the cache under the given key.
+        """
+
+        with self._lock:
+            maxsize = self.maxsize
+            if key not in self._data and len(self._data) >= maxsize:
+                for k, _ in nsmallest(maxsize // 10 or 1,
+                                      iteritems(self._lastused),
+                                      key=itemgetter(1)):
+                    del self._data[k]
+                    del self._lastused[k]
+
+            now = time()
+            self._data[key] = (now, results)
+            self._lastused[key] = now
+
+    def clear(self):
+        """Removes all entries from the cache.
+        """
+
+        with self._lock:
+            self._data.clear()
+            self._lastused.clear()
+            self.hits = self.misses = 0
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _cache_token(obj):
+    # Converts a search argument into a hashable value for a cache key, or
+    # raises _Uncacheable if there's no reliable way to do that
+
+    if obj is None or isinstance(obj, integer_types + (float, string_type,
+                                                       bytes_type)):
+        return obj
+    elif isinstance(obj, (datetime, date, timedelta)):
+        return obj
+    elif isinstance(obj, query.Query):
+        # The repr of a query doesn't include all of its options (for example
+        # maxterms), so use the class and the public attributes of the
+        # normalized query. Private attributes are lazy caches (such as the
+        # compiled automaton of a Wildcard query), not options
+        q = obj.normalize()
+        attrs = dict((k, v) for k, v in iteritems(q.__dict__)
+                     if not k.startswith("_"))
+        return (_cache_token(type(q)), _cache_token(attrs))
+    elif isinstance(obj, (list, tuple)):
+        return tuple(_cache_token(x) for x in obj)
+    elif isinstance(obj, (set, frozenset)):
+        return frozenset(_cache_token(x) for x in obj)
+    elif isinstance(obj, dict):
+        return tuple(sorted((repr(k), _cache_token(v))
+                            for k, v in iteritems(obj)))
+    elif isinstance(obj, type):
+        return obj.__module__ + "." + obj.__name__
+    elif isinstance(obj, (sorting.FacetType, sorting.Facets,
+                          scoring.WeightingModel)):
+        # Facets and weighting models are configured by their attributes
+        return (_cache_token(type(obj)), _cache_token(obj.__dict__))
+    else:
+        raise _Uncacheable
+
+
 # Context class
 
 class SearchContext(object):
@@ -104,7 +241,8 @@ class Searcher(object):
     """
 
     def __init__(self, reader, weighting=scoring.BM25F, closereader=True,
-                 fromindex=None, parent=None):
+                 fromindex=None, parent=None, resultcache=None,
+                 planner=None, filtercachesize=100):
         """
         :param reader: An :class:`~whoosh.reading.IndexReader` object for
             the index to search.
@@ -115,12 +253,24 @@ class Searcher(object):
         :param fromindex: An optional reference to the index of the underlying
             reader. This is required for :meth:`Searcher.up_to_date` and
             :meth:`Searcher.refresh` to work.
+        :param resultcache: an optional :class:`ResultCache` object (or any
+            object with the same ``get()`` and ``put()`` methods) to cache the
+            results of :meth:`Searcher.search`.
+        :param planner: the :class:`whoosh.query.planning.QueryPlanner` object
+            used to plan queries in :meth:`Searcher.search`. The default is a
+            planner with default settings.
+        :param filtercachesize: the maximum number of document sets of
+            :class:`whoosh.query.CachedFilter` queries to keep on this
+            searcher. When the cache is full, the least recently used sets
+            are removed.
         """
 
         self.ixreader = reader
         self.is_closed = False
         self._closereader = closereader
         self._ix = fromindex
+        self.resultcache = resultcache
+        self.planner = planner or query.QueryPlanner()
         self._doccount = self.ixreader.doc_count_all()
         # Cache for PostingCategorizer objects (supports fields without columns)
         self._field_caches = {}
@@ -134,7 +284,7 @@ class Searcher(object):
             self.parent = None
             self.schema = self.ixreader.schema
             self._idf_cache = {}
-            self._filter_cache = {}
+            self._filter_cache = ResultCache(maxsize=filtercachesize)
 
         if type(weighting) is type:
             self.weighting = weighting()
@@ -152,7 +302,8 @@ class Searcher(object):
         for name in ("stored_fields", "all_stored_fields", "has_vector",
                      "vector", "vector_as", "lexicon", "field_terms",
                      "frequency", "doc_frequency", "term_info",
-                     "doc_field_length", "corrector", "iter_docs"):
+                     "doc_field_length", "corrector", "iter_docs",
+                     "prefetch_stored_fields"):
             setattr(self, name, getattr(self.ixreader, name))
 
     def __enter__(self):
@@ -250,7 +401,9 @@ class Searcher(object):
         self.is_closed = True
         newreader = self._ix.reader(reuse=self.ixreader)
         return self.__class__(newreader, fromindex=self._ix,
-                              weighting=self.weighting)
+                              weighting=self.weighting,
+                              resultcache=self.resultcache,
+                              planner=self.planner)
 
     def close(self):
         if self._closereader:
@@ -407,11 +560,14 @@ class Searcher(object):
         """
 
         # In the common case where only one keyword was given, just use
-        # first_id() instead of building a query.
+        # the key index (for unique fields) or first_id() instead of building
+        # a query.
 
         self._kw_to_text(kw)
         if len(kw) == 1:
             k, v = list(kw.items())[0]
+            if self.schema[k].unique:
+                return self.reader().unique_docnums(k, [v]).get(v)
             try:
                 return self.reader().first_id(k, v)
             except TermNotFound:
@@ -435,12 +591,18 @@ class Searcher(object):
         return self.docs_for_query(self._query_for_kw(kw))
 
     def _find_unique(self, uniques):
-        # uniques is a list of ("unique_field_name", "field_value") tuples
-        delset = set()
+        # uniques is a list of ("unique_field_name", "field_value") tuples.
+        # Group the values by field so each field's key index is searched in
+        # one pass
+        byfield = {}
         for name, value in uniques:
-            docnum = self.document_number(**{name: value})
-            if docnum is not None:
-                delset.add(docnum)
+            tbytes = self.schema[name].to_bytes(value)
+            byfield.setdefault(name, []).append(tbytes)
+
+        reader = self.reader()
+        delset = set()
+        for name, tbytes_list in iteritems(byfield):
+            delset.update(itervalues(reader.unique_docnums(name, tbytes_list)))
         return delset
 
     @lru_cache(20)
@@ -640,6 +802,25 @@ class Searcher(object):
         results = self.search(query, limit=pagenum * pagelen, **kwargs)
         return ResultsPage(results, pagenum, pagelen)
 
+    def stored_fields_many(self, docnums, fieldnames=None):
+        """Returns a list of the stored fields of the given documents, in the
+        same order as ``docnums``. The documents are read in document number
+        order (the order they are stored on disk).
+
+        :param docnums: a sequence of document numbers.
+        :param fieldnames: if not None, only the values of these fields are
+            returned.
+        """
+
+        stored_fields = self.ixreader.stored_fields
+        order = sorted(set(docnums))
+        # Let the storage start loading all the documents at once
+        self.ixreader.prefetch_stored_fields(order)
+        found = {}
+        for docnum in order:
+            found[docnum] = stored_fields(docnum, fieldnames)
+        return [found[docnum] for docnum in docnums]
+
     def find(self, defaultfield, querystring, **kwargs):
         from whoosh.qparser import QueryParser
         qp = QueryParser(defaultfield, schema=self.ixreader.schema)
@@ -707,8 +888,12 @@ class Searcher(object):
         if not scored and not sortedby:
             c = collectors.UnsortedCollector()
         elif sortedby:
+            # Skipping blocks of documents is only safe if no wrapping
+            # collector needs to see every match
+            useblocks = optimize and not (groupedby or collapse)
             c = collectors.SortingCollector(sortedby, limit=limit,
-                                            reverse=reverse)
+                                            reverse=reverse,
+                                            useblocks=useblocks)
         elif groupedby or reverse or not limit or limit >= self.doc_count():
             # A collector that gathers every matching document
             c = collectors.UnlimitedCollector(reverse=reverse)
@@ -753,8 +938,9 @@ class Searcher(object):
         :param sortedby: see :doc:`/facets`.
         :param reverse: Reverses the direction of the sort. Default is False.
         :param groupedby: see :doc:`/facets`.
-        :param optimize: use optimizations to get faster results when possible.
-            Default is True.
+        :param optimize: use optimizations to get faster results when possible,
+            including running the query through the searcher's query planner
+            (see :meth:`Searcher.explain_plan`). Default is True.
         :param filter: a query, Results object, or set of docnums. The results
             will only contain documents that are also in the filter object.
         :param mask: a query, Results object, or set of docnums. The results
@@ -780,13 +966,86 @@ class Searcher(object):
         :rtype: :class:`Results`
         """
 
+        return self._search(q, kwargs)
+
+    def _search(self, q, kwargs, collector=None):
+        # Implements search(). The optional collector must be equivalent to
+        # self.collector(**kwargs) (for example, wrapped in a
+        # TimeLimitCollector) since the results may be cached under kwargs
+
+        # If the searcher has a result cache, see if this search is in it
+        cache = self.resultcache
+        key = None
+        if cache is not None:
+            key = self._result_cache_key(q, kwargs)
+            if key is not None:
+                cached = cache.get(key)
+                if cached is not None:
+                    return cached._attach(self)
+
+        # Rewrite the query into a cheaper equivalent
+        planq = q
+        if kwargs.get("optimize", True):
+            planq = self._plan(q, kwargs).query
+
         # Call the collector() method to build a collector based on the
         # parameters passed to this method
-        c = self.collector(**kwargs)
+        c = collector if collector is not None else self.collector(**kwargs)
         # Call the lower-level method to run the collector
-        self.search_with_collector(q, c)
+        self.search_with_collector(planq, c)
         # Return the results object from the collector
-        return c.results()
+        results = c.results()
+        # The results should refer to the user's query (e.g. for
+        # highlighting), not the planned one
+        results.q = q
+
+        if key is not None:
+            cache.put(key, results._detach(kwargs))
+        return results
+
+    def _plan(self, q, kwargs):
+        # Any clause may become a filter if the search isn't scored. Don't
+        # use filters if the search records matched terms, since the filter
+        # matchers don't know the terms
+        scored = kwargs.get("scored", True) or kwargs.get("sortedby")
+        return self.planner.plan(q, self, scored=bool(scored),
+                                 filters=not kwargs.get("terms"))
+
+    def explain_plan(self, q, **kwargs):
+        """Returns the :class:`whoosh.query.planning.QueryPlan` the searcher
+        would use to run the given query with the given :meth:`search`
+        keyword arguments. Call the plan's ``explain()`` method to get a
+        readable description::
+
+            plan = mysearcher.explain_plan(myquery, limit=20)
+            print(plan.explain())
+        """
+
+        return self._plan(q, kwargs)
+
+    def _segment_states(self):
+        # Returns a tuple of (segment ID, deleted count) pairs identifying the
+        # exact version of the index this searcher sees, or None if any of
+        # the leaf readers isn't backed by a segment
+        states = []
+        for reader, _ in self.ixreader.leaf_readers():
+            segment = reader.segment()
+            if segment is None:
+                return None
+            states.append((segment.segment_id(), segment.deleted_count()))
+        return tuple(states)
+
+    def _result_cache_key(self, q, kwargs):
+        # Returns a hashable key for the result cache representing the given
+        # search, or None if the search can't be cached
+        states = self._segment_states()
+        if states is None:
+            return None
+        try:
+            return (states, _cache_token(q), _cache_token(kwargs),
+                    _cache_token(self.weighting))
+        except _Uncacheable:
+            return None
 
     def search_with_collector(self, q, collector, context=None):
         """Low-level method: runs a :class:`whoosh.query.Query` object on this
@@ -939,6 +1198,10 @@ class Results(object):
     so keeps all files used by it open.
     """
 
+    # When iterating, the number of hits at a time whose stored fields are
+    # hinted to the storage before the Hit objects are created (0 to disable)
+    prefetch_size = 10
+
     def __init__(self, searcher, q, top_n, docset=None, facetmaps=None,
                  runtime=0, highlighter=None):
         """
@@ -980,12 +1243,55 @@ class Results(object):
         """
 
         if self._total is None:
-            self._total = self.collector.count()
+            if self.collector is None:
+                # These results came from the result cache, and the count
+                # wasn't known when they were cached
+                self._total = len(self.docs())
+            else:
+                self._total = self.collector.count()
         return self._total
 
+    def _detach(self, searchargs):
+        # Returns a copy of these results without references to the searcher
+        # or the collector, suitable for storing in a result cache. The copy
+        # can't ask the collector for the number of matches, so keep the
+        # count if the collector already knows it (otherwise counting would
+        # mean running the query again; the copy counts lazily instead)
+        c = self.collector
+        if self._total is None and c is not None and c.computes_count():
+            self._total = c.count()
+        r = self._copy()
+        r.searcher = None
+        r.collector = None
+        r.highlighter = None
+        r._char_cache = None
+        r._searchargs = searchargs
+        return r
+
+    def _copy(self):
+        # Returns a copy of these results that doesn't share any of the
+        # mutable state changed by methods such as extend() and filter()
+        r = copy.copy(self)
+        r.top_n = list(self.top_n)
+        if self.docset is not None:
+            r.docset = self.docset.copy()
+        r._facetmaps = copy.deepcopy(self._facetmaps)
+        r.highlighter = copy.copy(self.highlighter)
+        return r
+
+    def _attach(self, searcher):
+        # Returns a copy of these detached (cached) results connected to the
+        # given searcher
+        r = self._copy()
+        r.searcher = searcher
+        r.highlighter = highlight.Highlighter()
+        r._char_cache = {}
+        return r
+
     def __getitem__(self, n):
         if isinstance(n, slice):
             start, stop, step = n.indices(len(self.top_n))
+            self._prefetch(xrange(start, stop, step))
             return [Hit(self, self.top_n[i][1], i, self.top_n[i][0])
                     for i in xrange(start, stop, step)]
         else:
@@ -998,8 +1304,19 @@ class Results(object):
         """Yields a :class:`Hit` object for each result in ranked order.
         """
 
-        for i in xrange(len(self.top_n)):
-            yield Hit(self, self.top_n[i][1], i, self.top_n[i][0])
+        top_n = self.top_n
+        prefetch_size = self.prefetch_size
+        for i in xrange(len(top_n)):
+            if prefetch_size and not i % prefetch_size:
+                self._prefetch(xrange(i, min(i + prefetch_size, len(top_n))))
+            yield Hit(self, top_n[i][1], i, top_n[i][0])
+
+    def _prefetch(self, positions):
+        # Hints to the storage that the stored fields of the hits at the
+        # given positions are about to be read
+        if self.searcher is not None:
+            docnums = sorted(self.top_n[i][1] for i in positions)
+            self.searcher.ixreader.prefetch_stored_fields(docnums)
 
     def __contains__(self, docnum):
         """Returns True if the given document number matched the query.
@@ -1025,13 +1342,34 @@ class Results(object):
 
         return ((docnum, score) for score, docnum in self.top_n)
 
-    def fields(self, n):
+    def fields(self, n, fieldnames=None):
         """Returns the stored fields for the document at the ``n`` th position
         in the results. Use :meth:`Results.docnum` if you want the raw
         document number instead of the stored fields.
+
+        If ``n`` is a slice, this method returns a list of dictionaries, one
+        for each document in the slice. The documents are read in document
+        number order (the order they are stored on disk) instead of ranked
+        order::
+
+            # Get the titles and URLs of the first 10 results
+            for sfs in results.fields(slice(0, 10), ["title", "url"]):
+                print(sfs["title"], sfs["url"])
+
+        :param fieldnames: if not None, only the values of these fields are
+            returned. This avoids reading the values of other stored fields,
+            which can be much faster if the documents have large stored fields
+            you don't need.
         """
 
-        return self.searcher.stored_fields(self.top_n[n][1])
+        if isinstance(n, slice):
+            start, stop, step = n.indices(len(self.top_n))
+            docnums = [self.top_n[i][1] for i in xrange(start, stop, step)]
+            return self._stored_fields(docnums, fieldnames)
+        return self.searcher.stored_fields(self.top_n[n][1], fieldnames)
+
+    def _stored_fields(self, docnums, fieldnames):
+        return self.searcher.stored_fields_many(docnums, fieldnames)
 
     def facet_names(self):
         """Returns the available facet names, for use with the ``groups()``
@@ -1040,6 +1378,22 @@ class Results(object):
 
         return self._facetmaps.keys()
 
+    def facet_map(self, name=None):
+        """Returns the :class:`whoosh.sorting.FacetMap` object holding the
+        groups for the given facet name (see :meth:`Results.groups`). This is
+        useful for maps with extra methods, such as
+        :class:`whoosh.sorting.DistinctCount`.
+        """
+
+        if (name is None or name == "facet") and len(self._facetmaps) == 1:
+            # If there's only one facet, just use it; convert keys() to list
+            # for Python 3
+            name = list(self._facetmaps.keys())[0]
+        elif name not in self._facetmaps:
+            raise KeyError("%r not in facet names %r"
+                           % (name, self.facet_names()))
+        return self._facetmaps[name]
+
     def groups(self, name=None):
         """If you generated facet groupings for the results using the
         `groupedby` keyword argument to the ``search()`` method, you can use
@@ -1081,14 +1435,7 @@ class Results(object):
         {"new": 3, "apple": 4, "search": 1}
         """
 
-        if (name is None or name == "facet") and len(self._facetmaps) == 1:
-            # If there's only one facet, just use it; convert keys() to list
-            # for Python 3
-            name = list(self._facetmaps.keys())[0]
-        elif name not in self._facetmaps:
-            raise KeyError("%r not in facet names %r"
-                           % (name, self.facet_names()))
-        return self._facetmaps[name].as_dict()
+        return self.facet_map(name).as_dict()
 
     def has_exact_length(self):
         """Returns True if this results object already knows the exact number
@@ -1142,7 +1489,14 @@ class Results(object):
         """
 
         if self.docset is None:
-            self.docset = set(self.collector.all_ids())
+            if self.collector is None:
+                # These results came from the result cache, so search again
+                # to get the full set of matching documents
+                c = self.searcher.collector(**self._searchargs)
+                self.searcher.search_with_collector(self.q, c)
+                self.docset = set(c.all_ids())
+            else:
+                self.docset = set(self.collector.all_ids())
         return self.docset
 
     def copy(self):
@@ -1379,6 +1733,10 @@ class Hit(object):
         self.docnum = docnum
         self.score = score
         self._fields = None
+        # Values of stored fields loaded by get_fields()
+        self._partial = {}
+        # Names of fields get_fields() has tried to load
+        self._loaded = set()
 
     def fields(self):
         """Returns a dictionary of the stored fields of the document this
@@ -1389,6 +1747,30 @@ class Hit(object):
             self._fields = self.searcher.stored_fields(self.docnum)
         return self._fields
 
+    def get_fields(self, fieldnames):
+        """Returns a dictionary of the stored values of the given fields in the
+        document this object represents. Unlike :meth:`Hit.fields`, this only
+        reads the requested fields, which is faster if the document has large
+        stored fields you don't need::
+
+            for hit in results:
+                sfs = hit.get_fields(["title", "url"])
+                print(sfs["title"], sfs["url"])
+
+        :param fieldnames: a list of field names.
+        """
+
+        if self._fields is not None:
+            sfs = self._fields
+        else:
+            missing = [name for name in fieldnames if name not in self._loaded]
+            if missing:
+                self._partial.update(self.searcher.stored_fields(self.docnum,
+                                                                 missing))
+                self._loaded.update(missing)
+            sfs = self._partial
+        return dict((name, sfs[name]) for name in fieldnames if name in sfs)
+
     def matched_terms(self):
         """Returns the set of ``("fieldname", "text")`` tuples representing
         terms from the query that matched in this document. You can
@@ -1642,6 +2024,26 @@ class ResultsPage(object):
         """
         return self.results.docnum(n + self.offset)
 
+    def fields(self, n=None, fieldnames=None):
+        """Returns the stored fields of the hit at the nth position on this
+        page. If ``n`` is None, returns a list of the stored fields of every
+        hit on the page, read in document number order. See
+        :meth:`Results.fields`.
+
+        :param fieldnames: if not None, only the values of these fields are
+            returned.
+        """
+
+        offset = self.offset
+        if n is None:
+            n = slice(offset, offset + self.pagelen)
+        elif isinstance(n, slice):
+            start, stop, step = n.indices(self.pagelen)
+            n = slice(start + offset, stop + offset, step)
+        else:
+            n += offset
+        return self.results.fields(n, fieldnames)
+
     def is_last_page(self):
         """Returns True if this object represents the last page of results.
         """
@@ -25,10 +25,20 @@
 # those of the authors and should not be interpreted as representing official
 # policies, either expressed or implied, of Matt Chaput.
 
+import random
 from array import array
 from collections import defaultdict
+from hashlib import md5
+from heapq import merge
+from math import log
+from struct import Struct
 
-from whoosh.compat import string_type
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from whoosh.compat import bytes_type, string_type, text_type
 from whoosh.compat import iteritems, izip, xrange
 
 
@@ -96,6 +106,8 @@ class Categorizer(object):
 
     allow_overlap = False
     needs_current = False
+    # If True, the categorizer implements key_counts()
+    bulk_counts = False
 
     def set_searcher(self, segment_searcher, docoffset):
         """Called by the collector when the collector moves to a new segment.
@@ -126,6 +138,45 @@ class Categorizer(object):
 
         raise NotImplementedError(self.__class__)
 
+    def key_counts(self, segment_docnums):
+        """Yields ``(key, count)`` pairs giving the number of documents with
+        each key among the given segment-relative document numbers in the
+        current segment. Categorizers that can count keys faster than calling
+        ``key_for`` for each document should implement this method and set
+        ``bulk_counts`` to True. If the categorizer allows overlap, each
+        document counts once for each of its keys (see ``keys_for``). The
+        :class:`whoosh.collectors.FacetCollector` uses it to fill
+        :class:`Count` maps.
+        """
+
+        raise NotImplementedError(self.__class__)
+
+    def block_bounds(self):
+        """Returns a ``(blocksize, lows, highs)`` tuple describing the lowest
+        and highest key (or, for tuple keys, the first item of the key) of
+        every document in each block of ``blocksize`` consecutive documents in
+        the current segment, or None if the categorizer can't compute the
+        bounds cheaply (this is the default).
+
+        Sorting collectors use this information to skip over blocks of
+        documents that can't make the top N results.
+        """
+
+        return None
+
+    def key_order(self):
+        """Returns 1 if the keys (or, for tuple keys, the first items of the
+        keys) of the documents in the current segment never decrease as the
+        document number increases, for example because the segment was written
+        sorted on the same field, -1 if they never increase, or 0 if there's
+        no known relationship (this is the default).
+
+        Sorting collectors use this information to stop searching a segment
+        once they have the top N documents.
+        """
+
+        return 0
+
     def keys_for(self, matcher, segment_docnum):
         """Yields a series of keys for the current match.
 
@@ -203,7 +254,10 @@ class FieldFacet(FacetType):
 
         if global_searcher.reader().has_column(fieldname):
             coltype = fieldobj.column_type
-            if coltype.reversible or not self.reverse:
+            if coltype.ordinal:
+                c = OrdinalCategorizer(global_searcher, fieldname,
+                                       self.reverse)
+            elif coltype.reversible or not self.reverse:
                 c = ColumnCategorizer(global_searcher, fieldname, self.reverse)
             else:
                 c = ReversedColumnCategorizer(global_searcher, fieldname)
@@ -223,6 +277,7 @@ class ColumnCategorizer(Categorizer):
         # The column reader is set in set_searcher() as we iterate over the
         # sub-searchers
         self._creader = None
+        self._sortorder = None
 
     def __repr__(self):
         return "%s(%r, %r, reverse=%r)" % (self.__class__.__name__,
@@ -234,10 +289,23 @@ class ColumnCategorizer(Categorizer):
         self._creader = r.column_reader(self._fieldname,
                                         reverse=self._reverse,
                                         translate=False)
+        segment = r.segment()
+        self._sortorder = segment.sort_order() if segment else None
 
     def key_for(self, matcher, segment_docnum):
         return self._creader.sort_key(segment_docnum)
 
+    def block_bounds(self):
+        return self._creader.block_bounds()
+
+    def key_order(self):
+        sortorder = self._sortorder
+        if sortorder is None or sortorder[0] != self._fieldname:
+            return 0
+        # The keys are in the segment's order unless exactly one of the
+        # segment and the keys is reversed
+        return -1 if sortorder[1] != self._reverse else 1
+
     def key_to_name(self, key):
         return self._fieldobj.from_column_value(key)
 
@@ -250,24 +318,185 @@ class ReversedColumnCategorizer(ColumnCategorizer):
     def __init__(self, global_searcher, fieldname):
         ColumnCategorizer.__init__(self, global_searcher, fieldname)
 
-        reader = global_searcher.reader()
-        self._doccount = reader.doc_count_all()
-
-        global_creader = reader.column_reader(fieldname, translate=False)
-        self._values = sorted(set(global_creader))
+        # Cache the sorted list of unique values (and a map from each value to
+        # its position in the list) on the searcher
+        cachekey = ("reversed", fieldname)
+        if cachekey in global_searcher._field_caches:
+            self._values, self._order = global_searcher._field_caches[cachekey]
+        else:
+            reader = global_searcher.reader()
+            global_creader = reader.column_reader(fieldname, translate=False)
+            self._values = sorted(set(global_creader))
+            self._order = dict((v, i) for i, v in enumerate(self._values))
+            global_searcher._field_caches[cachekey] = (self._values,
+                                                       self._order)
 
     def key_for(self, matcher, segment_docnum):
         value = self._creader[segment_docnum]
-        order = self._values.index(value)
+        order = self._order[value]
         # Subtract from 0 to reverse the order
         return 0 - order
 
+    def block_bounds(self):
+        return None
+
+    def key_order(self):
+        # The keys are reversed even though self._reverse is False
+        return 0 - ColumnCategorizer.key_order(self)
+
     def key_to_name(self, key):
         # Re-reverse the key to get the index into _values
         key = self._values[0 - key]
         return ColumnCategorizer.key_to_name(self, key)
 
 
+class GlobalOrdinals(object):
+    """Maps the per-segment ordinals of a column with ordinals (such as
+    :class:`whoosh.columns.RefBytesColumn`, where each segment numbers its
+    unique values in the order they were added, or
+    :class:`whoosh.columns.DictionaryColumn`) to "global" ordinals, which
+    are positions in the sorted list of the unique values in all segments.
+
+    Since the global ordinals are in the same order as the values, sorting and
+    grouping can work on integers across segments, and only look up the values
+    for the final groups.
+
+    Use :meth:`GlobalOrdinals.for_searcher` to get the (cached) object for a
+    field.
+    """
+
+    def __init__(self, reader, fieldname):
+        """
+        :param reader: the top-level :class:`whoosh.reading.IndexReader`.
+        :param fieldname: the name of a field with an ordinal column.
+        """
+
+        segvalues = []
+        allsorted = True
+        for subreader, offset in reader.leaf_readers():
+            creader = subreader.column_reader(fieldname, translate=False)
+            segvalues.append((offset, creader.ordinal_values()))
+            allsorted &= getattr(creader, "sorted_ordinals", False)
+
+        # Map from each segment's document offset to an array mapping the
+        # segment's ordinals to global ordinals
+        self._maps = {}
+        if allsorted:
+            # Every segment's values are already sorted, so merge them
+            # instead of sorting, and walk each segment's values alongside
+            # the merged list to find the global ordinals
+            values = []
+            for v in merge(*[vs for _, vs in segvalues]):
+                if not values or values[-1] != v:
+                    values.append(v)
+            for offset, segvals in segvalues:
+                segmap = array("i")
+                pos = 0
+                for v in segvals:
+                    while values[pos] != v:
+                        pos += 1
+                    segmap.append(pos)
+                self._maps[offset] = segmap
+        else:
+            unique = set()
+            for _, segvals in segvalues:
+                unique.update(segvals)
+            values = sorted(unique)
+            positions = dict((v, i) for i, v in enumerate(values))
+            for offset, segvals in segvalues:
+                self._maps[offset] = array("i", [positions[v]
+                                                 for v in segvals])
+
+        #: The sorted list of the unique values in all segments
+        self.values = values
+
+    @classmethod
+    def for_searcher(cls, global_searcher, fieldname):
+        """Returns the global ordinals for the given field in the searcher's
+        reader, building them the first time they're requested for the
+        searcher.
+        """
+
+        cachekey = ("ordinals", fieldname)
+        gords = global_searcher._field_caches.get(cachekey)
+        if gords is None:
+            gords = cls(global_searcher.reader(), fieldname)
+            global_searcher._field_caches[cachekey] = gords
+        return gords
+
+    def __len__(self):
+        return len(self.values)
+
+    def segment_map(self, docoffset):
+        """Returns an array mapping the ordinals of the segment starting at
+        the given document offset to global ordinals.
+        """
+
+        return self._maps[docoffset]
+
+
+class OrdinalCategorizer(ColumnCategorizer):
+    """Categorizer for columns with ordinals (see :class:`GlobalOrdinals`).
+    The keys are global ordinals (negated if the facet is reversed), so the
+    categorizer can sort and group across segments in either direction
+    without comparing or decoding values.
+    """
+
+    bulk_counts = True
+
+    def __init__(self, global_searcher, fieldname, reverse=False):
+        ColumnCategorizer.__init__(self, global_searcher, fieldname, reverse)
+        self._gords = GlobalOrdinals.for_searcher(global_searcher, fieldname)
+        self._segmap = None
+        # Cache of decoded names by global ordinal
+        self._names = {}
+
+    def set_searcher(self, segment_searcher, docoffset):
+        r = segment_searcher.reader()
+        # Get the reader without reversing it, since the reversing happens
+        # on the global ordinals
+        self._creader = r.column_reader(self._fieldname, translate=False)
+        self._segmap = self._gords.segment_map(docoffset)
+        segment = r.segment()
+        self._sortorder = segment.sort_order() if segment else None
+
+    def key_for(self, matcher, segment_docnum):
+        key = self._segmap[self._creader.ordinal(segment_docnum)]
+        if self._reverse:
+            key = 0 - key
+        return key
+
+    def key_counts(self, segment_docnums):
+        # Count the segment ordinals of the documents in one pass over the
+        # column's ordinal array, then translate the segment ordinals that
+        # occur to global ordinals
+        ords = self._creader.ordinals()
+        if numpy is not None:
+            docs = numpy.asarray(segment_docnums, dtype=numpy.intp)
+            counts = numpy.bincount(numpy.asarray(ords)[docs]).tolist()
+        else:
+            counts = [0] * len(self._creader.ordinal_values())
+            for docnum in segment_docnums:
+                counts[ords[docnum]] += 1
+
+        segmap = self._segmap
+        sign = -1 if self._reverse else 1
+        for segord, count in enumerate(counts):
+            if count:
+                yield sign * segmap[segord], count
+
+    def block_bounds(self):
+        return None
+
+    def key_to_name(self, key):
+        try:
+            return self._names[key]
+        except KeyError:
+            value = self._gords.values[abs(key)]
+            name = self._names[key] = self._fieldobj.from_column_value(value)
+            return name
+
+
 class OverlappingCategorizer(Categorizer):
     allow_overlap = True
 
@@ -280,6 +509,17 @@ class OverlappingCategorizer(Categorizer):
         self._use_vectors = bool(field.vector)
         self._use_column = (reader.has_column(fieldname)
                             and field.column_type.stores_lists())
+        # If the column stores ordinals (such as a SortedSetColumn), use
+        # global ordinals as the keys, which also lets the categorizer count
+        # keys in bulk
+        self._use_ordinals = self._use_column and field.column_type.ordinal
+        self.bulk_counts = self._use_ordinals
+        if self._use_ordinals:
+            self._gords = GlobalOrdinals.for_searcher(global_searcher,
+                                                      fieldname)
+            self._segmap = None
+            # Cache of decoded names by global ordinal
+            self._names = {}
 
         # These are set in set_searcher() as we iterate over the sub-searchers
         self._segment_searcher = None
@@ -291,7 +531,14 @@ class OverlappingCategorizer(Categorizer):
         self._segment_searcher = segment_searcher
         reader = segment_searcher.reader()
 
-        if self._use_vectors:
+        if self._use_ordinals:
+            creader = reader.column_reader(fieldname, translate=False)
+            # A segment without the column has no keys
+            if not hasattr(creader, "doc_ordinals"):
+                creader = None
+            self._creader = creader
+            self._segmap = self._gords.segment_map(docoffset)
+        elif self._use_vectors:
             pass
         elif self._use_column:
             self._creader = reader.column_reader(fieldname, translate=False)
@@ -310,7 +557,12 @@ class OverlappingCategorizer(Categorizer):
                     self._lists[docid].append(text)
 
     def keys_for(self, matcher, docid):
-        if self._use_vectors:
+        if self._use_ordinals:
+            if self._creader is None:
+                return []
+            segmap = self._segmap
+            return [segmap[o] for o in self._creader.doc_ordinals(docid)]
+        elif self._use_vectors:
             try:
                 v = self._segment_searcher.vector(docid, self._fieldname)
                 return list(v.all_ids())
@@ -322,7 +574,11 @@ class OverlappingCategorizer(Categorizer):
             return self._lists[docid] or [None]
 
     def key_for(self, matcher, docid):
-        if self._use_vectors:
+        if self._use_ordinals:
+            if self._creader is None:
+                return self._segmap[0]
+            return self._segmap[self._creader.ordinal(docid)]
+        elif self._use_vectors:
             try:
                 v = self._segment_searcher.vector(docid, self._fieldname)
                 return v.id()
@@ -337,6 +593,47 @@ class OverlappingCategorizer(Categorizer):
             else:
                 return None
 
+    def key_counts(self, segment_docnums):
+        # Counts every value of every document using the column's arrays of
+        # all the segment ordinals, then translates the segment ordinals that
+        # occur to global ordinals
+        if self._creader is None:
+            return
+        starts, ords = self._creader.all_ordinals()
+        if numpy is not None:
+            starts = numpy.asarray(starts, dtype=numpy.intp)
+            docs = numpy.asarray(segment_docnums, dtype=numpy.intp)
+            begins = starts[docs]
+            lengths = starts[docs + 1] - begins
+            # The positions in the ordinal array of every value of every
+            # document
+            shifts = begins - numpy.cumsum(lengths) + lengths
+            positions = (numpy.repeat(shifts, lengths)
+                         + numpy.arange(lengths.sum()))
+            counts = numpy.bincount(numpy.asarray(ords)[positions])
+            counts = enumerate(counts.tolist())
+        else:
+            counts = defaultdict(int)
+            for docnum in segment_docnums:
+                for segord in ords[starts[docnum]:starts[docnum + 1]]:
+                    counts[segord] += 1
+            counts = iteritems(counts)
+
+        segmap = self._segmap
+        for segord, count in counts:
+            if count:
+                yield segmap[segord], count
+
+    def key_to_name(self, key):
+        if not self._use_ordinals:
+            return key
+        try:
+            return self._names[key]
+        except KeyError:
+            value = self._gords.values[key]
+            name = self._names[key] = self._fieldobj.from_column_value(value)
+            return name
+
 
 class PostingCategorizer(Categorizer):
     """
@@ -851,6 +1148,13 @@ class MultiFacet(FacetType):
             return tuple(catter.key_for(matcher, docid)
                          for catter in self.catters)
 
+        def block_bounds(self):
+            # The keys are tuples, so only the first part of the key is bounded
+            return self.catters[0].block_bounds()
+
+        def key_order(self):
+            return self.catters[0].key_order()
+
         def key_to_name(self, key):
             return tuple(catter.key_to_name(keypart)
                          for catter, keypart
@@ -1052,6 +1356,12 @@ class Count(FacetMap):
     def add(self, groupname, docid, sortkey):
         self.dict[groupname] += 1
 
+    def add_count(self, groupname, count):
+        """Adds the given number of documents to a group at once.
+        """
+
+        self.dict[groupname] += count
+
     def as_dict(self):
         return dict(self.dict)
 
@@ -1080,6 +1390,216 @@ class Best(FacetMap):
         return self.bestids
 
 
+# Approximate facet maps
+
+_unpack_hash = Struct("<Q").unpack
+
+def _hash64(value):
+    # Returns a 64-bit hash of the value. Python's hash() of a string is
+    # randomized in each process, so hash a stable encoding of the value
+    # instead, so sketches built in different processes can be merged
+    if isinstance(value, bytes_type):
+        data = b"b" + value
+    elif isinstance(value, text_type):
+        data = b"u" + value.encode("utf8")
+    else:
+        data = ("%s:%r" % (type(value).__name__, value)).encode("utf8")
+    return _unpack_hash(md5(data).digest()[:8])[0]
+
+
+class SampledCount(FacetMap):
+    """Estimates the number of documents in each group from a fixed-size
+    random sample (a "reservoir") of the documents added to the map, so the
+    memory used doesn't depend on the number of groups.
+
+    The ``as_dict`` method returns a dictionary mapping the group names in the
+    sample to estimated counts. Groups with few documents may be missing.
+
+    To change the sample size, pass an instance instead of the class as the
+    ``maptype``, for example ``FieldFacet("tag", maptype=SampledCount(500))``
+    (use a new instance for each search).
+    """
+
+    def __init__(self, size=1000, seed=None):
+        """
+        :param size: the number of group names to keep in the sample.
+        :param seed: an optional seed for the random number generator, to make
+            the sample repeatable.
+        """
+
+        self.size = size
+        self.total = 0
+        self.sample = []
+        self._random = random.Random(seed)
+
+    def __repr__(self):
+        return "<%s %d/%d>" % (self.__class__.__name__, len(self.sample),
+                               self.total)
+
+    def add(self, groupname, docid, sortkey):
+        self.total += 1
+        if len(self.sample) < self.size:
+            self.sample.append(groupname)
+        else:
+            # Replace a random item in the sample with probability
+            # size/total, which keeps every document equally likely to be in
+            # the sample
+            i = self._random.randint(0, self.total - 1)
+            if i < self.size:
+                self.sample[i] = groupname
+
+    def as_dict(self):
+        counts = defaultdict(int)
+        for groupname in self.sample:
+            counts[groupname] += 1
+        if not self.sample:
+            return {}
+        scale = self.total / float(len(self.sample))
+        return dict((groupname, int(round(count * scale)))
+                    for groupname, count in iteritems(counts))
+
+
+class DistinctCount(FacetMap):
+    """Estimates the number of distinct group names added to the map (for
+    example, the number of different users in the results when grouping by a
+    "user" field) using a HyperLogLog sketch, which takes ``2 ** precision``
+    bytes regardless of the number of groups. The standard error of the
+    estimate is about ``1.04 / sqrt(2 ** precision)``, so about 1.6% with the
+    default precision.
+
+    The ``as_dict`` method returns a dictionary mapping ``None`` to the
+    estimate. You can also get the map with
+    :meth:`whoosh.searching.Results.facet_map` and call
+    :meth:`DistinctCount.count`.
+    """
+
+    def __init__(self, precision=12):
+        """
+        :param precision: the base-2 logarithm of the number of registers in
+            the sketch, between 4 and 16.
+        """
+
+        if not 4 <= precision <= 16:
+            raise ValueError("Precision must be between 4 and 16, not %r"
+                             % (precision,))
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def __repr__(self):
+        return "<%s ~%d>" % (self.__class__.__name__, self.count())
+
+    def add(self, groupname, docid, sortkey):
+        p = self.precision
+        h = _hash64(groupname)
+        # The first p bits choose the register, and the register keeps the
+        # highest position of the first 1 bit in the rest of the hash
+        index = h >> (64 - p)
+        rest = h & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Adds the group names counted by another map with the same
+        precision to this map.
+        """
+
+        if other.precision != self.precision:
+            raise ValueError("Can't merge sketches with different precision")
+        self.registers = bytearray(max(a, b) for a, b
+                                   in izip(self.registers, other.registers))
+
+    def count(self):
+        """Returns the estimated number of distinct group names.
+        """
+
+        m = len(self.registers)
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = sum(1 for r in self.registers if not r)
+        if estimate <= 2.5 * m and zeros:
+            # Use linear counting for small cardinalities
+            estimate = m * log(m / float(zeros))
+        return int(round(estimate))
+
+    def as_dict(self):
+        return {None: self.count()}
+
+
+class TopCounts(FacetMap):
+    """Estimates the ``k`` groups with the most documents using a Count-Min
+    sketch, without keeping a count for every group. The
+    :class:`whoosh.collectors.FacetCollector` can fill it in bulk, like
+    :class:`Count`. The sketch
+    overestimates each count by at most about ``2 * n / width`` (where ``n``
+    is the number of documents added) with probability
+    ``1 - 0.5 ** depth``.
+
+    The ``as_dict`` method returns a dictionary mapping (at most) ``k`` group
+    names to their estimated counts.
+    """
+
+    def __init__(self, k=10, width=2048, depth=4):
+        """
+        :param k: the number of groups to return.
+        :param width: the number of counters in each row of the sketch.
+        :param depth: the number of rows (independent hashes) in the sketch.
+        """
+
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.rows = [array("i", [0]) * width for _ in xrange(depth)]
+        # Maps the current top candidates to their estimated counts
+        self.top = {}
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.as_dict())
+
+    def _estimate(self, groupname, increment=0):
+        # Adds the increment to the group's counters and returns the smallest
+        # of them, which is the estimated count
+        h = _hash64(groupname)
+        # Derive the row hashes from the two halves of one hash
+        h1 = h & 0xFFFFFFFF
+        h2 = h >> 32
+        width = self.width
+        estimate = None
+        for i, row in enumerate(self.rows):
+            pos = (h1 + i * h2) % width
+            if increment:
+                row[pos] += increment
+            if estimate is None or row[pos] < estimate:
+                estimate = row[pos]
+        return estimate
+
+    def add(self, groupname, docid, sortkey):
+        self.add_count(groupname, 1)
+
+    def add_count(self, groupname, count):
+        estimate = self._estimate(groupname, count)
+        top = self.top
+        if groupname in top or len(top) < self.k:
+            top[groupname] = estimate
+        else:
+            # Replace the weakest candidate if this group now beats it
+            weakest = min(top, key=top.__getitem__)
+            if estimate > top[weakest]:
+                del top[weakest]
+                top[groupname] = estimate
+
+    def as_dict(self):
+        return dict(self.top)
+
+
 # Helper functions
 
 def add_sortable(writer, fieldname, facet, column=None):
@@ -445,9 +445,10 @@ class IndexWriter(object):
         * Marking more fields "unique" in the schema will make each
           ``update_document`` call slightly slower.
 
-        * When you are updating multiple documents, it is faster to batch
-          delete all changed documents and then use ``add_document`` to add
-          the replacements instead of using ``update_document``.
+        * When you are updating multiple documents, it is faster to pass them
+          all to :meth:`IndexWriter.update_documents`, which finds the
+          documents to replace in one pass instead of one lookup per
+          document.
 
         Note that this method will only replace a *committed* document;
         currently it cannot replace documents you've added to the IndexWriter
@@ -476,6 +477,51 @@ class IndexWriter(object):
         # Add the given fields
         self.add_document(**fields)
 
+    def update_documents(self, docs):
+        """Adds each of the given documents and deletes any existing documents
+        with the same values in fields marked "unique" in the schema, like
+        calling :meth:`IndexWriter.update_document` for each document, but
+        finds all the documents to delete in one pass::
+
+            w = myindex.writer()
+            w.update_documents([{"path": u"/a", "content": u"alfa"},
+                                {"path": u"/b", "content": u"bravo"}])
+            w.commit()
+
+        If more than one of the given documents has the same value in a unique
+        field, only the last of them is added.
+
+        :param docs: a sequence of dictionaries mapping field names to values,
+            as you would pass as keyword arguments to ``update_document``.
+        """
+
+        schema = self.schema
+        # Go through the documents backwards, skipping any document that is
+        # replaced by a later document in the batch
+        seen = set()
+        keep = []
+        uniqueterms = []
+        for fields in reversed(list(docs)):
+            unique_fields = self._unique_fields(fields)
+            keys = [(name, schema[name].to_bytes(fields[name]))
+                    for name in unique_fields]
+            if any(key in seen for key in keys):
+                continue
+            seen.update(keys)
+            keep.append(fields)
+            uniqueterms.extend((name, fields[name]) for name in unique_fields)
+        keep.reverse()
+
+        # Delete the set of documents matching the unique terms
+        if uniqueterms:
+            with self.searcher() as s:
+                for docnum in s._find_unique(uniqueterms):
+                    self.delete_document(docnum)
+
+        # Add the documents
+        for fields in keep:
+            self.add_document(**fields)
+
     def commit(self):
         """Finishes writing and unlocks the index.
         """
@@ -491,8 +537,30 @@ class IndexWriter(object):
 # Codec-based writer
 
 class SegmentWriter(IndexWriter):
+    """Writes new documents (and any segments merged by the merge policy) into
+    a new segment.
+
+    If you pass a field name as the ``sortedby`` keyword argument, the writer
+    sorts the documents in the new segment by the values in that field's
+    column (in descending order if ``reverse=True``) before it commits. The
+    segment remembers the order, so a search sorted on the same field can stop
+    reading a segment as soon as it has the top N documents::
+
+        with myindex.writer(sortedby="date", reverse=True) as w:
+            ...
+
+        # Stops after the first 10 matches in each segment
+        results = searcher.search(q, sortedby="date", reverse=True)
+
+    The field must be sortable. Sorting requires an extra pass over the new
+    segment, which costs about as much as merging it. You have to pass the
+    same arguments each time you open a writer, since segments written by a
+    writer without ``sortedby`` are not sorted.
+    """
+
     def __init__(self, ix, poolclass=None, timeout=0.0, delay=0.1, _lk=True,
-                 limitmb=128, docbase=0, codec=None, compound=True, **kwargs):
+                 limitmb=128, docbase=0, codec=None, compound=True,
+                 sortedby=None, reverse=False, **kwargs):
         # Lock the index
         self.writelock = None
         if _lk:
@@ -509,10 +577,24 @@ class SegmentWriter(IndexWriter):
         # Get info from the index
         self.storage = ix.storage
         self.indexname = ix.indexname
-        info = ix._read_toc()
+        # Get private copies of the schema and segments, since the writer may
+        # modify them
+        info = ix._read_toc(cached=False)
         self.generation = info.generation + 1
         self.schema = info.schema
+        # The pickled schema from the TOC, which is written to the new TOC
+        # unless the schema is changed
+        self._schemabytes = info.schemabytes
         self.segments = info.segments
+        if sortedby is not None:
+            if sortedby not in self.schema:
+                raise UnknownFieldError("No field named %r in %s"
+                                        % (sortedby, self.schema))
+            if not self.schema[sortedby].column_type:
+                raise ValueError("Can't sort the index by %r because the "
+                                 "field is not sortable" % sortedby)
+        self.sortedby = sortedby
+        self.reverse = reverse
         self.docnum = self.docbase = docbase
         self._setup_doc_offsets()
 
@@ -523,12 +605,12 @@ class SegmentWriter(IndexWriter):
         self.compound = compound and newsegment.should_assemble()
         self.is_closed = False
         self._added = False
+        self.limitmb = limitmb
         self.pool = PostingPool(self._tempstorage, self.newsegment,
                                 limitmb=limitmb)
 
         # Set up writers
-        self.perdocwriter = codec.per_document_writer(self.storage, newsegment)
-        self.fieldwriter = codec.field_writer(self.storage, newsegment)
+        self._open_segment_writers(newsegment)
 
         self.merge = True
         self.optimize = False
@@ -585,12 +667,14 @@ class SegmentWriter(IndexWriter):
         if self._added:
             raise Exception("Can't modify schema after adding data to writer")
         super(SegmentWriter, self).add_field(fieldname, fieldspec, **kwargs)
+        self._schemabytes = None
 
     def remove_field(self, fieldname):
         self._check_state()
         if self._added:
             raise Exception("Can't modify schema after adding data to writer")
         super(SegmentWriter, self).remove_field(fieldname)
+        self._schemabytes = None
 
     def has_deletions(self):
         """
@@ -651,14 +735,17 @@ class SegmentWriter(IndexWriter):
         items = self._process_posts(items, startdoc, docmap)
         self.fieldwriter.add_postings(self.schema, lengths, items)
 
-    def write_per_doc(self, fieldnames, reader):
+    def write_per_doc(self, fieldnames, reader, order=None):
         # Very bad hack: reader should be an IndexReader, but may be a
         # PerDocumentReader if this is called from multiproc, where the code
         # tries to be efficient by merging per-doc and terms separately.
         # TODO: fix this!
 
+        # If order is not None, it is a list of the reader's document numbers
+        # in the order they should be written
+
         schema = self.schema
-        if reader.has_deletions():
+        if order is not None or reader.has_deletions():
             docmap = {}
         else:
             docmap = None
@@ -675,7 +762,12 @@ class SegmentWriter(IndexWriter):
                     creader = creader.raw_column()
                 cols[fieldname] = creader
 
-        for docnum, stored in reader.iter_docs():
+        if order is None:
+            docs = reader.iter_docs()
+        else:
+            docs = ((docnum, reader.stored_fields(docnum)) for docnum in order)
+
+        for docnum, stored in docs:
             if docmap is not None:
                 docmap[docnum] = self.docnum
 
@@ -701,12 +793,15 @@ class SegmentWriter(IndexWriter):
 
     def add_reader(self, reader):
         self._check_state()
+        self._add_reader(reader)
+
+    def _add_reader(self, reader, order=None):
         basedoc = self.docnum
         ndxnames = set(fname for fname in reader.indexed_field_names()
                        if fname in self.schema)
         fieldnames = set(self.schema.names()) | ndxnames
 
-        docmap = self.write_per_doc(fieldnames, reader)
+        docmap = self.write_per_doc(fieldnames, reader, order)
         self.add_postings_to_pool(reader, basedoc, docmap)
         self._added = True
 
@@ -798,10 +893,37 @@ class SegmentWriter(IndexWriter):
         newsegment.set_doc_count(self.docnum)
         return newsegment
 
+    def _open_segment_writers(self, newsegment):
+        # Creates the codec's writers for a new segment. If the segment will
+        # be compound, the writers stream its files straight into the
+        # compound file, instead of writing separate files that have to be
+        # copied into a compound file when the segment is finished
+        storage = self.storage
+        self._segstorage = None
+        if self.compound:
+            from whoosh.filedb.compound import StreamingCompoundStorage
+
+            name = newsegment.make_filename(newsegment.COMPOUND_EXT)
+            storage = StreamingCompoundStorage(self.storage, name,
+                                               self._tempstorage)
+            self._segstorage = storage
+        self.perdocwriter = self.codec.per_document_writer(storage, newsegment)
+        self.fieldwriter = self.codec.field_writer(storage, newsegment)
+
+    def _close_segment_storage(self):
+        # Finishes the compound file the segment's files were streamed into
+        if self._segstorage is not None:
+            self._segstorage.close()
+            self._segstorage = None
+            self.get_segment().compound = True
+
     def per_document_reader(self):
         if not self.perdocwriter.is_closed:
             raise Exception("Per-doc writer is still open")
-        return self.codec.per_document_reader(self.storage, self.get_segment())
+        storage = self.storage
+        if self._segstorage is not None:
+            storage = self._segstorage
+        return self.codec.per_document_reader(storage, self.get_segment())
 
     # The following methods break out the commit functionality into smaller
     # pieces to allow MpWriter to call them individually
@@ -846,12 +968,65 @@ class SegmentWriter(IndexWriter):
             self.perdocwriter.close()
         if not self.fieldwriter.is_closed:
             self.fieldwriter.close()
+        self._close_segment_storage()
         self.pool.cleanup()
 
+    def _sort_order(self, reader):
+        # Returns a list of the reader's document numbers in order of the
+        # values in the sort column, or None if they're already in order
+        creader = reader.column_reader(self.sortedby, translate=False)
+        docnums = list(reader.all_doc_ids())
+        # The sort is stable, so documents with the same value stay in the
+        # order they were added, even in reverse
+        order = sorted(docnums, key=creader.sort_key, reverse=self.reverse)
+        if order == docnums and not reader.has_deletions():
+            return None
+        return order
+
+    def _sort_segment(self):
+        # If the index is sorted, rewrites the closed (but not yet assembled)
+        # new segment with its documents in order of the sort column
+        if self.sortedby is None:
+            return
+
+        from whoosh.reading import SegmentReader
+
+        storage = self.storage
+        oldsegment = self.get_segment()
+        reader = SegmentReader(storage, self.schema, oldsegment,
+                               codec=self.codec)
+        try:
+            order = self._sort_order(reader)
+            if order is not None:
+                # Start a new segment and copy the documents into it in
+                # sorted order
+                codec = self.codec
+                self.newsegment = codec.new_segment(storage, self.indexname)
+                self.pool = PostingPool(self._tempstorage, self.newsegment,
+                                        limitmb=self.limitmb)
+                self._open_segment_writers(self.newsegment)
+                self.docnum = self.docbase
+                self._add_reader(reader, order)
+                self._flush_segment()
+                self._close_segment()
+        finally:
+            reader.close()
+
+        if order is not None:
+            # Delete the unsorted segment's files
+            for name in oldsegment.list_files(storage):
+                try:
+                    storage.delete_file(name)
+                except OSError:
+                    # The file is still open, clean_files will get it later
+                    pass
+
+        self.newsegment.sortedby = (self.sortedby, self.reverse)
+
     def _assemble_segment(self):
-        if self.compound:
+        newsegment = self.get_segment()
+        if self.compound and not newsegment.is_compound():
             # Assemble the segment files into a compound file
-            newsegment = self.get_segment()
             newsegment.create_compound_file(self.storage)
             newsegment.compound = True
 
@@ -861,6 +1036,7 @@ class SegmentWriter(IndexWriter):
         self._check_state()
         self.perdocwriter.close()
         self.fieldwriter.close()
+        self._close_segment_storage()
         # Don't call self.pool.cleanup()! We want to grab the pool files.
         return self.get_segment()
 
@@ -869,6 +1045,8 @@ class SegmentWriter(IndexWriter):
         self._flush_segment()
         # Close segment files
         self._close_segment()
+        # Put the documents in order if the index is sorted
+        self._sort_segment()
         # Assemble compound segment if necessary
         self._assemble_segment()
 
@@ -879,6 +1057,7 @@ class SegmentWriter(IndexWriter):
 
         # Write a new TOC with the new segment list (and delete old files)
         toc = TOC(self.schema, segments, self.generation)
+        toc.schemabytes = self._schemabytes
         toc.write(self.storage, self.indexname)
         # Delete leftover files
         clean_files(self.storage, self.indexname, self.generation, segments)
@@ -1026,6 +1205,9 @@ class AsyncWriter(threading.Thread, IndexWriter):
     def update_document(self, *args, **kwargs):
         self._record("update_document", args, kwargs)
 
+    def update_documents(self, *args, **kwargs):
+        self._record("update_documents", args, kwargs)
+
     def add_field(self, *args, **kwargs):
         self._record("add_field", args, kwargs)
 
@@ -1255,6 +1437,10 @@ class BufferedWriter(IndexWriter):
         with self.lock:
             IndexWriter.update_document(self, **fields)
 
+    def update_documents(self, docs):
+        with self.lock:
+            IndexWriter.update_documents(self, docs)
+
     def delete_document(self, docnum, delete=True):
         with self.lock:
             base = self.index.doc_count_all()
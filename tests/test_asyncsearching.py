@@ -0,0 +1,179 @@
+from __future__ import with_statement
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+asyncio = pytest.importorskip("asyncio")
+
+from whoosh import collectors, fields, query
+from whoosh.asyncsearching import AsyncSearcher
+from whoosh.compat import u, xrange
+from whoosh.filedb.filestore import RamStorage
+from whoosh.searching import TimeLimit
+
+
+def _index():
+    schema = fields.Schema(id=fields.STORED, text=fields.TEXT)
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        for i in xrange(100):
+            w.add_document(id=i, text=u("alfa bravo") if i % 2 else u("alfa"))
+    return ix
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self, *args, **kwargs):
+        ThreadPoolExecutor.__init__(self, *args, **kwargs)
+        self.count = 0
+
+    def submit(self, *args, **kwargs):
+        self.count += 1
+        return ThreadPoolExecutor.submit(self, *args, **kwargs)
+
+
+def test_async_search():
+    ix = _index()
+    q = query.Term("text", u("bravo"))
+    with ix.searcher() as s:
+        target = [hit["id"] for hit in s.search(q, limit=None)]
+        page = s.search_page(q, 2, pagelen=5)
+        pagetarget = [hit["id"] for hit in page]
+
+        asearcher = AsyncSearcher(s)
+
+        async def run():
+            r = await asearcher.search(q, limit=None)
+            assert [hit["id"] for hit in r] == target
+
+            p = await asearcher.search_page(q, 2, pagelen=5)
+            assert p.pagenum == 2
+            assert [hit["id"] for hit in p] == pagetarget
+
+            sfs = await asearcher.stored_fields_many([9, 3, 5], ["id"])
+            assert sfs == [{"id": 9}, {"id": 3}, {"id": 5}]
+
+        asyncio.run(run())
+
+
+def test_concurrent_searches():
+    ix = _index()
+    executor = ThreadPoolExecutor(max_workers=4)
+    queries = [query.Term("text", u("alfa")), query.Term("text", u("bravo")),
+               query.Prefix("text", u("b"))]
+
+    with ix.searcher() as s:
+        targets = [[hit["id"] for hit in s.search(q, limit=None)]
+                   for q in queries]
+        asearcher = AsyncSearcher(s, executor=executor)
+
+        async def run():
+            # Different limits, so the searches aren't shared
+            futures = [asearcher.search(queries[i % 3], limit=50 + i)
+                       for i in xrange(60)]
+            sfs = [asearcher.stored_fields_many(xrange(100), ["id"])
+                   for _ in xrange(10)]
+            for i, r in enumerate(await asyncio.gather(*futures)):
+                target = targets[i % 3]
+                assert len(r) == len(target)
+                assert r.scored_length() == min(50 + i, len(target))
+            for found in await asyncio.gather(*sfs):
+                assert found == [{"id": i} for i in xrange(100)]
+
+        asyncio.run(run())
+    executor.shutdown()
+
+
+def test_single_flight():
+    ix = _index()
+    q = query.Term("text", u("alfa"))
+    executor = CountingExecutor(max_workers=1)
+    block = threading.Event()
+
+    with ix.searcher() as s:
+        asearcher = AsyncSearcher(s, executor=executor)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            # Keep the only worker busy so the searches wait in the queue
+            blocker = loop.run_in_executor(executor, block.wait)
+            futures = [asearcher.search(q, limit=5) for _ in xrange(4)]
+            other = asearcher.search(q, limit=6)
+            block.set()
+            await blocker
+            results = await asyncio.gather(*futures)
+            target = [hit["id"] for hit in results[0]]
+            assert all([hit["id"] for hit in r] == target for r in results)
+
+            # Each caller gets its own copy of the shared results
+            assert len(set(id(r) for r in results)) == 4
+            results[0].filter(s.search(query.Term("text", u("bravo"))))
+            assert len(results[0].top_n) < 5
+            assert all([hit["id"] for hit in r] == target
+                       for r in results[1:])
+            assert len(await other) == 100
+
+        asyncio.run(run())
+        # The blocker, one shared search, and the different search
+        assert executor.count == 3
+    executor.shutdown()
+
+
+def test_async_cancel():
+    ix = _index()
+    q = query.Term("text", u("alfa"))
+    executor = ThreadPoolExecutor(max_workers=1)
+    block = threading.Event()
+    ran = []
+
+    with ix.searcher() as s:
+        asearcher = AsyncSearcher(s, executor=executor)
+        search = asearcher._search
+
+        def recording_search(flight, q, kwargs):
+            ran.append(q)
+            return search(flight, q, kwargs)
+        asearcher._search = recording_search
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            blocker = loop.run_in_executor(executor, block.wait)
+            try:
+                f1 = asearcher.search(q)
+                f2 = asearcher.search(q)
+                flight = asearcher._flights[asearcher._key("search", q, {})]
+                # Cancelling one caller doesn't cancel the shared search
+                f1.cancel()
+                await asyncio.sleep(0.01)
+                assert not flight.cancelled
+                f2.cancel()
+                # The cancelled flight is forgotten right away, without
+                # waiting for the executor future's callbacks
+                await asyncio.sleep(0)
+                assert flight.cancelled
+                assert not asearcher._flights
+                await asyncio.sleep(0.01)
+            finally:
+                block.set()
+            await blocker
+            # A new search doesn't join the cancelled one
+            r = await asearcher.search(q)
+            assert len(r) == 100
+
+        asyncio.run(run())
+        assert len(ran) == 1
+    executor.shutdown()
+
+
+def test_stop_time_limit_collector():
+    ix = _index()
+    with ix.searcher() as s:
+        c = collectors.TimeLimitCollector(s.collector(limit=None), None)
+        c.stop()
+        with pytest.raises(TimeLimit):
+            s.search_with_collector(query.Term("text", u("alfa")), c)
+
+        # Without a time limit or stop() the search runs to completion
+        c = collectors.TimeLimitCollector(s.collector(limit=None), None)
+        s.search_with_collector(query.Term("text", u("alfa")), c)
+        assert len(c.results()) == 100
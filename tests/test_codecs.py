@@ -8,7 +8,10 @@ from whoosh import analysis, fields, formats, query
 from whoosh.compat import u, b, text_type
 from whoosh.compat import array_tobytes, xrange
 from whoosh.codec import default_codec
+from whoosh.codec.whoosh3 import W3Codec
+from whoosh.filedb import filetables
 from whoosh.filedb.filestore import RamStorage
+from whoosh.reading import TermNotFound
 from whoosh.util.numeric import byte_to_length, length_to_byte
 from whoosh.util.testing import TempStorage
 
@@ -159,6 +162,42 @@ def test_termindex():
         assert ti.doc_frequency() == 1
 
 
+def test_termindex_formats():
+    terms = [("a", "alfa"), ("a", "alpha"), ("a", "alphabet"), ("a", "bravo"),
+             ("a", "charlie"), ("b", "able"), ("b", "baker"), ("b", "dog")]
+    schema = fields.Schema(a=fields.TEXT, b=fields.TEXT)
+
+    # 0 writes the ordered hash format, the others write sorted blocks
+    for termblocks in (0, 1, 3, 32):
+        st, codec, seg = _make_codec(termblocks=termblocks)
+        tw = codec.field_writer(st, seg)
+        postings = ((fname, b(text), 0, i + 1, b("")) for (i, (fname, text))
+                    in enumerate(terms))
+        tw.add_postings(schema, FakeLengths(), postings)
+        tw.close()
+
+        tr = codec.terms_reader(st, seg)
+        assert list(tr.terms()) == [(fn, b(t)) for fn, t in terms]
+        for i, (fieldname, text) in enumerate(terms):
+            assert tr.frequency(fieldname, b(text)) == i + 1
+            assert tr.doc_frequency(fieldname, b(text)) == 1
+        assert ("a", b("alp")) not in tr
+        assert ("c", b("alfa")) not in tr
+        assert list(tr.terms_from("a", b("alp"))) == [
+            (fn, b(t)) for fn, t in terms[1:]]
+        assert [t for (t, _) in tr.items_from("b", b("b"))] == [
+            ("b", b("baker")), ("b", b("dog"))]
+        with pytest.raises(TermNotFound):
+            tr.term_info("a", b("delta"))
+        # The sorted block format is opt-in
+        if termblocks:
+            assert isinstance(tr._tindex, filetables.SortedBlockReader)
+        else:
+            assert isinstance(tr._tindex, filetables.OrderedHashReader)
+        tr.close()
+    assert W3Codec()._termblocks == 0
+
+
 def test_w2_block():
     from whoosh.codec.whoosh2 import W2Codec
 
@@ -19,6 +19,8 @@ def test_pickleability():
                  "FixedBytesListColumn": (5,),
                  "NumericColumn": ("i",),
                  "PickleColumn": (columns.VarBytesColumn(),),
+                 "PointsColumn": ("i",),
+                 "BlockColumn": ("i",),
                  "StructColumn": ("=if", (0, 0.0)),
                  }
 
@@ -146,6 +148,13 @@ def test_roundtrip():
     _rt(columns.RefBytesColumn(3),
         [b("aaa"), b("bbb"), b("ccc"), b("aaa"), b("bbb"), b("ccc")],
         b("\x00") * 3)
+    _rt(columns.DictionaryColumn(),
+        [b("a"), b("ccc"), b("bb"), b("ccc"), b("a"), b("bb")], b(""))
+    _rt(columns.DictionaryColumn(3, fst=True),
+        [b("aaa"), b("bbb"), b("ccc"), b("aaa"), b("bbb"), b("ccc")],
+        b("\x00") * 3)
+    _rt(columns.SortedSetColumn(),
+        [[b("a"), b("ccc")], [b("bb")], [], [b("a"), b("bb"), b("ccc")]], [])
     _rt(columns.StructColumn("ifH", (0, 0.0, 0)),
         [(100, 1.5, 15000), (-100, -5.0, 0), (5820, 6.5, 462),
          (-57829, -1.5, 6), (0, 0, 0)],
@@ -162,6 +171,11 @@ def test_roundtrip():
     _rt(numcol("Q"), [2 ** 35, 2 ** 40, 2 ** 48, 2 ** 52, 2 ** 63], 0)
     _rt(numcol("f"), [1.5, -2.5, 3.5, -4.5, 1.25], 0)
     _rt(numcol("d"), [1.5, -2.5, 3.5, -4.5, 1.25], 0)
+    _rt(columns.PointsColumn("i"), [10, -20, 30, -25, 15], 0)
+    _rt(columns.PointsColumn("Q", dims=2),
+        [(2 ** 35, 1), (2 ** 40, 2), (2, 2 ** 63), (3, 4), (6, 5)], (0, 0))
+    _rt(columns.BlockColumn("i", blocksize=4), [10, -20, 30, -25, 15], 0)
+    _rt(columns.BlockColumn("Q"), [2 ** 35, 2 ** 40, 2 ** 48, 2 ** 63, 7], 0)
 
     c = columns.BitColumn(compress_at=10)
     _rt(c, [bool(random.randint(0, 1)) for _ in xrange(70)], False)
@@ -239,6 +253,292 @@ def test_column_query():
             assert check(q) == [4, 5, 6]
 
 
+def test_points_column():
+    random.seed(7)
+    st = RamStorage()
+    for dims in (1, 2):
+        c = columns.PointsColumn("i", dims=dims, leafsize=16)
+        doccount = 1000
+        values = {}
+        f = st.create_file("points")
+        w = c.writer(f)
+        for docnum in xrange(doccount):
+            if docnum % 5:
+                v = tuple(random.randint(1, 1000) for _ in xrange(dims))
+                values[docnum] = v
+                w.add(docnum, v if dims > 1 else v[0])
+        w.finish(doccount)
+        length = f.tell()
+        f.close()
+
+        f = st.open_file("points")
+        r = c.reader(f, 0, length, doccount)
+        assert r.point_count() == len(values)
+        for _ in xrange(20):
+            low = tuple(random.randint(-100, 900) for _ in xrange(dims))
+            high = tuple(n + random.randint(0, 300) for n in low)
+            target = [docnum for docnum in sorted(values)
+                      if all(low[d] <= values[docnum][d] <= high[d]
+                             for d in xrange(dims))]
+            if dims == 1:
+                low, high = low[0], high[0]
+            assert list(r.docs_in_range(low, high)) == target
+        f.close()
+
+
+def test_points_range_query():
+    schema = fields.Schema(id=fields.STORED, a=fields.ID,
+                           num=fields.NUMERIC(points=True),
+                           date=fields.DATETIME(points=True))
+    assert isinstance(schema["num"].column_type, columns.PointsColumn)
+
+    from datetime import datetime, timedelta
+    base = datetime(2010, 1, 1)
+    with TempIndex(schema, "pointsquery") as ix:
+        for segment in xrange(3):
+            with ix.writer() as w:
+                w.merge = False
+                for i in xrange(10):
+                    n = segment * 10 + i
+                    if n % 4 == 3:
+                        w.add_document(id=n, a=u("x"))
+                    else:
+                        w.add_document(id=n, a=u("x"), num=n,
+                                       date=base + timedelta(days=n))
+
+        with ix.searcher() as s:
+            def check(q):
+                leaf = s.reader().leaf_readers()[0][0]
+                assert q._column_docs(leaf) is not None
+                ids = sorted(hit["id"] for hit in s.search(q, limit=None))
+                assert ids == sorted(s.stored_fields(docnum)["id"]
+                                     for docnum in q.docs(s))
+                return ids
+
+            assert len(s.reader().leaf_readers()) == 3
+            q = query.NumericRange("num", 5, 12)
+            assert check(q) == [5, 6, 8, 9, 10, 12]
+            q = query.NumericRange("num", 5, 12, startexcl=True, endexcl=True)
+            assert check(q) == [6, 8, 9, 10]
+            q = query.DateRange("date", base + timedelta(days=25), None)
+            assert check(q) == [25, 26, 28, 29]
+            q = query.DateRange("date", None, base + timedelta(days=2))
+            assert check(q) == [0, 1, 2]
+
+        with ix.writer() as w:
+            w.delete_document(6)
+            w.delete_document(8)
+            w.optimize = True
+        with ix.searcher() as s:
+            q = query.NumericRange("num", 5, 12)
+            assert sorted(hit["id"] for hit in s.search(q)) == [5, 9, 10, 12]
+
+
+def test_block_column():
+    random.seed(11)
+    st = RamStorage()
+    c = columns.BlockColumn("i", default=-1, blocksize=32)
+    doccount = 1000
+    target = [-1] * doccount
+    f = st.create_file("blocks")
+    w = c.writer(f)
+    for docnum in xrange(doccount):
+        if 200 <= docnum < 300:
+            # A run of documents without values
+            continue
+        if docnum < 500:
+            # Few distinct values, so dictionary encoding
+            v = random.choice((5, 50, 500, 5000))
+        else:
+            v = docnum * 3 + random.randint(0, 2)
+        if docnum % 9 == 1:
+            continue
+        target[docnum] = v
+        w.add(docnum, v)
+    w.finish(doccount)
+    length = f.tell()
+    f.close()
+
+    f = st.open_file("blocks")
+    r = c.reader(f, 0, length, doccount)
+    assert r.blocksize == 32
+    assert list(r) == target
+    for docnum in xrange(doccount - 1, -1, -1):
+        assert r[docnum] == target[docnum]
+
+    for low, high in ((0, 100), (40, 600), (1500, 1700), (1490, 3000),
+                      (-5, -1), (6000, 9000)):
+        docs = [docnum for docnum, v in enumerate(target)
+                if low <= v <= high and v != -1]
+        assert list(r.docs_in_range(low, high)) == docs
+
+    blocksize, lows, highs = r.block_bounds()
+    assert blocksize == 32
+    for i, (lo, hi) in enumerate(zip(lows, highs)):
+        block = target[i * 32:(i + 1) * 32]
+        assert lo == min(block) and hi == max(block)
+    f.close()
+
+
+def test_block_range_and_sort():
+    schema = fields.Schema(id=fields.STORED, a=fields.ID,
+                           num=fields.NUMERIC(blocks=True))
+    assert isinstance(schema["num"].column_type, columns.BlockColumn)
+
+    with TempIndex(schema, "blockquery") as ix:
+        with ix.writer() as w:
+            for n in xrange(500):
+                if n % 7 == 3:
+                    w.add_document(id=n, a=u("x"))
+                else:
+                    w.add_document(id=n, a=u("x"), num=(n * 37) % 500)
+
+        with ix.searcher() as s:
+            leaf = s.reader().leaf_readers()[0][0]
+            q = query.NumericRange("num", 100, 150)
+            assert q._column_docs(leaf) is not None
+            ids = sorted(hit["id"] for hit in s.search(q, limit=None))
+            assert ids == sorted(n for n in xrange(500)
+                                 if n % 7 != 3 and 100 <= (n * 37) % 500 <= 150)
+
+            r = s.search(query.Term("a", u("x")), sortedby="num", limit=5)
+            assert [hit["id"] for hit in r] == [0, 473, 446, 419, 392]
+
+
+def test_dictionary_column():
+    st = RamStorage()
+    # More unique values than RefBytesColumn can hold
+    doccount = 70000
+    values = [b("%05x") % ((i * 7919) % 99991) for i in xrange(doccount)]
+    # The default value is always in the dictionary
+    uniques = [b("")] + sorted(set(values))
+    for fst in (False, True):
+        c = columns.DictionaryColumn(fst=fst)
+        f = st.create_file("dict")
+        w = c.writer(f)
+        for docnum, v in enumerate(values):
+            w.add(docnum, v)
+        w.finish(doccount)
+        length = f.tell()
+        f.close()
+
+        f = st.open_file("dict")
+        r = c.reader(f, 0, length, doccount)
+        for docnum in xrange(0, doccount, 97):
+            assert r[docnum] == values[docnum]
+            assert uniques[r.ordinal(docnum)] == values[docnum]
+        assert list(r.ordinals()[-5:]) == [uniques.index(v)
+                                            for v in values[-5:]]
+
+        assert r.ordinal_of(b("00000")) == 1
+        assert r.ordinal_of(uniques[1234]) == 1234
+        assert r.ordinal_of(b("0000g")) is None
+        for prefix in (b("1"), b("18"), b("0ff"), b("0000")):
+            target = [i for i, v in enumerate(uniques)
+                      if v.startswith(prefix)]
+            assert r.prefix_ordinals(prefix) == (target[0], target[-1] + 1)
+        start, end = r.prefix_ordinals(b("x"))
+        assert start == end
+        assert r.ordinal_values() == uniques
+        f.close()
+
+
+def test_dictionary_column_absent():
+    st = RamStorage()
+    samples = [[b("aa"), b("aab")],
+               [b("a"), b("aab"), b("b")],
+               [b("b"), b("bba"), b("bbc"), b("c"), b("cab")],
+               [b("cac"), b("baca"), b("accb")]]
+    probes = [b("a"), b("aaa"), b("aac"), b("ab"), b("abc"), b("bb"),
+              b("bbb"), b("bc"), b("ca"), b("cb"), b("cc"), b("d"), b("zz")]
+    for values in samples:
+        # The default value is always in the dictionary
+        uniques = [b("")] + sorted(set(values))
+        for fst in (False, True):
+            c = columns.DictionaryColumn(fst=fst)
+            f = st.create_file("dict")
+            w = c.writer(f)
+            for docnum, v in enumerate(values):
+                w.add(docnum, v)
+            w.finish(len(values))
+            length = f.tell()
+            f.close()
+
+            f = st.open_file("dict")
+            r = c.reader(f, 0, length, len(values))
+            for v in probes + values:
+                if v in uniques:
+                    assert r.ordinal_of(v) == uniques.index(v)
+                else:
+                    assert r.ordinal_of(v) is None
+
+                target = [i for i, u in enumerate(uniques)
+                          if u.startswith(v)]
+                start, end = r.prefix_ordinals(v)
+                if target:
+                    assert (start, end) == (target[0], target[-1] + 1)
+                else:
+                    assert start == end
+            f.close()
+
+
+def test_stored_fields_column():
+    st = RamStorage()
+    body = u("alfa bravo charlie ") * 1000
+    # More fields than fit in the prefix the reader reads to get the table
+    many = dict(("field%02d" % i, i) for i in xrange(40))
+    many.update(("large%02d" % i, body) for i in xrange(10))
+    docs = [{"title": u("First"), "body": body, "n": 1},
+            {},
+            many,
+            {"title": u("Fourth"), "tags": [u("x"), u("y")]}]
+
+    c = columns.StoredFieldsColumn()
+    f = st.create_file("stored")
+    w = c.writer(f)
+    for docnum, d in enumerate(docs):
+        w.add(docnum, d)
+    w.finish(len(docs) + 1)
+    length = f.tell()
+    f.close()
+
+    f = st.open_file("stored")
+    r = c.reader(f, 0, length, len(docs) + 1)
+    # The large value is compressed
+    assert length < len(body)
+    assert list(r) == docs + [{}]
+    assert r.fields(0, ["title", "n", "nope"]) == {"title": u("First"), "n": 1}
+    assert r.fields(0, ["body"]) == {"body": body}
+    assert r.fields(1, ["title"]) == {}
+    assert r.fields(2, ["field00", "field39"]) == {"field00": 0, "field39": 39}
+    assert r.fields(2, ["large09", "field01"]) == {"large09": body,
+                                                   "field01": 1}
+    assert r.fields(3, ["tags"]) == {"tags": [u("x"), u("y")]}
+    assert r.fields(4, ["title"]) == {}
+    f.close()
+
+
+def test_prefetch_extents():
+    st = RamStorage()
+    c = columns.VarBytesColumn()
+    f = st.create_file("vb")
+    w = c.writer(f)
+    for docnum in xrange(6):
+        w.add(docnum, b("x") * (docnum + 1))
+    w.finish(6)
+    length = f.tell()
+    f.close()
+
+    f = st.open_file("vb")
+    hints = []
+    f.advise = lambda advice, pos, length: hints.append((advice, pos, length))
+    r = c.reader(f, 0, length, 6)
+    # Consecutive documents are hinted as one run
+    r.prefetch([0, 1, 2, 4])
+    assert hints == [("willneed", 0, 6), ("willneed", 10, 5)]
+    f.close()
+
+
 def test_ref_switch():
     import warnings
 
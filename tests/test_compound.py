@@ -52,6 +52,92 @@ def test_simple_compound_nomap():
     _test_simple_compound(st)
 
 
+def _test_streaming_compound(st):
+    from whoosh.filedb.compound import StreamingCompoundStorage
+
+    big = b("x") * 100
+    cs = StreamingCompoundStorage(st, "f", buffersize=64)
+    # "a" outgrows the buffer first, so it's written directly to the end of
+    # the compound file, while "b" has to go to a temporary file
+    af = cs.create_file("a")
+    bf = cs.create_file("b")
+    af.write_int(0)
+    af.write(big)
+    bf.write(big)
+    bf.write(big)
+    # Overwrite the start of "a" after it was moved to the compound file
+    af.seek(0)
+    af.write_int(12345)
+    af.seek(0, 2)
+    af.write(b("end"))
+    cf = cs.create_file("c")
+    cf.write(b("charlie"))
+    cf.close()
+
+    # Closed files can be read back before the compound file is finished
+    assert cs.file_exists("c")
+    assert not cs.file_exists("a")
+    with cs.open_file("c") as f:
+        assert f.read() == b("charlie")
+
+    bf.close()
+    af.close()
+    with cs.open_file("b") as f:
+        assert f.read() == big + big
+    cs.close()
+    assert st.list() == ["f"]
+
+    f = CompoundStorage(st.open_file("f"))
+    assert sorted(f.list()) == ["a", "b", "c"]
+    with f.open_file("a") as af:
+        assert af.read_int() == 12345
+        assert af.read() == big + b("end")
+    with f.open_file("b") as bf:
+        assert bf.read() == big + big
+    with f.open_file("c") as cf:
+        assert cf.read() == b("charlie")
+    f.close()
+
+
+def test_compound_checksums():
+    from whoosh.filedb.compound import StreamingCompoundStorage
+
+    st = RamStorage()
+    with st.create_file("a") as af:
+        af.write(b("alfa") * 100)
+    f = st.create_file("f")
+    CompoundStorage.assemble(f, st, ["a"])
+
+    cs = StreamingCompoundStorage(st, "g", buffersize=64)
+    bf = cs.create_file("b")
+    bf.write(b("bravo") * 100)
+    # Going back to overwrite part of the file invalidates the running
+    # checksum, so it must be computed from the finished data
+    bf.seek(10)
+    bf.write(b("BRAVO"))
+    bf.close()
+    cs.close()
+
+    for name in ("f", "g"):
+        c = CompoundStorage(st.open_file(name))
+        assert c.verify() == []
+        c.close()
+
+    # Corrupt a byte in the middle of "b"
+    data = bytearray(st.files["g"])
+    data[200] ^= 0xff
+    st.files["g"] = bytes(data)
+    c = CompoundStorage(st.open_file("g"))
+    assert c.verify() == ["b"]
+    c.close()
+
+
+def test_streaming_compound():
+    _test_streaming_compound(RamStorage())
+    with TempStorage("streaming") as st:
+        _test_streaming_compound(st)
+
+
 #def test_unclosed_mmap():
 #    with TempStorage("unclosed") as st:
 #        assert st.supports_mmap
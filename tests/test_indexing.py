@@ -70,6 +70,141 @@ def test_version_in():
         assert not ix.is_empty()
 
 
+def test_single_file_segment():
+    schema = fields.Schema(id=fields.ID(stored=True),
+                           text=fields.TEXT(vector=True, spelling=True))
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        for i in xrange(500):
+            w.add_document(id=text_type(i), text=u("alfa bravo w%d") % (i % 5))
+
+    # The segment's files were streamed into one compound file, with no
+    # separate files left over
+    segment = ix._segments()[0]
+    assert segment.is_compound()
+    names = ix.storage.list()
+    assert sorted(name[-4:] for name in names) == [".seg", ".toc"]
+
+    with ix.searcher() as s:
+        r = s.search(query.Term("text", u("w3")), limit=None)
+        assert len(r) == 100
+        assert r[0]["id"] == u("3")
+        assert list(s.reader().most_distinctive_terms("text", number=1))
+        assert s.vector_as("weight", 0, "text")
+
+
+def test_verify():
+    import os, time
+    from whoosh.filedb.filestore import ChecksumError
+
+    schema = fields.Schema(id=fields.ID(stored=True), text=fields.TEXT)
+    with TempIndex(schema, "verify") as ix:
+        for _ in xrange(3):
+            with ix.writer() as w:
+                w.merge = False
+                for i in xrange(200):
+                    w.add_document(id=text_type(i), text=u("alfa bravo"))
+        assert index.verify(ix, parallel=3) == []
+
+        # Flip a byte in the stored fields of the second segment
+        segment = ix._segments()[1]
+        path = os.path.join(ix.storage.folder,
+                            segment.make_filename(segment.COMPOUND_EXT))
+        with open(path, "rb") as f:
+            data = bytearray(f.read())
+        data[100] ^= 0xff
+        with open(path, "wb") as f:
+            f.write(bytes(data))
+
+        problems = index.verify(ix, parallel=3)
+        assert len(problems) == 1
+        assert problems[0][0] == segment.segment_id()
+
+        # Opening the segment queues a background check, after which reading
+        # the corrupt file raises a clear error
+        with ix.searcher() as s:
+            assert s.doc_count() == 600
+        for _ in xrange(100):
+            with ix.searcher() as s:
+                try:
+                    s.stored_fields(200)
+                except ChecksumError:
+                    break
+            time.sleep(0.05)
+        else:
+            assert False, "Corrupt file was not detected"
+
+
+def test_toc_cache():
+    from whoosh.compat import pickle
+    from whoosh.system import _INT_SIZE, _FLOAT_SIZE, _LONG_SIZE
+
+    schema = fields.Schema(id=fields.ID(stored=True),
+                           text=fields.TEXT(analyzer=analysis.StemmingAnalyzer()))
+    ix = RamStorage().create_index(schema)
+    for ids in ("ab", "cd"):
+        w = ix.writer()
+        for c in ids:
+            w.add_document(id=u(c), text=u("running"))
+        w.commit(merge=False)
+    # Open the index without a schema object so it uses the stored schema
+    ix = ix.storage.open_index()
+
+    # The schema's fields and unchanged segments are shared between reads
+    toc1 = ix._read_toc()
+    assert ix._read_toc().schema["text"] is toc1.schema["text"]
+    w = ix.writer()
+    w.delete_by_term("id", u("c"))
+    w.commit(merge=False)
+    toc2 = ix._read_toc()
+    assert toc2.schema["text"] is toc1.schema["text"]
+    assert toc2.segments[0] is toc1.segments[0]
+    assert toc2.segments[1] is not toc1.segments[1]
+    assert toc2.segments[1].deleted_count() == 1
+    assert toc1.segments[1].deleted_count() == 0
+
+    # Each read gets its own schema object, so changing one doesn't change
+    # the schema of other indexes with the same fingerprint
+    assert toc2.schema is not toc1.schema
+    toc1.schema.add("extra", fields.ID)
+    toc1.schema.add("dyn_*", fields.ID, glob=True)
+    for toc in (toc2, ix._read_toc()):
+        assert "extra" not in toc.schema
+        assert "dyn_x" not in toc.schema
+    toc1.schema.remove("text")
+    assert "text" in ix._read_toc().schema
+
+    # Writers get private copies they can change
+    w = ix.writer()
+    assert w.schema is not toc1.schema
+    w.add_field("tag", fields.KEYWORD)
+    assert "tag" not in toc1.schema
+    w.commit(merge=False)
+    assert "tag" in ix.schema
+    assert "tag" not in toc1.schema
+
+    # Read a TOC in the previous format
+    st = ix.storage
+    stream = st.create_file("_OLD_0.toc")
+    stream.write_varint(_INT_SIZE)
+    stream.write_varint(_LONG_SIZE)
+    stream.write_varint(_FLOAT_SIZE)
+    stream.write_int(-12345)
+    stream.write_int(-111)
+    for num in (2, 7, 0):
+        stream.write_varint(num)
+    stream.write_string(pickle.dumps(schema, -1))
+    stream.write_int(0)
+    stream.write_int(0)
+    stream.write_pickle(toc2.segments)
+    stream.close()
+    toc = index.TOC.read(st, "OLD")
+    assert toc.version == -111
+    assert toc.schema == schema
+    assert [s.segment_id() for s in toc.segments] == [
+        s.segment_id() for s in toc2.segments]
+
+
 def test_simple_indexing():
     schema = fields.Schema(text=fields.TEXT, id=fields.STORED)
     domain = (u("alfa"), u("bravo"), u("charlie"), u("delta"), u("echo"),
@@ -390,6 +525,58 @@ def test_update_numeric():
             assert results == "0 1 2 3 4"
 
 
+def test_update_documents():
+    schema = fields.Schema(key=fields.ID(unique=True, stored=True),
+                           num=fields.NUMERIC(unique=True),
+                           text=fields.ID(stored=True))
+    with TempIndex(schema, "updatedocs") as ix:
+        # Write the documents in several segments
+        for start in (0, 10, 20):
+            with ix.writer() as w:
+                w.merge = False
+                for i in xrange(start, start + 10):
+                    w.add_document(key=text_type(i), num=i, text=u("a"))
+
+        with ix.reader() as r:
+            for sr, _ in r.leaf_readers():
+                assert sr._terms.has_key_index("key")
+                assert sr._terms.has_key_index("num")
+                assert not sr._terms.has_key_index("text")
+
+        with ix.writer() as w:
+            w.merge = False
+            w.update_documents([
+                {"key": u("5"), "text": u("b")},
+                {"key": u("15"), "text": u("b")},
+                {"key": u("25"), "text": u("b")},
+                {"key": u("40"), "text": u("b")},
+                # Replaces the document with num=7, and the earlier document
+                # in this batch with key=5
+                {"key": u("5"), "num": 7, "text": u("c")},
+            ])
+
+        with ix.searcher() as s:
+            assert s.doc_count() == 30
+            docs = dict((d["key"], d["text"]) for _, d in s.iter_docs())
+            assert docs["5"] == "c"
+            assert "7" not in docs
+            assert docs["15"] == docs["25"] == docs["40"] == "b"
+            assert docs["0"] == "a"
+
+            # The replaced documents are deleted, so the lookups find the
+            # new versions in the newest segment
+            for key in ("5", "15", "40"):
+                docnum = s.document_number(key=text_type(key))
+                assert s.stored_fields(docnum)["key"] == key
+            assert s.document_number(key=u("7")) is None
+            assert s.document_number(key=u("100")) is None
+            assert s.stored_fields(s.document_number(num=7))["key"] == "5"
+
+            r = s.reader()
+            found = r.unique_docnums("key", [b("0"), b("15"), b("99")])
+            assert sorted(found) == [b("0"), b("15")]
+
+
 def test_reindex():
     SAMPLE_DOCS = [
         {'id': u('test1'),
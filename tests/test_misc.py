@@ -47,6 +47,65 @@ def test_ramstorage():
     lock.release()
 
 
+def test_block_cache():
+    from whoosh.compat import b
+    from whoosh.filedb.blockcache import BlockCache
+
+    cache = BlockCache(cachesize=3 * 16 / (1024 * 1024), blocksize=16)
+    assert cache.capacity == 3
+    loads = []
+
+    def loader(n):
+        loads.append(n)
+        return b("%02d") % n
+
+    key = ("a", 100)
+    for n in (0, 1, 2, 0, 3, 0):
+        cache.block(key, n, loader)
+    # Block 0 was referenced, so the clock evicted block 1 to make room for 3
+    assert loads == [0, 1, 2, 3]
+    cache.block(key, 1, loader)
+    assert loads[-1] == 1
+    assert cache.stats() == {"a": {"hits": 2, "misses": 5, "evictions": 2}}
+
+    cache.forget("a")
+    cache.block(key, 0, loader)
+    assert loads[-1] == 0
+
+
+def test_caching_storage():
+    from whoosh import fields, query
+    from whoosh.compat import xrange
+    from whoosh.filedb.blockcache import CachingStorage
+    from whoosh.filedb.filestore import RamStorage
+
+    st = CachingStorage(RamStorage(), cachesize=0.25, blocksize=512)
+    schema = fields.Schema(id=fields.ID(stored=True), text=fields.TEXT)
+    ix = st.create_index(schema)
+    with ix.writer() as w:
+        for i in xrange(500):
+            w.add_document(id=u("%d") % i, text=u("alfa bravo %d") % (i % 7))
+
+    def hits():
+        return sum(stat["hits"] for stat in st.cache_stats().values())
+
+    q = query.Term("text", u("bravo"))
+    with ix.searcher() as s:
+        r = s.search(q, limit=None, sortedby="id")
+        ids = [hit["id"] for hit in r]
+    assert len(ids) == 500
+    assert ids[:3] == ["0", "1", "10"]
+
+    # The second search is served from the cache
+    before = hits()
+    misses = sum(stat["misses"] for stat in st.cache_stats().values())
+    with ix.searcher() as s:
+        assert [hit["id"] for hit in s.search(q, limit=None,
+                                              sortedby="id")] == ids
+    assert hits() > before
+    assert sum(stat["misses"] for stat in st.cache_stats().values()) == misses
+
+
 def test_filelock_simple():
     with TempStorage("simplefilelock") as st:
         lock1 = st.lock("testlock")
@@ -548,3 +548,87 @@ def test_andmaybe():
         assert len(r) == 3
         assert [hit["id"] for hit in r] == [1, 2, 0]
 
+
+
+def test_pattern_automata():
+    import fnmatch
+    import re
+
+    words = u("alfa alpha bravo brave action nation station ration bar "
+              "baz abc aXbYc abbc ca cab tion").split()
+    schema = fields.Schema(text=fields.KEYWORD)
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        for i in range(0, len(words), 3):
+            w.add_document(text=u(" ").join(words[i:i + 3]))
+
+    with ix.reader() as r:
+        for pattern in ("*tion", "a*b*c", "?a*", "[ab]*", "[!a]?", "*a*a*"):
+            q = Wildcard("text", pattern)
+            assert q._automaton(schema["text"]) is not None
+            target = sorted(w for w in words
+                            if fnmatch.fnmatchcase(w, pattern))
+            assert [t.decode("utf8") for t in q._btexts(r)] == target
+
+        for pattern in (".*tion", "a.*b.*c$", "(br|ca)", "[^a].{2}$"):
+            q = query.Regex("text", pattern)
+            assert q._automaton(schema["text"]) is not None
+            target = sorted(w for w in words if re.match(pattern, w))
+            assert [t.decode("utf8") for t in q._btexts(r)] == target
+
+        # Patterns that can't be converted to automata fall back to testing
+        # each term
+        q = query.Regex("text", r"(\w).*\1")
+        assert q._automaton(schema["text"]) is None
+        target = sorted(w for w in words if re.match(r"(\w).*\1", w))
+        assert [t.decode("utf8") for t in q._btexts(r)] == target
+
+
+def test_multiterm_rewrite():
+    schema = fields.Schema(id=fields.STORED, text=fields.KEYWORD)
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        for i in range(100):
+            words = [u("w%02d") % i]
+            if i % 2:
+                # Make the odd terms more frequent
+                words.append(u("w%02d") % (i - 1))
+            w.add_document(id=i, text=u(" ").join(words))
+
+    with ix.searcher() as s:
+        allids = set(range(100))
+
+        q = Prefix("text", u("w"), rewrite=query.MultiTerm.BOOLEAN_REWRITE)
+        assert set(hit["id"] for hit in s.search(q, limit=None)) == allids
+
+        q = Prefix("text", u("w"),
+                   rewrite=query.MultiTerm.CONSTANT_SCORE_REWRITE, boost=2.0)
+        r = s.search(q, limit=None)
+        assert set(hit["id"] for hit in r) == allids
+        assert all(hit.score == 2.0 for hit in r)
+
+        # The even terms appear in two documents each, so they're the top
+        # terms by doc frequency
+        q = Wildcard("text", u("w*"), topterms=5,
+                     rewrite=query.MultiTerm.TOP_TERMS_REWRITE)
+        r = s.search(q, limit=None)
+        assert len(r) == 10
+
+        q = TermRange("text", u("w00"), u("w99"), maxterms=10)
+        with pytest.raises(query.TooManyTerms):
+            s.search(q)
+
+        q = TermRange("text", u("w00"), u("w99"), maxterms=10, truncate=True,
+                      rewrite=query.MultiTerm.CONSTANT_SCORE_REWRITE)
+        assert len(s.search(q, limit=None)) == 10
+
+        q = FuzzyTerm("text", u("w10"), maxterms=3, truncate=True)
+        assert len(list(q._limited_btexts(s.reader()))) == 3
+
+        # AUTO_REWRITE switches to the constant score matcher for large
+        # expansions
+        q = Prefix("text", u("w"))
+        q.BOOLEAN_TERM_LIMIT = 10
+        m = q.matcher(s, s.boolean_context())
+        assert m.__class__.__name__ == "ListMatcher"
+        assert set(m.all_ids()) == allids
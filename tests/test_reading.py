@@ -2,7 +2,7 @@ from __future__ import with_statement
 import random, threading, time
 
 from whoosh import analysis, fields, formats, reading
-from whoosh.compat import b, u, xrange
+from whoosh.compat import b, iteritems, u, xrange
 from whoosh.reading import SegmentReader
 from whoosh.filedb.filestore import RamStorage
 from whoosh.util.testing import TempIndex
@@ -154,6 +154,39 @@ def test_stored_fields():
         assert sr.document(a=u("2")) == {"a": u("2"), "b": "b", "d": u("Bravo")}
 
 
+def test_prefetch_hints():
+    from whoosh import query
+    from whoosh.filedb.structfile import BufferFile
+
+    schema = fields.Schema(id=fields.ID(stored=True), text=fields.TEXT)
+    with TempIndex(schema, "prefetch") as ix:
+        with ix.writer() as w:
+            for i in xrange(1000):
+                w.add_document(id=u("%04d") % i, text=u("alfa"))
+
+        hints = []
+        advise = BufferFile.advise
+
+        def record(self, advice, position=0, length=0):
+            hints.append((self._name, advice))
+            return advise(self, advice, position, length)
+
+        BufferFile.advise = record
+        try:
+            with ix.searcher() as s:
+                r = s.search(query.Term("text", u("alfa")), limit=None,
+                             sortedby="id")
+                assert [hit["id"] for hit in r[:3]] == ["0000", "0001",
+                                                        "0002"]
+                assert len(list(r)) == 1000
+        finally:
+            BufferFile.advise = advise
+
+        names = set(name for name, advice in hints if advice == "willneed")
+        assert any(name.endswith(".pst") for name in names)
+        assert any(name.endswith(".col") for name in names)
+
+
 def test_stored_fields2():
     schema = fields.Schema(content=fields.TEXT(stored=True),
                            title=fields.TEXT(stored=True),
@@ -362,3 +395,74 @@ def test_reader_subclasses():
     check_abstract_methods(reading.IndexReader, SegmentReader)
     check_abstract_methods(reading.IndexReader, reading.MultiReader)
     check_abstract_methods(reading.IndexReader, reading.EmptyReader)
+
+
+def test_reader_manager():
+    from whoosh import index, query
+
+    schema = fields.Schema(id=fields.ID(stored=True))
+    ix = RamStorage().create_index(schema)
+    for ids in ("abc", "def"):
+        w = ix.writer()
+        for c in ids:
+            w.add_document(id=u(c))
+        w.commit(merge=False)
+
+    def segfiles(r):
+        return dict((sr.segment().segment_id(), sr._files)
+                    for sr, _ in r.leaf_readers())
+
+    with index.ReaderManager(ix) as mgr:
+        assert mgr.refresh()
+        assert not mgr.refresh()
+        r1 = mgr.reader()
+        files1 = segfiles(r1)
+        assert r1.doc_count() == 6
+
+        # Delete a document in the first segment and add a new segment
+        w = ix.writer()
+        w.delete_by_term("id", u("a"))
+        w.add_document(id=u("g"))
+        w.commit(merge=False)
+
+        assert mgr.refresh()
+        with mgr.searcher() as s:
+            files2 = segfiles(s.reader())
+            # Only the new segment was opened
+            assert len(files2) == 3
+            for segid, files in iteritems(files1):
+                assert files2[segid] is files
+
+            assert s.doc_count() == 6
+            assert not s.search(query.Term("id", u("a")))
+            assert s.search(query.Term("id", u("g")))
+
+        # The old reader still sees the old deletions
+        assert r1.doc_count() == 6
+        assert r1.stored_fields(0) == {"id": u("a")}
+        assert not any(r.is_deleted(0) for r, _ in r1.leaf_readers())
+        r1.close()
+
+    # Closing the manager and the readers closed all the files
+    assert all(files.refs == 0 for files in files2.values())
+
+
+def test_refresh_reuses_segments():
+    schema = fields.Schema(id=fields.ID(stored=True))
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        w.add_document(id=u("a"))
+        w.add_document(id=u("b"))
+
+    s = ix.searcher()
+    files = s.reader()._files
+    w = ix.writer()
+    w.delete_by_term("id", u("b"))
+    w.commit(merge=False)
+
+    s = s.refresh()
+    assert s.reader()._files is files
+    assert s.doc_count() == 1
+    assert s.reader().segment().deletion_generation() != (0, 0)
+    s.close()
+    assert files.refs == 0
@@ -333,6 +333,45 @@ def test_resultspage():
         assert rp.is_last_page()
 
 
+def test_field_projection():
+    schema = fields.Schema(id=fields.ID(stored=True), title=fields.STORED,
+                           body=fields.TEXT(stored=True))
+    with TempIndex(schema) as ix:
+        with ix.writer() as w:
+            for i in xrange(10):
+                w.add_document(id=text_type(i), title=u("T%d") % i,
+                               body=u("alfa ") * (i + 1))
+        with ix.writer() as w:
+            for i in xrange(10, 15):
+                w.add_document(id=text_type(i), title=u("T%d") % i,
+                               body=u("alfa ") * (i + 1))
+
+        with ix.searcher() as s:
+            r = s.search(query.Term("body", "alfa"), limit=None)
+            ids = [hit["id"] for hit in r]
+            assert sorted(ids, key=int) == [text_type(i) for i in xrange(15)]
+
+            n = ids.index("12")
+            assert r.fields(n, ["title"]) == {"title": u("T12")}
+            assert r.fields(n)["body"] == u("alfa ") * 13
+
+            sfs = r.fields(slice(2, 8), ["id", "title"])
+            assert [d["id"] for d in sfs] == ids[2:8]
+            assert all(sorted(d) == ["id", "title"] for d in sfs)
+
+            hit = r[n]
+            assert hit.get_fields(["title", "nope"]) == {"title": u("T12")}
+            assert hit.get_fields(["body"]) == {"body": u("alfa ") * 13}
+            # Only the requested fields were read
+            assert hit._fields is None
+            assert hit["id"] == "12"
+            assert hit.fields()["title"] == u("T12")
+
+            page = s.search_page(query.Term("body", "alfa"), 2, pagelen=4)
+            assert [d["id"] for d in page.fields(fieldnames=["id"])] == ids[4:8]
+            assert page.fields(1, ["title"]) == {"title": r[5]["title"]}
+
+
 def test_highlight_setters():
     schema = fields.Schema(text=fields.TEXT)
     ix = RamStorage().create_index(schema)
@@ -551,7 +590,7 @@ def test_closed_searcher():
         assert r[0]
         assert r[0]["key"] == "bravo"
         c = s.reader().column_reader("key")
-        assert c[1] == "bravo"
+        assert c[1] == ["bravo"]
         assert s.reader().has_word_graph("key")
         assert s.suggest("key", "brovo") == ["bravo"]
 
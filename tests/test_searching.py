@@ -1536,6 +1536,87 @@ def test_collapse_order_nocolumn():
               "h b l i k d")
 
 
+def test_collapse_bounded():
+    import random
+    from whoosh import collectors, sorting
+
+    schema = fields.Schema(id=fields.STORED, rank=fields.NUMERIC(sortable=True),
+                           text=fields.TEXT, tag=fields.ID(sortable=True))
+    ix = RamStorage().create_index(schema)
+    rng = random.Random(0)
+    docs = []
+    with ix.writer() as w:
+        for i in xrange(2000):
+            tag = u("t%d") % rng.randint(0, 700) if i % 7 else u("")
+            rank = rng.randint(0, 100000)
+            text = u(" ").join([u("alfa")] * rng.randint(1, 9))
+            docs.append((i, rank, tag))
+            w.add_document(id=i, rank=rank, text=text, tag=tag)
+
+    def brute(r, limit):
+        counts = {}
+        out = []
+        for docnum in [hit.docnum for hit in r]:
+            tag = docs[docnum][2]
+            if tag:
+                counts[tag] = counts.get(tag, 0) + 1
+                if counts[tag] > limit:
+                    continue
+            out.append(docnum)
+        return out
+
+    with ix.searcher() as s:
+        q = query.Term("text", u("alfa"))
+        tag = sorting.FieldFacet("tag")
+        for limit in (1, 3):
+            # Sorted
+            allr = s.search(q, sortedby="rank", limit=None)
+            target = brute(allr, limit)
+            c = collectors.SortingCollector(sorting.FieldFacet("rank"),
+                                            limit=10)
+            cc = collectors.CollapseCollector(c, tag, limit=limit)
+            cc.prune_size = 8
+            s.search_with_collector(q, cc)
+            r = cc.results()
+            assert [hit.docnum for hit in r] == target[:10]
+            assert len(cc._best) < 700
+            # Forgetting keys doesn't change the counts
+            assert len(r) == len(target)
+            c2 = collectors.SortingCollector(sorting.FieldFacet("rank"),
+                                             limit=10)
+            cc2 = collectors.CollapseCollector(c2, tag, limit=limit)
+            s.search_with_collector(q, cc2)
+            assert len(cc2.results()) == len(target)
+            assert cc2.collapsed_counts == cc.collapsed_counts
+
+            # Scored
+            allr = s.search(q, limit=None)
+            target = brute(allr, limit)
+            cc = collectors.CollapseCollector(collectors.TopCollector(10),
+                                              tag, limit=limit)
+            s.search_with_collector(q, cc)
+            r = cc.results()
+            assert [hit.docnum for hit in r] == target[:10]
+            assert r.scored_length() == 10
+
+            # A child that counts every match gives the exact count directly
+            c = collectors.TopCollector(10, usequality=False)
+            cc = collectors.CollapseCollector(c, tag, limit=limit)
+            cc.prune_size = 2
+            s.search_with_collector(q, cc)
+            r = cc.results()
+            assert [hit.docnum for hit in r] == target[:10]
+            assert len(cc._best) < 700
+            assert r.has_exact_length()
+            assert len(r) == len(target)
+            assert sum(r.collapsed_counts.values()) == 2000 - len(target)
+
+        # Without a bounded child every collapsed document is counted
+        r = s.search(q, collapse=tag, collapse_limit=2, limit=None)
+        assert len(r) == len(brute(s.search(q, limit=None), 2))
+        assert sum(r.collapsed_counts.values()) == 2000 - len(r)
+
+
 def test_coord():
     from whoosh.matching import CoordMatcher
 
@@ -1742,3 +1823,248 @@ def test_find_decimals():
         assert names == "delta foxtrot"
 
 
+
+
+def test_result_cache():
+    from whoosh import sorting
+
+    schema = fields.Schema(id=fields.ID(stored=True),
+                           text=fields.TEXT,
+                           tag=fields.KEYWORD(sortable=True))
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        for i, tag in enumerate(u("a b a c b a d").split()):
+            w.add_document(id=text_type(i), text=u("alfa bravo"), tag=tag)
+
+    cache = searching.ResultCache(maxsize=10)
+    q = query.Term("text", u("alfa"))
+    with ix.searcher(resultcache=cache) as s:
+        r1 = s.search(q, limit=3, groupedby="tag")
+        r2 = s.search(q, limit=3, groupedby="tag")
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert r2.searcher is s
+        assert r2.top_n == r1.top_n
+        assert len(r2) == 7
+        assert r2.groups("tag") == r1.groups("tag")
+        assert r2.docs() == set(range(7))
+        assert [hit["id"] for hit in r2] == [hit["id"] for hit in r1]
+
+        # Different search arguments make a different key
+        s.search(q, limit=4, groupedby="tag")
+        s.search(q, limit=3, sortedby=sorting.FieldFacet("tag"))
+        s.search(q, limit=3, sortedby=sorting.FieldFacet("tag"))
+        assert (cache.hits, cache.misses) == (2, 3)
+
+        # Results objects can't be used in a key
+        s.search(q, filter=r1)
+        s.search(q, filter=r1)
+        assert (cache.hits, cache.misses) == (2, 3)
+
+        # Lazily cached state on a query doesn't change its key
+        wq = query.Wildcard("text", u("al*a"))
+        assert len(s.search(wq)) == 7
+        assert len(s.search(wq)) == 7
+        assert (cache.hits, cache.misses) == (3, 4)
+
+    # Deleting a document invalidates the cached entries
+    with ix.writer() as w:
+        w.delete_by_term("id", u("0"))
+    with ix.searcher(resultcache=cache) as s:
+        r = s.search(q, limit=3, groupedby="tag")
+        assert cache.misses == 5
+        assert len(r) == 6
+        r = s.search(q, limit=3, groupedby="tag")
+        assert cache.hits == 4
+
+    # Least recently used entries are evicted when the cache is full
+    cache = searching.ResultCache(maxsize=2)
+    with ix.searcher(resultcache=cache) as s:
+        for limit in (1, 2, 1, 3):
+            s.search(q, limit=limit)
+        assert len(cache) == 2
+        s.search(q, limit=1)
+        assert cache.hits == 2
+
+    # Entries expire after the TTL
+    import time
+    cache = searching.ResultCache(ttl=0.05)
+    with ix.searcher(resultcache=cache) as s:
+        s.search(q)
+        time.sleep(0.1)
+        s.search(q)
+        assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_result_cache_lazy_count():
+    schema = fields.Schema(text=fields.TEXT,
+                           num=fields.NUMERIC(sortable=True))
+    ix = RamStorage().create_index(schema)
+    with ix.writer(sortedby="num") as w:
+        for i in xrange(100):
+            w.add_document(text=u("alfa") if i % 4 else u("bravo"), num=i)
+
+    cache = searching.ResultCache()
+    q = query.Term("text", u("alfa"))
+    with ix.searcher(resultcache=cache) as s:
+        r = s.search(q, sortedby="num", limit=3)
+        # The search stopped early, so caching the results didn't count the
+        # matches
+        assert not r.has_exact_length()
+        cached = list(cache._data.values())[0][1]
+        assert cached._total is None
+
+        r = s.search(q, sortedby="num", limit=3)
+        assert cache.hits == 1
+        assert not r.has_exact_length()
+        assert len(r) == 75
+        assert [hit["num"] for hit in r] == [1, 2, 3]
+
+
+def test_result_cache_isolation():
+    schema = fields.Schema(id=fields.ID(stored=True), text=fields.TEXT,
+                           tag=fields.KEYWORD(sortable=True))
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        for i, word in enumerate(u("alfa able bravo alfa able").split()):
+            w.add_document(id=text_type(i), text=word, tag=word)
+
+    cache = searching.ResultCache(maxsize=10)
+    with ix.searcher(resultcache=cache) as s:
+        # Options missing from the repr of a query are part of the key
+        s.search(query.Prefix("text", u("a")))
+        with pytest.raises(query.TooManyTerms):
+            s.search(query.Prefix("text", u("a"), maxterms=1))
+
+        # Changing the results of a cache hit doesn't change the cache
+        q = query.Term("text", u("alfa"))
+        s.search(q, groupedby="tag")
+        r = s.search(q, groupedby="tag")
+        assert cache.hits == 1
+        r.extend(s.search(query.Term("text", u("bravo"))))
+        assert len(r.top_n) == 3
+        r.docs().add(100)
+        r.groups("tag")["zulu"] = [100]
+
+        r = s.search(q, groupedby="tag")
+        assert cache.hits == 2
+        assert sorted(hit["id"] for hit in r) == ["0", "3"]
+        assert r.docs() == set([0, 3])
+        assert sorted(r.groups("tag")) == ["alfa"]
+
+        r.filter(s.search(query.Term("id", u("0"))))
+        assert len(s.search(q, groupedby="tag").top_n) == 2
+
+
+def test_query_planner():
+    schema = fields.Schema(id=fields.STORED, text=fields.TEXT,
+                           num=fields.NUMERIC(stored=True))
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        for i in xrange(40):
+            words = u("alfa bravo") if i % 10 else u("alfa charlie")
+            w.add_document(id=i, text=words, num=i)
+
+    with ix.searcher() as s:
+        # Clauses are ordered from rarest to most frequent, and the wide
+        # constant-scoring range becomes a cached filter
+        nr = query.NumericRange("num", 0, 35)
+        q = query.And([nr, query.Term("text", u("alfa")),
+                       query.Term("text", u("charlie"))])
+        plan = s.explain_plan(q)
+        pq = plan.query
+        assert pq[0] == query.Term("text", u("charlie"))
+        assert pq[1] == query.CachedFilter(nr, 1.0)
+        assert pq[2] == query.Term("text", u("alfa"))
+        assert "CachedFilter" in plan.explain()
+
+        r = s.search(q)
+        assert r.q is q
+        assert sorted(hit["id"] for hit in r) == [0, 10, 20, 30]
+        unplanned = s.search(q, optimize=False)
+        assert ([(hit["id"], hit.score) for hit in r] ==
+                [(hit["id"], hit.score) for hit in unplanned])
+        # The filter's bit set is now cached on the searcher
+        assert len(s._filter_cache) == 1
+
+        # A scoring clause is only converted in an unscored search
+        q = query.And([query.Term("text", u("charlie")),
+                       query.Term("text", u("bravo")),
+                       query.Term("text", u("alfa"))])
+        plan = s.explain_plan(q)
+        assert not any(isinstance(sub, query.CachedFilter)
+                       for sub in plan.query)
+        plan = s.explain_plan(q, scored=False)
+        assert isinstance(plan.query[2], query.CachedFilter)
+
+        # A required clause that can't match makes the whole And empty
+        q = query.Or([query.Term("text", u("bravo")),
+                      query.And([query.Term("text", u("alfa")),
+                                 query.Term("text", u("zulu"))])])
+        plan = s.explain_plan(q)
+        assert plan.query[1] is query.NullQuery
+        assert len(s.search(q)) == 36
+
+        # Queries that aren't compound, and multi-term queries, aren't
+        # estimated, so planning doesn't expand them (or ignore maxterms)
+        def no_estimate(ixreader):
+            raise AssertionError("estimated %r" % (q,))
+        q = query.Prefix("text", u("a"))
+        q.estimate_size = no_estimate
+        assert s.explain_plan(q).query is q
+        q = query.And([query.Term("text", u("alfa")),
+                       query.Prefix("text", u("b"), maxterms=1)])
+        q[1].estimate_size = no_estimate
+        plan = s.explain_plan(q)
+        assert plan.query[1] == q[1]
+
+
+def test_filter_cache_size():
+    schema = fields.Schema(num=fields.NUMERIC)
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        for i in xrange(20):
+            w.add_document(num=i)
+
+    with ix.searcher(filtercachesize=2) as s:
+        for i in xrange(5):
+            q = query.CachedFilter(query.NumericRange("num", i, 19))
+            assert len(s.search(q)) == 20 - i
+            assert len(s._filter_cache) <= 2
+        # The most recently used filter is still cached
+        assert len(s.search(q)) == 16
+        assert s._filter_cache.hits == 1
+
+
+def test_query_planner_threads():
+    import sys
+    import threading
+
+    schema = fields.Schema(text=fields.TEXT)
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as w:
+        for i in xrange(40):
+            w.add_document(text=u("alfa bravo") if i % 10 else u("alfa"))
+
+    # One planner shared by searchers in several threads
+    planner = query.QueryPlanner()
+    q = query.And([query.Term("text", u("alfa")),
+                   query.Term("text", u("bravo"))])
+    with ix.searcher(planner=planner) as s:
+        target = s.explain_plan(q).query
+
+    errors = []
+
+    def run():
+        try:
+            with ix.searcher(planner=planner) as s:
+                for _ in xrange(200):
+                    assert s.explain_plan(q).query == target
+        except Exception:
+            errors.append(sys.exc_info()[1])
+
+    threads = [threading.Thread(target=run) for _ in xrange(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
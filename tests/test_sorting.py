@@ -2,6 +2,7 @@ from __future__ import with_statement
 from datetime import datetime, timedelta
 import random
 import gc
+from collections import defaultdict
 
 from whoosh import fields, query, sorting
 from whoosh.compat import b, u
@@ -991,3 +992,377 @@ def test_compound_sort():
             "bravo alfa juliet",
         ]
 
+
+
+def test_bounded_sort():
+    from whoosh import collectors
+
+    schema = fields.Schema(id=fields.STORED, kind=fields.ID,
+                           num=fields.NUMERIC(sortable=True),
+                           tag=fields.KEYWORD(sortable=True))
+    domain = list(range(1000))
+    random.shuffle(domain)
+    with TempIndex(schema) as ix:
+        # The second segment is indexed in increasing order, so a sort on the
+        # number can stop early
+        for segment in (domain[:600], sorted(domain[600:])):
+            with ix.writer() as w:
+                for i in segment:
+                    w.add_document(id=i, kind=u("even" if i % 2 else "odd"),
+                                   num=i % 300, tag=u("t%d") % (i % 7))
+
+        with ix.searcher() as s:
+            q = query.Term("kind", "even")
+
+            for sortedby in ("num", ["num", "tag"], ["tag", "num"]):
+                for reverse in (False, True):
+                    everything = s.search(q, sortedby=sortedby,
+                                          reverse=reverse, limit=None)
+                    target = [hit.docnum for hit in everything][:15]
+
+                    c = collectors.SortingCollector(sortedby, limit=15,
+                                                    reverse=reverse)
+                    s.search_with_collector(q, c)
+                    r = c.results()
+                    assert [hit.docnum for hit in r] == target
+                    assert len(r) == len(everything) == 500
+
+                    if sortedby == "num":
+                        # The bounds let the collector skip most blocks
+                        assert c.skipped_times or c.terminated_times
+
+            # The count of a filtered search that skipped blocks only
+            # includes documents that pass the filter and mask
+            fq = query.Term("tag", u("t3"))
+            for kwargs in ({"filter": fq}, {"mask": fq}):
+                everything = s.search(q, sortedby="num", limit=None, **kwargs)
+                r = s.search(q, sortedby="num", limit=5, **kwargs)
+                assert not r.has_exact_length()
+                assert len(r) == len(everything) < 500
+                assert r.docs() == everything.docs()
+
+            # With a facet collector, every document has to be seen
+            r = s.search(q, sortedby="num", limit=5, groupedby="tag")
+            assert sum(len(v) for v in r.groups("tag").values()) == 500
+
+
+def test_index_sort():
+    from whoosh import collectors
+
+    schema = fields.Schema(id=fields.STORED, kind=fields.ID(stored=True),
+                           num=fields.NUMERIC(sortable=True),
+                           name=fields.ID(sortable=True))
+    domain = list(range(200))
+    random.shuffle(domain)
+    with TempIndex(schema) as ix:
+        for segment in (domain[:120], domain[120:]):
+            with ix.writer(sortedby="num", reverse=True) as w:
+                w.merge = False
+                for i in segment:
+                    w.add_document(id=i, kind=u("even" if i % 2 else "odd"),
+                                   num=i % 50, name=u("n%03d") % i)
+
+        with ix.reader() as r:
+            assert len(r.leaf_readers()) == 2
+            for sr, _ in r.leaf_readers():
+                assert sr.segment().sort_order() == ("num", True)
+                nums = [sr.stored_fields(d)["id"] % 50
+                        for d in sr.all_doc_ids()]
+                assert nums == sorted(nums, reverse=True)
+            # The documents are still searchable through their terms
+            assert r.doc_frequency("kind", u("even")) == 100
+
+        with ix.searcher() as s:
+            q = query.Term("kind", "even")
+            everything = s.search(q, sortedby="num", reverse=True, limit=None)
+            target = [hit.docnum for hit in everything][:10]
+            c = collectors.SortingCollector("num", limit=10, reverse=True)
+            s.search_with_collector(q, c)
+            assert [hit.docnum for hit in c.results()] == target
+            # Both segments were cut short
+            assert c.terminated_times == 2
+
+            # A sort in the other direction can't stop early
+            everything = s.search(q, sortedby="num", limit=None)
+            r = s.search(q, sortedby="num", limit=10)
+            assert [h.docnum for h in r] == [h.docnum for h in everything][:10]
+
+        # Deleting a document and merging keeps the documents in order
+        with ix.writer(sortedby="num", reverse=True) as w:
+            w.delete_by_term("name", u("n%03d") % domain[0])
+            w.optimize = True
+        with ix.searcher() as s:
+            assert s.doc_count_all() == 199
+            assert s.reader().segment().sort_order() == ("num", True)
+            ids = [s.stored_fields(d)["id"] for d in xrange(199)]
+            assert [i % 50 for i in ids] == sorted([i % 50 for i in ids],
+                                                   reverse=True)
+            assert domain[0] not in ids
+            r = s.search(query.Term("name", u("n%03d") % domain[1]))
+            assert [h["id"] for h in r] == [domain[1]]
+
+        # A segment written without the index sort isn't marked
+        with ix.writer() as w:
+            w.add_document(id=500, kind=u("odd"), num=1, name=u("n500"))
+            w.merge = False
+        with ix.reader() as r:
+            orders = [sr.segment().sort_order() for sr, _ in r.leaf_readers()]
+            assert orders == [("num", True), None]
+
+
+def test_global_ordinals():
+    from whoosh import columns
+
+    schema = fields.Schema(id=fields.STORED,
+                           tag=fields.ID(sortable=columns.RefBytesColumn()),
+                           name=fields.ID(sortable=True))
+    tags = [u("delta"), u("alfa"), u("echo"), u("charlie"), u("bravo")]
+    with TempIndex(schema) as ix:
+        # Each segment sees the tags in a different order, so the segment
+        # ordinals don't agree with each other
+        for segment in ([0, 1, 2, 3], [4, 5, 6], [7, 8, 9, 10, 11]):
+            with ix.writer() as w:
+                w.merge = False
+                for i in segment:
+                    tag = tags[(i * 3 + len(segment)) % 5]
+                    if i == 8:
+                        w.add_document(id=i, name=u("n%02d") % i)
+                    else:
+                        w.add_document(id=i, tag=tag, name=u("n%02d") % i)
+
+        with ix.searcher() as s:
+            assert len(s.reader().leaf_readers()) == 3
+            values = {}
+            for docnum in xrange(s.doc_count_all()):
+                values[docnum] = s.reader().column_reader("tag")[docnum]
+
+            facet = sorting.FieldFacet("tag")
+            cat = facet.categorizer(s)
+            assert isinstance(cat, sorting.OrdinalCategorizer)
+            gords = sorting.GlobalOrdinals.for_searcher(s, "tag")
+            assert gords.values == [b("")] + sorted(t.encode("ascii")
+                                                    for t in tags)
+            # The global ordinals are only built once per searcher
+            assert sorting.GlobalOrdinals.for_searcher(s, "tag") is gords
+
+            for reverse in (False, True):
+                r = s.search(query.Every(), sortedby=sorting.FieldFacet(
+                    "tag", reverse=reverse), limit=None)
+                # Ties keep docnum order in both directions
+                target = sorted(values, key=lambda d: values[d],
+                                reverse=reverse)
+                assert [values[h.docnum] for h in r] == [values[d]
+                                                        for d in target]
+
+            r = s.search(query.Every(), groupedby="tag")
+            groups = r.groups("tag")
+            expected = defaultdict(list)
+            for docnum, v in values.items():
+                expected[v].append(docnum)
+            assert dict((k, sorted(v)) for k, v in groups.items()) == expected
+
+
+def test_dictionary_column_sort():
+    from whoosh import columns
+
+    schema = fields.Schema(id=fields.STORED,
+                           name=fields.ID(sortable=columns.DictionaryColumn()))
+    names = {}
+    with TempIndex(schema) as ix:
+        for segment in xrange(3):
+            with ix.writer() as w:
+                w.merge = False
+                for i in xrange(segment * 300, segment * 300 + 300):
+                    if i % 11:
+                        names[i] = u("%04d") % ((i * 7919) % 1000)
+                        w.add_document(id=i, name=names[i])
+                    else:
+                        names[i] = u("")
+                        w.add_document(id=i)
+
+        with ix.searcher() as s:
+            gords = sorting.GlobalOrdinals.for_searcher(s, "name")
+            assert gords.values == sorted(set(v.encode("ascii")
+                                              for v in names.values()))
+            for reverse in (False, True):
+                r = s.search(query.Every(), sortedby=sorting.FieldFacet(
+                    "name", reverse=reverse), limit=None)
+                ids = [hit["id"] for hit in r]
+                assert [names[i] for i in ids] == sorted(names.values(),
+                                                         reverse=reverse)
+
+
+def test_sorted_set_facets():
+    from whoosh import columns
+
+    schema = fields.Schema(id=fields.STORED, kind=fields.ID,
+                           tags=fields.KEYWORD(sortable=True))
+    assert isinstance(schema["tags"].column_type, columns.SortedSetColumn)
+    words = u("alfa bravo charlie delta echo foxtrot").split()
+    tags = {}
+    with TempIndex(schema) as ix:
+        for segment in xrange(3):
+            with ix.writer() as w:
+                w.merge = False
+                for i in xrange(segment * 40, segment * 40 + 40):
+                    ws = [words[(i * n) % (len(words) - segment)]
+                          for n in xrange(i % 4)]
+                    tags[i] = sorted(set(ws))
+                    w.add_document(id=i, kind=u("even" if i % 2 else "odd"),
+                                   tags=u(" ").join(ws))
+
+        with ix.searcher() as s:
+            for docnum in (0, 5, 47, 119):
+                i = s.stored_fields(docnum)["id"]
+                assert s.reader().column_reader("tags")[docnum] == tags[i]
+
+            q = query.Term("kind", u("even"))
+            facet = sorting.FieldFacet("tags", allow_overlap=True)
+            cat = facet.categorizer(s)
+            assert cat.bulk_counts
+
+            expected = defaultdict(int)
+            for i, ts in tags.items():
+                if i % 2:
+                    for t in ts:
+                        expected[t] += 1
+            r = s.search(q, groupedby=facet, maptype=sorting.Count)
+            assert r.groups() == expected
+
+            expected = defaultdict(list)
+            for i, ts in tags.items():
+                if i % 2:
+                    for t in ts:
+                        expected[t].append(i)
+            r = s.search(q, groupedby=facet)
+            groups = r.groups()
+            assert (dict((k, sorted(s.stored_fields(d)["id"] for d in v))
+                         for k, v in groups.items()) == expected)
+
+            # Without overlap, sorting and grouping use the lowest tag
+            r = s.search(query.Every(), sortedby="tags", limit=None)
+            assert ([(tags[hit["id"]] or [u("")])[0] for hit in r]
+                    == sorted((ts or [u("")])[0] for ts in tags.values()))
+
+
+def test_bulk_counts():
+    from whoosh import columns
+
+    schema = fields.Schema(id=fields.ID(stored=True), kind=fields.ID,
+                           tag=fields.ID(sortable=columns.RefBytesColumn()))
+    tags = [u("alfa"), u("bravo"), u("charlie"), u("delta")]
+    expected = defaultdict(int)
+    with TempIndex(schema) as ix:
+        for start in (0, 100, 250):
+            with ix.writer() as w:
+                w.merge = False
+                for i in xrange(start, start + 100 + start // 2):
+                    tag = tags[(i * 7) % (len(tags) + start // 100)
+                               % len(tags)]
+                    kind = u("even") if i % 2 else u("odd")
+                    w.add_document(id=u("%d") % i, kind=kind, tag=tag)
+                    if kind == "even" and i % 5:
+                        expected[tag] += 1
+        with ix.writer() as w:
+            w.merge = False
+            for i in xrange(0, 500, 5):
+                w.delete_by_term("id", u("%d") % i)
+
+        with ix.searcher() as s:
+            q = query.Term("kind", "even")
+            facet = sorting.FieldFacet("tag", maptype=sorting.Count)
+            r = s.search(q, groupedby=facet)
+            assert r.groups() == expected
+
+            # The bulk counts agree with grouping document by document
+            r = s.search(q, groupedby="tag")
+            assert dict((k, len(v)) for k, v in r.groups().items()) == expected
+
+
+def test_approximate_maps():
+    # Skewed group sizes: group i has 2000 // (i + 1) documents
+    names = []
+    for i in xrange(200):
+        names.extend([u("g%d") % i] * (2000 // (i + 1)))
+    random.Random(7).shuffle(names)
+
+    sc = sorting.SampledCount(500, seed=3)
+    dc = sorting.DistinctCount()
+    tc = sorting.TopCounts(k=5)
+    for docnum, name in enumerate(names):
+        for fmap in (sc, dc, tc):
+            fmap.add(name, docnum, None)
+
+    d = sc.as_dict()
+    assert abs(d["g0"] - 2000) < 500
+    assert abs(sum(d.values()) - len(names)) < len(names) * 0.05
+
+    assert abs(dc.count() - 200) <= 10
+    assert dc.as_dict() == {None: dc.count()}
+    big = sorting.DistinctCount()
+    for i in xrange(50000):
+        big.add(i, i, None)
+    assert abs(big.count() - 50000) < 50000 * 0.05
+    big.merge(dc)
+    assert big.count() >= 50000 * 0.95
+
+    d = tc.as_dict()
+    assert sorted(d) == ["g0", "g1", "g2", "g3", "g4"]
+    assert d["g0"] >= 2000
+
+
+def test_sketch_merge_across_processes():
+    import os.path
+    import subprocess
+    import sys
+    import whoosh
+
+    # Build the same sketch in processes with different string hash seeds
+    script = ("import binascii\n"
+              "from whoosh import sorting\n"
+              "dc = sorting.DistinctCount()\n"
+              "for i in range(1000):\n"
+              "    dc.add(u'name%d' % i, i, None)\n"
+              "print(binascii.hexlify(bytes(dc.registers)).decode('ascii'))\n")
+    srcdir = os.path.dirname(os.path.dirname(os.path.abspath(
+        whoosh.__file__)))
+    outputs = []
+    for seed in ("1", "2"):
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=srcdir)
+        out = subprocess.check_output([sys.executable, "-c", script],
+                                      env=env)
+        outputs.append(out.strip())
+    assert outputs[0] == outputs[1]
+
+    # A sketch built in another process merges with one built here
+    import binascii
+    other = sorting.DistinctCount()
+    other.registers = bytearray(binascii.unhexlify(outputs[0]))
+    dc = sorting.DistinctCount()
+    for i in xrange(500, 1500):
+        dc.add(u("name%d") % i, i, None)
+    dc.merge(other)
+    assert abs(dc.count() - 1500) < 1500 * 0.05
+
+
+def test_facet_budget():
+    from whoosh import collectors
+
+    schema = fields.Schema(tag=fields.ID(sortable=True), n=fields.NUMERIC)
+    with TempIndex(schema) as ix:
+        with ix.writer() as w:
+            for i in xrange(1000):
+                w.add_document(tag=u("t%d") % (i // 250), n=i)
+
+        with ix.searcher() as s:
+            fc = collectors.FacetCollector(
+                s.collector(limit=None), sorting.FieldFacet(
+                    "tag", maptype=sorting.Count), budget=100)
+            s.search_with_collector(query.Every(), fc)
+            r = fc.results()
+            # The child collector still saw every document
+            assert len(r) == 1000
+            assert fc.sampled == 100
+            assert fc.sample_rate == 0.1
+            assert r.groups() == {"t0": 25, "t1": 25, "t2": 25, "t3": 25}
+            assert isinstance(r.facet_map(), sorting.Count)
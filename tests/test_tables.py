@@ -2,11 +2,15 @@
 
 from __future__ import with_statement
 import random
+from bisect import bisect_left
+
+import pytest
 
 from whoosh.compat import b, xrange, iteritems
 from whoosh.filedb.filestore import RamStorage
 from whoosh.filedb.filetables import HashReader, HashWriter
 from whoosh.filedb.filetables import OrderedHashWriter, OrderedHashReader
+from whoosh.filedb.filetables import SortedBlockWriter, SortedBlockReader
 from whoosh.util.testing import TempStorage
 
 
@@ -147,6 +151,70 @@ def test_ordered_closest():
         hr.close()
 
 
+def test_ordered_closest_sampled():
+    keys = sorted(set(b("%06d") % random.randint(0, 999999)
+                      for _ in xrange(2000)))
+    st = RamStorage()
+    hw = OrderedHashWriter(st.create_file("test.hsh"))
+    hw.add_all((key, b("")) for key in keys)
+    hw.close()
+
+    for interval in (1, 5, 32, 5000):
+        hr = OrderedHashReader.open(st, "test.hsh")
+        hr.sampleinterval = interval
+        for _ in xrange(500):
+            target = b("%06d") % random.randint(0, 999999)
+            i = bisect_left(keys, target)
+            expected = keys[i] if i < len(keys) else None
+            assert hr.closest_key(target) == expected
+        for key in keys[::50]:
+            assert hr.closest_key(key) == key
+        assert hr.closest_key(b("")) == keys[0]
+        assert hr.closest_key(b("a")) is None
+        hr.close()
+
+
+def test_sorted_block():
+    # Keys with shared prefixes longer than the 255 bytes a block records
+    keys = sorted(set(b("%s%05d") % (b("x") * 300 if i % 3 else b("a"),
+                                      random.randint(0, 99999))
+                      for i in xrange(1000)))
+    values = [b(str(i)) for i in xrange(len(keys))]
+
+    st = RamStorage()
+    for blockkeys in (1, 7, 64):
+        sw = SortedBlockWriter(st.create_file("test"), blockkeys=blockkeys)
+        sw.extras["test"] = 100
+        sw.add_all(zip(keys, values))
+        with pytest.raises(ValueError):
+            sw.add(keys[0], b("x"))
+        sw.close()
+
+        sr = SortedBlockReader.open(st, "test")
+        assert sr.extras["test"] == 100
+        assert len(sr) == len(keys)
+        assert list(sr.keys()) == keys
+        assert list(sr.values()) == values
+        for key, value in zip(keys, values):
+            assert sr[key] == value
+            assert list(sr.all(key)) == [value]
+        assert b("b") not in sr
+        assert sr.get(b("b")) is None
+        assert sr.closest_key(b("")) == keys[0]
+        assert sr.closest_key(b("b")) == [k for k in keys if k > b("b")][0]
+        assert sr.closest_key(b("z")) is None
+        assert list(sr.items_from(keys[500])) == list(zip(keys, values))[500:]
+        sr.close()
+
+    # Empty file
+    SortedBlockWriter(st.create_file("empty")).close()
+    sr = SortedBlockReader.open(st, "empty")
+    assert list(sr.items()) == []
+    assert b("a") not in sr
+    assert sr.closest_key(b("a")) is None
+    sr.close()
+
+
 def test_extras():
     st = RamStorage()
     hw = HashWriter(st.create_file("test"))